@@ -0,0 +1,58 @@
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+from main import Main
+
+
+def run_quietly(main: Main) -> float:
+    """
+    run main without plots or console chatter and return the wall time
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main.run_sim(plot=False)
+    return time.perf_counter() - start
+
+
+def compare_to_reference(d_maker: str, num_chargers: int, num_buses: int, seeds=range(5)) -> dict:
+    """
+    run the same seeded scenarios with one second timesteps and with
+    adaptive steps, and report how far the adaptive results drift from
+    the reference. The delivery noise is drawn differently in the two
+    modes, so the error includes sampling noise as well as the effect
+    of holding each decision for a whole step.
+    """
+    cost_errors, soc_errors, peak_errors = [], [], []
+    reference_time, adaptive_time, steps = 0.0, 0.0, 0
+    for seed in seeds:
+        reference = Main(d_maker, num_chargers, num_buses, seed=seed)
+        adaptive = Main(d_maker, num_chargers, num_buses, seed=seed, adaptive=True)
+        reference_time += run_quietly(reference)
+        adaptive_time += run_quietly(adaptive)
+        steps += len(adaptive.time_points)
+
+        expected, actual = reference.summary(), adaptive.summary()
+        cost_errors.append(abs(actual["cost"] - expected["cost"]) / expected["cost"])
+        soc_errors.append(np.max(np.abs(np.subtract(actual["departure_soc"], expected["departure_soc"]))))
+        peak_errors.append(abs(actual["peak_kw"] - expected["peak_kw"]))
+
+    return {
+        "max relative cost error":         float(np.max(cost_errors)),
+        "max departure SOC error (%)":     float(np.max(soc_errors)),
+        "max peak power error (kW)":       float(np.max(peak_errors)),
+        "mean adaptive steps per run":     steps / len(cost_errors),
+        "speedup":                         reference_time / adaptive_time,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4:
+        report = compare_to_reference(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        report = compare_to_reference("naive", 4, 8)
+    for metric, value in report.items():
+        print(f"{metric}: {value:.4g}")
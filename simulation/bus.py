@@ -3,12 +3,14 @@ from datetime import datetime, timedelta
 import sys
 class Bus():
     
-    def __init__(self, bus_id, scheduledArrival: datetime, scheduledDeparture: datetime, battery_capacity: float, desired_soc: int):
-        self.arrival_time:        datetime      = self.__getTrueArrivalTime(scheduledArrival)
+    def __init__(self, bus_id, scheduledArrival: datetime, scheduledDeparture: datetime, battery_capacity: float, desired_soc: int,
+                 true_arrival=None, true_departure=None, initial_capacity=None):
+        # true times and initial capacity are drawn from the noise model unless given (frozen scenarios)
+        self.arrival_time:        datetime      = true_arrival if true_arrival is not None else self.__getTrueArrivalTime(scheduledArrival)
         self.id:                  int           = bus_id
-        self.departure_time:      datetime      = self.__getTrueDepartureTime(scheduledDeparture)
+        self.departure_time:      datetime      = true_departure if true_departure is not None else self.__getTrueDepartureTime(scheduledDeparture)
         self.battery_capacity:    float         = battery_capacity
-        self.__current_capacity:  float         = self.__init_curr_capacity()
+        self.__current_capacity:  float         = initial_capacity if initial_capacity is not None else self.__init_curr_capacity()
         self.desired_soc:         int           = desired_soc
         self.current_soc:         function      = lambda : ((self.__current_capacity / self.battery_capacity) * 100)
 
@@ -1,13 +1,13 @@
 
 from bus import Bus
 from connector import Connector
+from eventLog import DISABLED, INFO, WARNING, CONNECT, DEPARTURE, NOT_FOUND, REJECTED
 
-import sys
 from datetime import datetime, timedelta
 
 class Charger:
 
-    def __init__(self, charger_id, min_power, max_power, num_connectors, timestep_scale):
+    def __init__(self, charger_id, min_power, max_power, num_connectors, timestep_scale, cabinet_limit=None):
         self.connectors:  list[Connector] = self.__initialize_connectors(
                 min_power, 
                 max_power, 
@@ -15,8 +15,15 @@ class Charger:
                 timestep_scale
                 )
         self.charger_id:  str             = charger_id
-        self.meter_count: int             = 0
+        self.meter_count: float           = 0.0     # metered energy delivered through this charger (kWh)
+        self.meter_cost:  float           = 0.0     # metered cost of that energy
+        self.meter_peak:  float           = 0.0     # highest metered demand of the charger (kW over a demand interval)
         self.current_draw:float           = 0.0
+        self.cabinet_limit                = cabinet_limit   # power (kW) shared by all connectors, None if unshared
+        self.events                       = DISABLED        # EventLog connections are recorded to
+        self.listeners:   list            = []              # called with every connector a bus is plugged into or unplugged from
+        for connector in self.connectors:
+            connector.charger = self
 
     def connect_bus(self, bus: Bus, verbose=True) -> bool:
         """
@@ -29,11 +36,15 @@ class Charger:
                 continue
             else:
                 connector.connected_to = bus
+                for listener in self.listeners:
+                    listener(connector)
+                if self.events.info:
+                    self.events.emit(INFO, CONNECT, bus.id, self.charger_id, connector.connector_id, bus.current_soc())
                 return True
 
         # no connectors are available
-        if verbose:
-            print("error: This charger has no available connectors", file=sys.stderr)
+        if verbose and self.events.warn:
+            self.events.emit(WARNING, REJECTED, bus.id, self.charger_id)
         return False
     
     def disconnect_bus(self, bus: Bus, verbose=True) -> bool:
@@ -45,16 +56,29 @@ class Charger:
         for connector in self.connectors:
             if connector.connected_to == bus:
                 connector.connected_to = None
+                for listener in self.listeners:
+                    listener(connector)
+                if self.events.info:
+                    self.events.emit(INFO, DEPARTURE, bus.id, self.charger_id, connector.connector_id,
+                                     bus.current_soc(), bus.desired_soc)
                 return True
             else:
                 continue
 
         # Bus not on any connectors
-        if verbose:
-            print("error: Bus could not be found on any connectors", file=sys.stderr)
+        if verbose and self.events.warn:
+            self.events.emit(WARNING, NOT_FOUND, bus.id, self.charger_id)
         return False
 
-    def update_charge_rate(self, connector_id: int, rate: float) -> bool:
+    def cabinet_headroom(self, connector) -> float:
+        """
+        power the cabinet can still give connector with the other
+        connected buses charging at their current rates
+        """
+        used = sum(other.curr_power_delivery for other in self.connectors if other is not connector and other.active())
+        return self.cabinet_limit - used
+
+    def update_charge_rate(self, connector_id: int, rate: float, verbose=True) -> bool:
         """
         update rate of charge of a specific connector
         return true if connector_id valid and rate within bonuds of
@@ -65,7 +89,7 @@ class Charger:
             print(f"Error: connector requested out of range. Valid IDs in range (0-{len(self.connectors) - 1}) ")
             return False 
 
-        self.connectors[connector_id].update_charge_rate(rate)
+        self.connectors[connector_id].update_charge_rate(rate, verbose)
 
         # go through current charge rate of each connector to calculate the total power draw of the charger
         self.current_draw = 0.0
@@ -91,6 +115,8 @@ class Charger:
         Charger ID: {self.charger_id}
         Charger Connectors: {self.connectors}
         Meter Count: {self.meter_count}
+        Meter Cost: {self.meter_cost}
+        Meter Peak: {self.meter_peak}
         Current Draw: {self.current_draw}
         """
         print(charger_metrics)
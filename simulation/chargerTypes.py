@@ -0,0 +1,187 @@
+"""
+Charger type specs and vectorized connector constraints for mixed depots.
+
+A ChargerType describes one kind of charger: how many connectors it has,
+the power bounds of each connector and, for dispensers fed from one
+cabinet, the power all of its connectors share. ConnectorArrays flattens
+every connector of a depot into numpy arrays so a whole vector of
+requested rates can be clamped to connector bounds and projected onto
+the cabinet limits in a handful of array operations, with the number of
+clamped requests counted instead of a warning printed per connector.
+"""
+
+import numpy as np
+
+
+class ChargerType:
+
+    def __init__(self, name, min_power, max_power, num_connectors=1, cabinet_limit=None):
+        self.name:           str   = name
+        self.min_power:      float = min_power        # per connector (kW)
+        self.max_power:      float = max_power        # per connector (kW)
+        self.num_connectors: int   = num_connectors
+        self.cabinet_limit         = cabinet_limit    # shared by all connectors (kW), None if unshared
+
+    def __repr__(self):
+        return f"ChargerType({self.name!r})"
+
+
+PLUG_IN_60    = ChargerType("plug-in 60 kW", 0, 60)
+DISPENSER_150 = ChargerType("dispenser 150 kW", 0, 150, num_connectors=2, cabinet_limit=150)
+PANTOGRAPH    = ChargerType("pantograph 450 kW", 0, 450)
+
+
+def mixed_depot(counts) -> list[ChargerType]:
+    """
+    list with one charger type per charger from {charger type: count}
+    """
+    return [charger_type for charger_type, count in counts.items() for _ in range(count)]
+
+
+class ConnectorArrays:
+
+    def __init__(self, chargers):
+        self.chargers                   = chargers
+        self.connectors                 = [connector for charger in chargers for connector in charger.connectors]
+        for index, connector in enumerate(self.connectors):
+            connector.log_index = index
+        self.charger_index: np.ndarray  = np.repeat(np.arange(len(chargers)), [len(charger.connectors) for charger in chargers])
+        self.min_power:     np.ndarray  = np.array([connector.min_power_out for connector in self.connectors], dtype=float)
+        self.max_power:     np.ndarray  = np.array([connector.max_power_out for connector in self.connectors], dtype=float)
+        self.cabinet_limit: np.ndarray  = np.array([np.inf if charger.cabinet_limit is None else charger.cabinet_limit
+                                                    for charger in chargers], dtype=float)
+        self.shared                     = bool(np.isfinite(self.cabinet_limit).any())
+        self.clamped:       int         = 0     # requests changed by project so far
+
+    def set_cabinet_limits(self, limits) -> None:
+        """
+        change the cabinet limit (kW, inf for none) of every charger
+        """
+        self.cabinet_limit = np.asarray(limits, dtype=float)
+        self.shared = bool(np.isfinite(self.cabinet_limit).any())
+        for charger, limit in zip(self.chargers, self.cabinet_limit.tolist()):
+            charger.cabinet_limit = limit if np.isfinite(limit) else None
+
+    def guaranteed_power(self) -> np.ndarray:
+        """
+        (connectors,) kW every connector can hold with all the connectors
+        of its cabinet charging at once
+        """
+        per_charger = np.bincount(self.charger_index, minlength=len(self.chargers))
+        return np.minimum(self.max_power, self.cabinet_limit[self.charger_index] / per_charger[self.charger_index])
+
+    def site_capacity(self) -> float:
+        """
+        kW the depot draws with every connector at full power, within its
+        cabinet limits
+        """
+        return float(np.minimum(np.bincount(self.charger_index, self.max_power, minlength=len(self.chargers)),
+                                self.cabinet_limit).sum())
+
+    def active(self) -> np.ndarray:
+        """
+        mask of connectors with a bus connected
+        """
+        return np.fromiter((connector.connected_to is not None for connector in self.connectors),
+                           dtype=bool, count=len(self.connectors))
+
+    def bus_ids(self) -> np.ndarray:
+        """
+        id of the bus on every connector, -1 where none is connected
+        """
+        return np.fromiter((-1 if connector.connected_to is None else connector.connected_to.id
+                            for connector in self.connectors), dtype=int, count=len(self.connectors))
+
+    def draw(self) -> float:
+        """
+        kW the connected connectors deliver, however their rates were set
+        """
+        return sum(connector.curr_power_delivery for connector in self.connectors if connector.connected_to is not None)
+
+    def project(self, requested, active=None) -> np.ndarray:
+        """
+        nearest feasible rates (kW) to requested: clamped to each
+        connector's bounds, then the part above the minimum scaled down
+        on every cabinet that would exceed its limit. Inactive connectors
+        get 0.
+        """
+        if active is None:
+            active = self.active()
+        requested = np.asarray(requested, dtype=float)
+        floor = np.where(active, self.min_power, 0.0)
+        rates = np.where(active, np.clip(requested, self.min_power, self.max_power), 0.0)
+        if self.shared:
+            num_chargers = len(self.chargers)
+            load = np.bincount(self.charger_index, rates, minlength=num_chargers)
+            over = load > self.cabinet_limit
+            if over.any():
+                base = np.bincount(self.charger_index, floor, minlength=num_chargers)
+                flexible = load - base
+                scale = np.ones(num_chargers)
+                scale[over] = np.clip(np.divide(self.cabinet_limit[over] - base[over], flexible[over],
+                                                out=np.zeros(np.count_nonzero(over)), where=flexible[over] > 0), 0, 1)
+                rates = floor + (rates - floor) * scale[self.charger_index]
+        self.clamped += int(np.count_nonzero(active & (rates != requested)))
+        return rates
+
+    def apply(self, requested, active=None) -> np.ndarray:
+        """
+        project requested and set the result on every connected connector
+        and the draw of every charger
+        """
+        if active is None:
+            active = self.active()
+        rates = self.project(requested, active)
+        requests = np.broadcast_to(np.asarray(requested, dtype=float), rates.shape).tolist()
+        for connector, rate, request in zip(self.connectors, rates.tolist(), requests):
+            if connector.connected_to is not None:
+                connector.requested_power = request
+                connector.curr_power_delivery = rate
+                if connector.decision_log is not None:
+                    connector.decision_log.record(connector)
+        draw = np.bincount(self.charger_index, rates, minlength=len(self.chargers))
+        for charger, total in zip(self.chargers, draw.tolist()):
+            charger.current_draw = total
+        return rates
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    from datetime import datetime
+    from simspace import SimState
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+
+    # projection on a mixed depot against setting connectors one at a time
+    print(f"{'chargers':>8} {'connectors':>10} {'scalar ms':>10} {'vector ms':>10} {'clamped':>8}")
+    for scale in (1, 10, 100):
+        types = mixed_depot({PLUG_IN_60: 8 * scale, DISPENSER_150: 6 * scale, PANTOGRAPH: 2 * scale})
+        np.random.seed(0)
+        sim_state = SimState(start_time, end_time, num_buses=26 * scale, charger_types=types, compact=True)
+        for bus in sim_state.buses:
+            for charger in sim_state.chargers:
+                if charger.connect_bus(bus, verbose=False):
+                    break
+        arrays = sim_state.connector_arrays
+        requested = np.random.uniform(0, 500, len(arrays.connectors))
+
+        begin = time.perf_counter()
+        with contextlib.redirect_stderr(io.StringIO()):
+            position = 0
+            for charger in sim_state.chargers:
+                for connector in charger.connectors:
+                    charger.update_charge_rate(connector.connector_id, requested[position])
+                    position += 1
+        scalar = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        arrays.apply(requested)
+        vector = time.perf_counter() - begin
+        print(f"{len(sim_state.chargers):>8} {len(arrays.connectors):>10} {scalar * 1e3:>10.2f} "
+              f"{vector * 1e3:>10.2f} {arrays.clamped:>8}")
+
+        draw = np.array([charger.current_draw for charger in sim_state.chargers])
+        assert (draw <= arrays.cabinet_limit + 1e-9).all()
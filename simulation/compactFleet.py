@@ -0,0 +1,281 @@
+"""
+Slotted, allocation-light versions of Bus, Connector and Charger for
+large fleet stress scenarios. They keep the public API of the original
+classes (and draw random numbers in the same order, so a seeded run
+produces the same fleet) but store their attributes in __slots__
+instead of a per-instance __dict__.
+"""
+
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Optional
+
+from eventLog import DISABLED, INFO, WARNING, CONNECT, DEPARTURE, INACTIVE_RATE, NOT_FOUND, RATE_CLAMPED, REJECTED
+
+
+class CompactBus:
+    __slots__ = ("arrival_time", "id", "departure_time", "battery_capacity", "current_capacity", "desired_soc")
+
+    def __init__(self, bus_id, scheduledArrival: datetime, scheduledDeparture: datetime, battery_capacity: float, desired_soc: int,
+                 true_arrival=None, true_departure=None, initial_capacity=None):
+        self.arrival_time:     datetime = true_arrival if true_arrival is not None else \
+            scheduledArrival + timedelta(minutes=abs(int(np.random.normal(0, 10))))
+        self.id:               int      = bus_id
+        self.departure_time:   datetime = true_departure if true_departure is not None else \
+            scheduledDeparture + timedelta(minutes=abs(int(np.random.normal(0, 10))))
+        self.battery_capacity: float    = battery_capacity
+        self.current_capacity: float    = initial_capacity if initial_capacity is not None else np.random.normal(150, 10)
+        self.desired_soc:      int      = desired_soc
+
+    def current_soc(self) -> float:
+        return (self.current_capacity / self.battery_capacity) * 100
+
+    def get_current_capacity(self):
+        return self.current_capacity
+
+    def charge(self, amount: float) -> bool:
+        """
+        add a certain amount of power to the bus in Kw/h
+        return True if battery can accept charge
+        return False if amount added exceeds amount available
+        """
+        if (amount + self.current_capacity) < self.battery_capacity:
+            self.current_capacity += amount
+            return True
+        self.current_capacity = self.battery_capacity
+        return False
+
+    def print_metrics(self) -> None:
+        bus_stats = f"""
+        arrival time: {self.arrival_time}
+        departure time: {self.departure_time}
+        battery capacity: {self.battery_capacity}
+        current capacity: {self.current_capacity}
+        desired SOC: {self.desired_soc}
+        current SOC: {self.current_soc()}
+        """
+        print(bus_stats)
+
+
+class CompactConnector:
+    __slots__ = ("connected_to", "connector_id", "min_power_out", "max_power_out",
+                 "curr_power_delivery", "timestep_scale", "charger", "analytic",
+                 "meter", "meter_energy", "meter_cost", "meter_peak", "log_index", "decision_log",
+                 "events", "requested_power", "rng")
+
+    def __init__(self, connector_id, min_power, max_power, timestep_scale, charger=None) -> None:
+        self.connected_to:        Optional[CompactBus]     = None
+        self.connector_id:        int                      = connector_id
+        self.min_power_out:       float                    = min_power
+        self.max_power_out:       float                    = max_power
+        self.curr_power_delivery: float                    = max_power
+        self.requested_power:     float                    = max_power
+        self.rng                                           = None   # delivery noise generator, None for np.random
+        self.timestep_scale:      int                      = timestep_scale
+        self.charger:             Optional["CompactCharger"] = charger   # charger whose meter this connector feeds
+        self.analytic:            bool                     = False
+        self.meter                                         = None
+        self.meter_energy:        float                    = 0.0
+        self.meter_cost:          float                    = 0.0
+        self.meter_peak:          float                    = 0.0
+        self.log_index:           int                      = 0
+        self.decision_log                                  = None
+        self.events                                        = DISABLED
+
+    def active(self) -> bool:
+        return self.connected_to is not None
+
+    def connect(self, bus) -> bool:
+        if self.connected_to is not None:
+            return False
+        self.connected_to = bus
+        return True
+
+    def disconnect(self) -> bool:
+        if self.connected_to is None:
+            return False
+        self.connected_to = None
+        return True
+
+    def update_charge_rate(self, rate: float, verbose=True) -> bool:
+        """
+        Change rate of charge on connector, clamping it to the power
+        bounds of the connector and its cabinet. return False if no bus
+        connected.
+        """
+        if self.connected_to is None:
+            if verbose and self.events.warn:
+                self.events.emit(WARNING, INACTIVE_RATE, -1, self.charger.charger_id, self.connector_id, rate)
+            return False
+        self.requested_power = rate
+        max_power = self.max_power_out
+        if self.charger is not None and self.charger.cabinet_limit is not None:
+            max_power = max(self.min_power_out, min(max_power, self.charger.cabinet_headroom(self)))
+        requested = rate
+        if rate < self.min_power_out:
+            rate = self.min_power_out
+        elif rate > max_power:
+            rate = max_power
+        if rate != requested and verbose and self.events.warn:
+            self.events.emit(WARNING, RATE_CLAMPED, self.connected_to.id, self.charger.charger_id, self.connector_id,
+                             requested, rate)
+        self.curr_power_delivery = rate
+        if self.decision_log is not None:
+            self.decision_log.record(self)
+        return True
+
+    def deliver_power(self, timesteps: int) -> float:
+        """
+        simulate delivering power to the bus over n timesteps
+        return the amount of power delivered to the bus.
+        """
+        bus = self.connected_to
+        if bus is None:
+            return 0.0
+        power_per_timestep = (self.curr_power_delivery / 3600) * self.timestep_scale
+        normal = self.rng.normal if self.rng is not None else np.random.normal
+        # meter what the battery took: a full battery refuses the rest
+        capacity_before = bus.current_capacity
+        if self.analytic:
+            energy = power_per_timestep * timesteps + normal(0, 0.01 * np.sqrt(timesteps))
+            bus.charge(min(energy, bus.battery_capacity - bus.current_capacity))
+        else:
+            # one draw for the whole call instead of one per timestep
+            noise = normal(0, 0.01, timesteps)
+            for random_val in noise.tolist():
+                bus.charge(power_per_timestep + random_val)
+        power_delivered = bus.current_capacity - capacity_before
+        if self.meter is not None:
+            self.meter.record(self, power_delivered, timesteps * self.timestep_scale)
+        elif self.charger is not None:
+            self.charger.meter_count += power_delivered
+        return power_delivered
+
+    def seconds_until_full(self) -> float:
+        bus = self.connected_to
+        if bus is None or self.curr_power_delivery <= 0:
+            return float("inf")
+        return (bus.battery_capacity - bus.current_capacity) * 3600 / self.curr_power_delivery
+
+    def print_metrics(self) -> None:
+        charger_stats = f"""
+        Connector ID: {self.connector_id}
+        Connected to: {self.connected_to}
+        Minimum Power Delivery: {self.min_power_out}
+        Maximum Power Delivery: {self.max_power_out}
+        Current Power Delivery: {self.curr_power_delivery}
+        Timestep scale (seconds): {self.timestep_scale}
+        """
+        print(charger_stats)
+
+
+class CompactCharger:
+    __slots__ = ("connectors", "charger_id", "meter_count", "meter_cost", "meter_peak", "current_draw",
+                 "cabinet_limit", "events", "listeners")
+
+    def __init__(self, charger_id, min_power, max_power, num_connectors, timestep_scale, cabinet_limit=None):
+        self.connectors:   list[CompactConnector] = [
+            CompactConnector(i, min_power, max_power, timestep_scale, self) for i in range(num_connectors)
+        ]
+        self.charger_id:   str   = charger_id
+        self.meter_count:  float = 0.0    # energy delivered through this charger (kWh)
+        self.meter_cost:   float = 0.0
+        self.meter_peak:   float = 0.0
+        self.current_draw: float = 0.0
+        self.cabinet_limit         = cabinet_limit
+        self.events                = DISABLED
+        self.listeners: list       = []
+
+    def connect_bus(self, bus, verbose=True) -> bool:
+        for connector in self.connectors:
+            if connector.connected_to is None:
+                connector.connected_to = bus
+                for listener in self.listeners:
+                    listener(connector)
+                if self.events.info:
+                    self.events.emit(INFO, CONNECT, bus.id, self.charger_id, connector.connector_id, bus.current_soc())
+                return True
+        if verbose and self.events.warn:
+            self.events.emit(WARNING, REJECTED, bus.id, self.charger_id)
+        return False
+
+    def disconnect_bus(self, bus, verbose=True) -> bool:
+        for connector in self.connectors:
+            if connector.connected_to is bus:
+                connector.connected_to = None
+                for listener in self.listeners:
+                    listener(connector)
+                if self.events.info:
+                    self.events.emit(INFO, DEPARTURE, bus.id, self.charger_id, connector.connector_id,
+                                     bus.current_soc(), bus.desired_soc)
+                return True
+        if verbose and self.events.warn:
+            self.events.emit(WARNING, NOT_FOUND, bus.id, self.charger_id)
+        return False
+
+    def cabinet_headroom(self, connector) -> float:
+        used = sum(other.curr_power_delivery for other in self.connectors
+                   if other is not connector and other.connected_to is not None)
+        return self.cabinet_limit - used
+
+    def update_charge_rate(self, connector_id: int, rate: float, verbose=True) -> bool:
+        if len(self.connectors) - 1 < connector_id or connector_id < 0:
+            print(f"Error: connector requested out of range. Valid IDs in range (0-{len(self.connectors) - 1}) ")
+            return False
+        self.connectors[connector_id].update_charge_rate(rate, verbose)
+        self.current_draw = sum(connector.curr_power_delivery for connector in self.connectors)
+        return True
+
+    def print_metrics(self):
+        charger_metrics = f"""
+        Charger ID: {self.charger_id}
+        Charger Connectors: {self.connectors}
+        Meter Count: {self.meter_count}
+        Current Draw: {self.current_draw}
+        """
+        print(charger_metrics)
+        for connector in self.connectors:
+            connector.print_metrics()
+            if connector.active():
+                connector.connected_to.print_metrics()
+
+
+def fleet_memory(bus_class, charger_class, num_buses, num_connectors=2):
+    """
+    measure the bytes allocated per bus for a fleet of num_buses with one
+    connector per bus, including the chargers holding those connectors
+    """
+    import tracemalloc
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T05:00:00')
+    np.random.seed(0)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    buses = [bus_class(i, start_time, end_time, 588, 90) for i in range(num_buses)]
+    chargers = [charger_class(i, 0, 120, num_connectors, 1) for i in range(num_buses // num_connectors)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / num_buses, buses, chargers
+
+
+if __name__ == "__main__":
+    import time
+    from bus import Bus
+    from charger import Charger
+
+    num_buses = 10000
+    for name, bus_class, charger_class in (("original", Bus, Charger), ("compact", CompactBus, CompactCharger)):
+        bytes_per_bus, buses, chargers = fleet_memory(bus_class, charger_class, num_buses)
+        connectors = [connector for charger in chargers for connector in charger.connectors]
+        for bus, connector in zip(buses, connectors):
+            connector.connect(bus)
+            connector.update_charge_rate(60)
+
+        start = time.perf_counter()
+        for _ in range(10):
+            for connector in connectors:
+                connector.deliver_power(1)
+            socs = [bus.current_soc() for bus in buses]
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {bytes_per_bus:7.0f} bytes/bus, {elapsed / 10 * 1e3:7.1f} ms per tick for {num_buses} buses")
@@ -1,8 +1,8 @@
 from bus import Bus
+from eventLog import DISABLED, WARNING, RATE_CLAMPED, INACTIVE_RATE
 from typing import Optional
 
 import numpy as np
-import sys
 from datetime import datetime, timedelta
 
 class Connector:
@@ -13,7 +13,21 @@ class Connector:
         self.min_power_out:       float          = min_power        # minimum power which charger can deliver (Kw/H)
         self.max_power_out:       float          = max_power        # maximum power which charger can deliver (Kw/H)
         self.curr_power_delivery: float          = max_power        # current desired charge rate (Kw/H)
+        self.requested_power:     float          = max_power        # rate last asked for, before clamping (kW)
+        self.rng                                 = None             # delivery noise generator, None for np.random
         self.timestep_scale:      int            = timestep_scale   # number of seconds each timestep represents
+        self.analytic:            bool           = False            # integrate multi-timestep deliveries in closed form
+        self.charger                             = None             # charger this connector belongs to
+        self.meter                               = None             # DepotMeter every delivery is reported to
+        self.meter_energy:        float          = 0.0              # metered energy delivered (kWh)
+        self.meter_cost:          float          = 0.0              # metered cost of that energy
+        self.meter_peak:          float          = 0.0              # highest metered demand (kW over a demand interval)
+        self.log_index:           int            = 0                # position of the connector in the depot
+        self.decision_log                        = None             # DecisionLog rate changes are recorded to
+        self.events                              = DISABLED         # EventLog warnings are recorded to
+
+    def __charger_id(self):
+        return self.charger.charger_id if self.charger is not None else -1
 
     def active(self) -> bool:
         return self.connected_to != None
@@ -44,27 +58,33 @@ class Connector:
             return False
 
 
-    def update_charge_rate(self, rate: float) -> bool:
+    def update_charge_rate(self, rate: float, verbose=True) -> bool:
         """
         Change rate of charge on connector. return true
         if bus connected and charge rate updated.
         return False if no bus connected.
 
-        If requested rate is out of bounds, raise a
-        warning that desired rate is out of bounds, and
-        print the rate actually set
+        If requested rate is out of bounds (including what is
+        left of a shared cabinet's limit), clamp it and, when
+        verbose, log the requested and the set rate
         """
         if not self.active():
-            print("Warning: Attempted to update the charge rate on an inactive connector", file=sys.stderr)
+            if verbose and self.events.warn:
+                self.events.emit(WARNING, INACTIVE_RATE, -1, self.__charger_id(), self.connector_id, rate)
             return False
-        if self.min_power_out <= rate <= self.max_power_out:
+        self.requested_power = rate
+        max_power = self.max_power_out
+        if self.charger is not None and self.charger.cabinet_limit is not None:
+            max_power = max(self.min_power_out, min(max_power, self.charger.cabinet_headroom(self)))
+        if self.min_power_out <= rate <= max_power:
             self.curr_power_delivery = rate
-        elif self.min_power_out > rate:
-            print(f"Warning: proposed charge rate ({rate}) is below minimum ({self.min_power_out}). setting charge rate to {self.min_power_out}", file=sys.stderr)
-            self.curr_power_delivery = self.min_power_out
-        elif self.max_power_out < rate:
-            print(f"Warning: proposed charge rate ({rate}) is above maximum ({self.max_power_out}). setting charge rate to {self.max_power_out}", file=sys.stderr)
-            self.curr_power_delivery = self.max_power_out
+        else:
+            self.curr_power_delivery = self.min_power_out if rate < self.min_power_out else max_power
+            if verbose and self.events.warn:
+                self.events.emit(WARNING, RATE_CLAMPED, self.connected_to.id, self.__charger_id(), self.connector_id,
+                                 rate, self.curr_power_delivery)
+        if self.decision_log is not None:
+            self.decision_log.record(self)
         return True
 
     def deliver_power(self, timesteps: int) -> float:
@@ -79,13 +99,44 @@ class Connector:
         # calculate power delivered per timestep
         power_per_timestep = (self.curr_power_delivery / 3600 ) * self.timestep_scale
 
-        for _ in range(timesteps):
-            # add randomness to power delivery to emulate real charger behavior
-            random_val = np.random.normal(0, 0.01)
-            power_for_timestep = (power_per_timestep) + random_val
-            self.connected_to.charge(power_for_timestep)
-            power_delivered += power_for_timestep
+        normal = self.rng.normal if self.rng is not None else np.random.normal
+        # meter what the battery took: a full battery refuses the rest
+        capacity_before = self.connected_to.get_current_capacity()
+        if self.analytic:
+            self.__deliver_analytic(power_per_timestep, timesteps, normal)
+        else:
+            for _ in range(timesteps):
+                # add randomness to power delivery to emulate real charger behavior
+                random_val = normal(0, 0.01)
+                power_for_timestep = (power_per_timestep) + random_val
+                self.connected_to.charge(power_for_timestep)
+        power_delivered = self.connected_to.get_current_capacity() - capacity_before
+
+        if self.meter is not None:
+            self.meter.record(self, power_delivered, timesteps * self.timestep_scale)
         return power_delivered
+
+    def __deliver_analytic(self, power_per_timestep: float, timesteps: int, normal) -> None:
+        """
+        closed form equivalent of delivering power_per_timestep for n
+        timesteps: the per-timestep noise terms sum to a single normal
+        draw with a sqrt(n) wider spread, and delivery stops once the
+        battery is full
+        """
+        bus = self.connected_to
+        energy = power_per_timestep * timesteps + normal(0, 0.01 * np.sqrt(timesteps))
+        bus.charge(min(energy, bus.battery_capacity - bus.get_current_capacity()))
+
+    def seconds_until_full(self) -> float:
+        """
+        seconds until the connected bus reaches full capacity at the
+        current charge rate (infinite if idle or nothing connected)
+        """
+        if not self.active() or self.curr_power_delivery <= 0:
+            return float("inf")
+        remaining = self.connected_to.battery_capacity - self.connected_to.get_current_capacity()
+        return remaining * 3600 / self.curr_power_delivery
+
     def print_metrics(self) -> None:
         charger_stats = f"""
         Connector ID: {self.connector_id}
@@ -94,6 +145,8 @@ class Connector:
         Maximum Power Delivery: {self.max_power_out}
         Current Power Delivery: {self.curr_power_delivery}
         Timestep scale (seconds): {self.timestep_scale}
+        Metered energy (kWh): {self.meter_energy}
+        Metered cost: {self.meter_cost}
         """
         print(charger_stats)
    
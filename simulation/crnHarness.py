@@ -0,0 +1,191 @@
+"""
+Common random numbers comparison of decision makers.
+
+Every scenario is drawn once from its own seed and frozen: the true
+arrival and departure times and starting capacity of every bus, and one
+delivery noise generator per connector. Every decision maker then runs
+against each identical scenario (in parallel), so the difference between
+two decision makers on a scenario only comes from their decisions. Their
+costs on a scenario are strongly correlated, and the paired differences
+have a far smaller variance than the difference of independent runs,
+which is what sets how many scenarios a significant result needs.
+"""
+
+import contextlib
+import io
+import itertools
+import math
+import multiprocessing
+import sys
+import time
+from datetime import timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+from main import Main
+
+
+METRICS = ("cost", "energy_kwh", "peak_kw", "shortfall_soc")
+
+
+class FrozenScenario:
+    """
+    the noise of one night, drawn the way Bus and Connector draw it but
+    from the scenario's own generators
+    """
+
+    def __init__(self, num_buses: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.seed:             int        = seed
+        self.num_buses:        int        = num_buses
+        self.arrival_delay:    np.ndarray = np.abs(rng.normal(0, 10, num_buses).astype(int))     # minutes late
+        self.departure_delay:  np.ndarray = np.abs(rng.normal(0, 10, num_buses).astype(int))     # minutes late
+        self.initial_capacity: np.ndarray = rng.normal(150, 10, num_buses)                       # kWh on arrival
+
+    def bus_kwargs(self, bus_id, scheduled_arrival, scheduled_departure) -> dict:
+        """
+        keyword arguments that fix a Bus to this scenario
+        """
+        return {
+            "true_arrival":     scheduled_arrival + timedelta(minutes=int(self.arrival_delay[bus_id])),
+            "true_departure":   scheduled_departure + timedelta(minutes=int(self.departure_delay[bus_id])),
+            "initial_capacity": float(self.initial_capacity[bus_id]),
+        }
+
+    def connector_rng(self, index) -> np.random.Generator:
+        """
+        delivery noise of the connector at position index in the depot,
+        the same stream whichever decision maker drives it
+        """
+        return np.random.default_rng((self.seed, index))
+
+
+def t_critical(df, confidence=0.95) -> float:
+    """
+    two sided Student t critical value (Cornish-Fisher expansion around
+    the normal quantile, within 1% for df >= 3)
+    """
+    if df < 1:
+        raise ValueError(f"A t critical value needs at least 1 degree of freedom, got {df}")
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    if df == math.inf:
+        return z
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def _run_scenario(task) -> tuple:
+    """
+    worker: one decision maker on one frozen scenario
+    """
+    d_maker, scenario, config = task
+    begin = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        # the global seed only drives the decision maker's own randomness now
+        main = Main(d_maker, num_buses=scenario.num_buses, seed=scenario.seed, scenario=scenario,
+                    event_level="off", **config)
+        main.run_sim(plot=False)
+    summary = main.summary()
+    shortfall = [max(0.0, bus.desired_soc - soc) for bus, soc in zip(main.sim_state.buses, summary["departure_soc"])]
+    metrics = [summary["cost"], summary["energy_kwh"], summary["peak_kw"], float(np.mean(shortfall))]
+    return d_maker, scenario.seed, metrics, time.perf_counter() - begin
+
+
+class CRNComparison:
+
+    def __init__(self, d_makers: list[str], num_scenarios: int, num_buses: int, baseline=None,
+                 first_seed=0, processes=None, **config):
+        if num_scenarios < 2:
+            raise ValueError(f"Paired differences need at least 2 scenarios, got {num_scenarios}")
+        self.d_makers:  list[str] = d_makers
+        self.baseline:  str       = baseline if baseline is not None else d_makers[0]
+        self.scenarios: list      = [FrozenScenario(num_buses, seed) for seed in range(first_seed, first_seed + num_scenarios)]
+        self.processes            = processes
+        self.config:    dict      = config      # other Main keyword arguments, the same for every run
+        # decision maker -> (scenarios, metrics)
+        self.results:   dict      = {d_maker: np.full((num_scenarios, len(METRICS)), np.nan) for d_maker in d_makers}
+        self.run_seconds: float   = 0.0         # summed over runs
+        self.wall_seconds: float  = 0.0
+
+    def run(self) -> dict:
+        begin = time.perf_counter()
+        row = {scenario.seed: i for i, scenario in enumerate(self.scenarios)}
+        tasks = [(d_maker, scenario, self.config) for scenario, d_maker in itertools.product(self.scenarios, self.d_makers)]
+        if self.processes == 1:
+            self.__collect(map(_run_scenario, tasks), row)
+        else:
+            with multiprocessing.Pool(self.processes) as pool:
+                self.__collect(pool.imap_unordered(_run_scenario, tasks), row)
+        self.wall_seconds = time.perf_counter() - begin
+        return self.results
+
+    def __collect(self, outcomes, row) -> None:
+        for d_maker, seed, metrics, seconds in outcomes:
+            self.results[d_maker][row[seed]] = metrics
+            self.run_seconds += seconds
+
+    def paired(self, metric="cost", confidence=0.95) -> list[dict]:
+        """
+        difference of every decision maker from the baseline on each
+        scenario: mean, confidence interval, variance reduction over
+        independent runs and the scenarios either design needs for the
+        interval to exclude zero
+        """
+        column = METRICS.index(metric)
+        base = self.results[self.baseline][:, column]
+        n = len(base)
+        t = t_critical(n - 1, confidence)
+        z = t_critical(math.inf, confidence)
+        rows = []
+        for d_maker in self.d_makers:
+            if d_maker == self.baseline:
+                continue
+            values = self.results[d_maker][:, column]
+            differences = values - base
+            mean = float(differences.mean())
+            paired_var = float(differences.var(ddof=1))
+            independent_var = float(values.var(ddof=1) + base.var(ddof=1))
+            half_width = t * math.sqrt(paired_var / n)
+
+            def needed(variance):
+                # identical differences on every scenario: the sign is settled by 2
+                if variance == 0:
+                    return math.inf if mean == 0 else 2
+                return math.inf if mean == 0 else max(2, math.ceil(z ** 2 * variance / mean ** 2))
+
+            rows.append({
+                "d_maker":            d_maker,
+                "mean":               mean,
+                "low":                mean - half_width,
+                "high":               mean + half_width,
+                "significant":        abs(mean) > half_width,
+                "variance_reduction": independent_var / paired_var if paired_var > 0 else
+                                      (1.0 if independent_var == 0 else math.inf),
+                "paired_needed":      needed(paired_var),
+                "independent_needed": needed(independent_var),
+            })
+        return rows
+
+    def print_metrics(self, metric="cost", confidence=0.95):
+        lines = "".join(f"""
+        {row['d_maker']} - {self.baseline}: {row['mean']:+.3f} [{row['low']:+.3f}, {row['high']:+.3f}]"""
+                        f"""{' *' if row['significant'] else ''}, variance reduction x{row['variance_reduction']:.1f}, """
+                        f"""scenarios needed {row['paired_needed']} paired vs {row['independent_needed']} independent"""
+                        for row in self.paired(metric, confidence))
+        metrics = f"""
+        scenarios: {len(self.scenarios)}, decision makers: {len(self.d_makers)}
+        wall time (s): {self.wall_seconds:.2f} ({self.run_seconds:.2f} s of runs)
+        {metric} means: {", ".join(f"{d}: {np.mean(self.results[d][:, METRICS.index(metric)]):.3f}" for d in self.d_makers)}
+        paired {metric} differences ({confidence:.0%} CI):{lines}
+        """
+        print(metrics)
+
+
+if __name__ == "__main__":
+    num_scenarios = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    comparison = CRNComparison(["naive", "llf", "hierarchical"], num_scenarios, num_buses=16,
+                               num_chargers=8, adaptive=True)
+    comparison.run()
+    for metric in ("cost", "shortfall_soc"):
+        comparison.print_metrics(metric)
@@ -0,0 +1,253 @@
+"""
+Binary decision logs and replay.
+
+A DecisionLog attached to a SimState is handed every charge rate a
+connector accepts at the update_charge_rate boundary and keeps the ones
+that change the connector's rate as (tick, connector, rate) records,
+where tick is seconds since the start of the schedule and connector the
+connector's position in the depot. In adaptive runs it also keeps the
+tick every step of the recording started at. Logs save to a flat binary
+file of packed 12 byte records followed by the 4 byte step ticks.
+
+ReplayDM feeds a log back into a SimState: it only sets the logged rates
+at their ticks and delivers power, so a plan from the GA or a policy can
+be re-scored under other noise seeds or tariffs without planning again.
+An adaptive replay steps on the recorded step boundaries, so delivery is
+split into the same closed-form steps; on the recording's FrozenScenario
+(crnHarness.py) it then reproduces the recorded run. With global numpy
+noise it does not when the recorder drew random numbers itself, as the
+GA does.
+"""
+
+from array import array
+from bisect import bisect_right
+from datetime import timedelta
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from decisionMaker import DecisionMaker
+from reporting import padded_matrix
+
+
+ENTRY = np.dtype([("tick", "<u4"), ("connector", "<u4"), ("rate", "<f4")])
+MAGIC = b"BUSDLOG2"
+HEADER = np.dtype([("num_connectors", "<u4"), ("num_entries", "<u8"), ("num_steps", "<u8")])
+# logs written before step boundaries were kept
+MAGIC_V1 = b"BUSDLOG1"
+HEADER_V1 = np.dtype([("num_connectors", "<u4"), ("num_entries", "<u8")])
+
+
+class DecisionLog:
+
+    def __init__(self, num_connectors=0):
+        self.num_connectors: int   = num_connectors
+        self.ticks:          array = array("I")
+        self.connectors:     array = array("I")
+        self.rates:          array = array("f")
+        self.steps:          array = array("I")     # tick every adaptive step started at
+        self.last_rate:      list  = []     # rate of every connector as of the last record
+        self.state                 = None
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def attach(self, sim_state) -> "DecisionLog":
+        """
+        record the rate changes of every connector of sim_state from now on
+        """
+        self.state = sim_state
+        connectors = sim_state.connector_arrays.connectors
+        self.num_connectors = len(connectors)
+        self.last_rate = [connector.curr_power_delivery for connector in connectors]
+        for connector in connectors:
+            connector.decision_log = self
+        sim_state.decision_log = self
+        return self
+
+    def record(self, connector) -> None:
+        rate = connector.curr_power_delivery
+        index = connector.log_index
+        if rate == self.last_rate[index]:
+            return
+        self.last_rate[index] = rate
+        self.ticks.append(int((self.state.current_time - self.state.start_schedule).total_seconds()))
+        self.connectors.append(index)
+        self.rates.append(rate)
+
+    def record_step(self) -> None:
+        """
+        note that an adaptive step starts now
+        """
+        self.steps.append(int((self.state.current_time - self.state.start_schedule).total_seconds()))
+
+    def entries(self) -> np.ndarray:
+        """
+        structured array of every record in tick order
+        """
+        entries = np.empty(len(self), dtype=ENTRY)
+        entries["tick"] = np.frombuffer(self.ticks, dtype=np.uint32)
+        entries["connector"] = np.frombuffer(self.connectors, dtype=np.uint32)
+        entries["rate"] = np.frombuffer(self.rates, dtype=np.float32)
+        return entries
+
+    def save(self, path) -> None:
+        header = np.array([(self.num_connectors, len(self), len(self.steps))], dtype=HEADER)
+        with open(path, "wb") as log_file:
+            log_file.write(MAGIC)
+            log_file.write(header.tobytes())
+            log_file.write(self.entries().tobytes())
+            log_file.write(np.frombuffer(self.steps, dtype=np.uint32).astype("<u4").tobytes())
+
+    @classmethod
+    def load(cls, path) -> "DecisionLog":
+        with open(path, "rb") as log_file:
+            magic = log_file.read(len(MAGIC))
+            if magic not in (MAGIC, MAGIC_V1):
+                raise ValueError(f"{path} is not a decision log")
+            header_type = HEADER if magic == MAGIC else HEADER_V1
+            header = np.frombuffer(log_file.read(header_type.itemsize), dtype=header_type)[0]
+            entries = np.frombuffer(log_file.read(int(header["num_entries"]) * ENTRY.itemsize), dtype=ENTRY)
+            steps = np.frombuffer(log_file.read(), dtype="<u4")
+        num_steps = int(header["num_steps"]) if magic == MAGIC else 0
+        if len(entries) != header["num_entries"] or len(steps) != num_steps:
+            raise ValueError(f"{path} is truncated: {len(entries)} of {header['num_entries']} records, "
+                             f"{len(steps)} of {num_steps} steps")
+        log = cls(int(header["num_connectors"]))
+        log.steps.frombytes(steps.astype(np.uint32).tobytes())
+        log.ticks.frombytes(np.ascontiguousarray(entries["tick"]).tobytes())
+        log.connectors.frombytes(np.ascontiguousarray(entries["connector"]).tobytes())
+        log.rates.frombytes(np.ascontiguousarray(entries["rate"]).tobytes())
+        return log
+
+    def print_metrics(self):
+        metrics = f"""
+        connectors: {self.num_connectors}
+        records: {len(self)}
+        steps: {len(self.steps)}
+        bytes: {len(MAGIC) + HEADER.itemsize + len(self) * ENTRY.itemsize + len(self.steps) * 4}
+        """
+        print(metrics)
+
+
+class ReplayDM(DecisionMaker):
+
+    def __init__(self, sim_state, log: DecisionLog):
+        super().__init__(sim_state)
+        self.connectors = self.state.connector_arrays.connectors
+        if log.num_connectors != len(self.connectors):
+            raise ValueError(f"Log was recorded on {log.num_connectors} connectors, the depot has {len(self.connectors)}")
+        self.ticks       = log.ticks.tolist()
+        self.entry_index = log.connectors.tolist()
+        self.rates       = log.rates.tolist()
+        self.steps       = log.steps.tolist()    # recorded step boundaries, empty for fixed-step recordings
+        self.position    = 0        # next record to apply
+        self.cost        = 0.0
+        self.charge_rate_runs = [[] for _ in self.state.buses]   # run-length encoded [rate, timesteps] per bus
+
+    @property
+    def charge_rate(self) -> list[list[float]]:
+        return [[rate for rate, count in runs for _ in range(count)] for runs in self.charge_rate_runs]
+
+    def __elapsed(self) -> int:
+        return int((self.state.current_time - self.state.start_schedule).total_seconds())
+
+    def __apply_due(self) -> None:
+        """
+        set every logged rate whose tick has come
+        """
+        elapsed = self.__elapsed()
+        while self.position < len(self.ticks) and self.ticks[self.position] <= elapsed:
+            connector = self.connectors[self.entry_index[self.position]]
+            rate = self.rates[self.position]
+            # a connector with no bus (other noise) holds the rate until one arrives
+            if not connector.update_charge_rate(rate, verbose=False):
+                connector.curr_power_delivery = rate
+            self.position += 1
+
+    def update_chargers(self, timesteps) -> None:
+        """
+        apply every record up to now, then deliver power over timesteps
+        """
+        self.__apply_due()
+        curr_power_price = self.state.price_schedule.get_current_price(self.state.current_time)
+        for connector in self.connectors:
+            bus = connector.connected_to
+            if bus is None:
+                continue
+            runs = self.charge_rate_runs[bus.id]
+            if runs and runs[-1][0] == connector.curr_power_delivery:
+                runs[-1][1] += timesteps
+            else:
+                runs.append([connector.curr_power_delivery, timesteps])
+            self.cost += curr_power_price * connector.deliver_power(timesteps)
+
+    def next_decision_time(self):
+        """
+        the next recorded step boundary, or for logs without them the
+        tick of the next record not yet due
+        """
+        # adaptive stepping sizes the step from the rates, so set them first
+        self.__apply_due()
+        if self.steps:
+            ticks, lo = self.steps, 0
+        else:
+            ticks, lo = self.ticks, self.position
+        upcoming = bisect_right(ticks, self.__elapsed(), lo=lo)
+        if upcoming == len(ticks):
+            return self.state.end_schedule
+        return self.state.start_schedule + timedelta(seconds=ticks[upcoming])
+
+    def print_metrics(self):
+        metrics = f"""
+        records applied: {self.position} of {len(self.ticks)}
+        cost: {self.cost}
+        """
+        print(metrics)
+
+    def plot_bus_charge_rates(self):
+        for i, row in enumerate(self.charge_rate):
+            plt.plot(row, label=f"bus {i}")
+        plt.xlabel("timestep of charge session")
+        plt.ylabel("power to deliver (kW)")
+        plt.legend()
+        plt.grid(True)
+        plt.show()
+
+    def plot_total_charge_rate(self):
+        plt.plot(padded_matrix(self.charge_rate).sum(axis=0))
+        plt.xlabel("timestep of charge session")
+        plt.ylabel("total power delivered (kW)")
+        plt.grid(True)
+        plt.show()
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import time
+    from main import Main
+
+    from crnHarness import FrozenScenario
+
+    def run(seed, **kwargs):
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            # a frozen scenario keeps delivery noise apart from the GA's draws
+            main = Main(num_chargers=8, num_buses=16, adaptive=True, seed=seed, scenario=FrozenScenario(16, seed), **kwargs)
+            main.run_sim(plot=False)
+        return main, time.perf_counter() - begin
+
+    path = os.path.join(tempfile.mkdtemp(), "rule-based.dlog")
+    recorded, seconds = run(d_maker="rule-based", seed=0, record_decisions=True)
+    recorded.decision_log.save(path)
+    print(f"recorded plan: ${recorded.summary()['cost']:.2f} in {seconds:.2f} s, "
+          f"{len(recorded.decision_log)} records, {os.path.getsize(path)} bytes")
+
+    tariff = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariffs", "weekday_tou.json")
+    for seed, tariff_path in ((0, None), (1, None), (2, None), (0, tariff)):
+        replay, seconds = run(d_maker="replay", seed=seed, replay_path=path, tariff_path=tariff_path)
+        label = f"seed {seed}" + (", weekday tariff" if tariff_path else "")
+        print(f"replay {label:>24}: ${replay.summary()['cost']:.2f} in {seconds:.2f} s")
@@ -1,4 +1,5 @@
 from simspace import SimState
+from datetime import datetime, timedelta
 
 class DecisionMaker:
 
@@ -15,5 +16,13 @@ class DecisionMaker:
         """
         pass
 
+    def next_decision_time(self) -> datetime:
+        """
+        earliest time at which the decision maker may want to change a
+        charge rate. Adaptive stepping never steps past it; the default
+        is to decide on every timestep.
+        """
+        return self.state.current_time + timedelta(seconds=self.state.price_schedule.timestep_duration)
+
     def print_metrics(self):
         pass
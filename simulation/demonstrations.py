@@ -0,0 +1,134 @@
+"""
+Offline demonstration datasets for warm starting the RL decision maker.
+
+NaiveDM and rtsoDM are run over many seeded scenarios in parallel and
+their hourly charging decisions are recorded as (observation, action)
+pairs in the same form BusDepotEnv uses: the normalized observation at
+the start of each hour and each bus's mean charge rate over that hour as
+a fraction of the connector's maximum power. behavior_clone then fits
+the PPO MlpPolicy to those pairs before model.learn fine tunes it.
+"""
+
+import contextlib
+import io
+from multiprocessing import Pool
+
+import numpy as np
+
+from fleetKernels import FleetArrays, observation_kernel
+
+
+class DemonstrationRecorder:
+    """
+    Main.run_sim step callback collecting hourly observations and
+    time-averaged actions of whichever decision maker is running
+    """
+
+    def __init__(self, main):
+        state = main.sim_state
+        self.fleet        = FleetArrays(state)
+        self.num_hours    = state.price_schedule.num_timesteps * state.price_schedule.timestep_duration // 3600
+        self.max_power    = state.max_power
+        self.observations = np.zeros((self.num_hours, len(state.buses) * 2 + 2), dtype=np.float32)
+        self.actions      = np.zeros((self.num_hours, len(state.buses)), dtype=np.float32)
+
+    def __call__(self, main):
+        state = main.sim_state
+        elapsed = int((state.current_time - state.start_schedule).total_seconds())
+        if elapsed % 3600 == 0 and elapsed // 3600 < self.num_hours:
+            self.observations[elapsed // 3600] = observation_kernel(self.fleet)
+        if elapsed == 0:
+            return
+
+        # the rates in force now were applied over the timestep that just ended
+        hour = (elapsed - 1) // 3600
+        if hour >= self.num_hours:
+            return
+        timestep_fraction = state.price_schedule.timestep_duration / 3600
+        for charger in state.chargers:
+            for connector in charger.connectors:
+                if connector.connected_to is not None:
+                    self.actions[hour, connector.connected_to.id] += \
+                        connector.curr_power_delivery / self.max_power * timestep_fraction
+
+
+def record_demonstration(d_maker: str, num_chargers: int, num_buses: int, seed: int):
+    """
+    run one seeded scenario with d_maker and return its hourly
+    observations and actions
+    """
+    from main import Main
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main = Main(d_maker, num_chargers, num_buses, seed=seed)
+        recorder = DemonstrationRecorder(main)
+        main.run_sim(plot=False, on_step=recorder)
+    return recorder.observations, np.clip(recorder.actions, 0, 1)
+
+
+def _record(args):
+    return record_demonstration(*args)
+
+
+def generate_dataset(num_chargers: int, num_buses: int, seeds, d_makers=("naive", "rule-based"), processes=None):
+    """
+    record every decision maker in d_makers on every seed in parallel
+    and stack the results into observation and action arrays
+    """
+    jobs = [(d_maker, num_chargers, num_buses, seed) for d_maker in d_makers for seed in seeds]
+    with Pool(processes) as pool:
+        results = pool.map(_record, jobs)
+    observations = np.concatenate([observations for observations, _ in results])
+    actions = np.concatenate([actions for _, actions in results])
+    return observations, actions
+
+
+def save_dataset(path, observations, actions):
+    np.savez_compressed(path, observations=observations, actions=actions)
+
+
+def load_dataset(path):
+    with np.load(path) as dataset:
+        return dataset["observations"], dataset["actions"]
+
+
+def behavior_clone(model, observations, actions, epochs=50, batch_size=64, learning_rate=1e-3) -> list[float]:
+    """
+    fit the mean action of model's policy to the demonstrated actions by
+    minimizing squared error, leaving the policy's log std (and so its
+    exploration during fine tuning) untouched. Returns the mean loss of
+    each epoch.
+    """
+    import torch
+
+    policy = model.policy
+    policy.set_training_mode(True)
+    parameters = [p for name, p in policy.named_parameters() if name != "log_std" and not name.startswith("value")]
+    optimizer = torch.optim.Adam(parameters, lr=learning_rate)
+    observations = torch.as_tensor(observations, device=policy.device)
+    actions = torch.as_tensor(actions, device=policy.device)
+
+    losses = []
+    for _ in range(epochs):
+        order = torch.randperm(len(observations), device=policy.device)
+        epoch_loss = 0.0
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            predicted = policy.get_distribution(observations[batch]).distribution.mean
+            loss = torch.nn.functional.mse_loss(predicted, actions[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(batch)
+        losses.append(epoch_loss / len(order))
+    policy.set_training_mode(False)
+    return losses
+
+
+if __name__ == "__main__":
+    import time
+
+    begin = time.perf_counter()
+    observations, actions = generate_dataset(num_chargers=8, num_buses=16, seeds=range(8))
+    print(f"recorded {len(observations)} (observation, action) pairs in {time.perf_counter() - begin:.1f}s")
+    save_dataset("demonstrations.npz", observations, actions)
@@ -0,0 +1,173 @@
+"""
+Structured, buffered event log.
+
+Arrivals, connections, rejected connections, clamped charge rates and
+departures are kept as typed records (time, level, kind, bus, charger,
+connector, value, extra) in a fixed size ring buffer. When the buffer is
+full, or on flush, the batch is written in one go: as CSV rows to a file
+tools can read back, or as one line per record to a stream. Call sites
+test a level flag (events.info, events.warn, ...) before building a
+record, so a level that is off costs one attribute lookup.
+"""
+
+import csv
+import math
+import os
+import sys
+
+DEBUG   = 10
+INFO    = 20
+WARNING = 30
+ERROR   = 40
+OFF     = 100
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error", OFF: "off"}
+
+# event kinds and what value / extra hold for each
+ARRIVAL       = "arrival"         # value: SOC on arrival
+CONNECT       = "connect"         # value: SOC when plugged in
+REJECTED      = "rejected"        # no free connector (charger -1: on any charger)
+RATE_CLAMPED  = "rate_clamped"    # value: requested kW, extra: kW set
+INACTIVE_RATE = "inactive_rate"   # value: requested kW on a connector with no bus
+DEPARTURE     = "departure"       # value: final SOC, extra: desired SOC
+NOT_FOUND     = "not_found"       # bus to disconnect is not on the charger
+
+FIELDS = ("time", "level", "kind", "bus", "charger", "connector", "value", "extra")
+
+
+def parse_level(level) -> int:
+    if isinstance(level, str):
+        names = {name: number for number, name in LEVEL_NAMES.items()}
+        if level.lower() not in names:
+            raise ValueError(f"Event level {level} is not one of {', '.join(names)}")
+        return names[level.lower()]
+    return int(level)
+
+
+class EventLog:
+
+    def __init__(self, sim_state=None, level=WARNING, path=None, capacity=4096, stream=None):
+        self.state                = sim_state     # events are timed in seconds since its start
+        self.path                 = path          # CSV file flushed batches are appended to, after any earlier runs
+        self.stream               = stream if stream is not None else sys.stderr
+        self.capacity:  int       = capacity
+        self.buffer:    list      = [None] * capacity
+        self.size:      int       = 0
+        self.emitted:   int       = 0
+        self.flushes:   int       = 0
+        self.counts:    dict      = {}            # kind -> records emitted
+        self.__header_written     = False
+        self.set_level(level)
+
+    def set_level(self, level) -> None:
+        self.level: int = parse_level(level)
+        self.debug: bool = self.level <= DEBUG
+        self.info:  bool = self.level <= INFO
+        self.warn:  bool = self.level <= WARNING
+        self.error: bool = self.level <= ERROR
+
+    def __now(self) -> float:
+        if self.state is None:
+            return math.nan
+        return (self.state.current_time - self.state.start_schedule).total_seconds()
+
+    def emit(self, level, kind, bus=-1, charger=-1, connector=-1, value=math.nan, extra=math.nan) -> None:
+        """
+        buffer one record; callers check the level flag first
+        """
+        if level < self.level:
+            return
+        self.buffer[self.size] = (self.__now(), level, kind, bus, charger, connector, value, extra)
+        self.size += 1
+        self.emitted += 1
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.size == self.capacity:
+            self.flush()
+
+    def records(self) -> list[tuple]:
+        """
+        records buffered and not flushed yet
+        """
+        return self.buffer[:self.size]
+
+    def flush(self) -> None:
+        """
+        write the buffered records in one batch
+        """
+        if self.size == 0:
+            return
+        batch = self.buffer[:self.size]
+        if self.path is not None:
+            if not self.__header_written:
+                # another run may have started the file already
+                self.__header_written = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            with open(self.path, "a", newline="") as log_file:
+                writer = csv.writer(log_file)
+                if not self.__header_written:
+                    writer.writerow(FIELDS)
+                    self.__header_written = True
+                writer.writerows((time, LEVEL_NAMES.get(level, level), *rest) for time, level, *rest in batch)
+        else:
+            self.stream.write("".join(self.__line(record) for record in batch))
+            self.stream.flush()
+        self.size = 0
+        self.flushes += 1
+
+    def __line(self, record) -> str:
+        time, level, kind, bus, charger, connector, value, extra = record
+        line = f"[{time:>7.0f}s] {LEVEL_NAMES.get(level, level)}: {kind} bus={bus} charger={charger} connector={connector}"
+        if not math.isnan(value):
+            line += f" value={value:.4g}"
+        if not math.isnan(extra):
+            line += f" extra={extra:.4g}"
+        return line + "\n"
+
+    def print_metrics(self):
+        metrics = f"""
+        level: {LEVEL_NAMES.get(self.level, self.level)}
+        events emitted: {self.emitted}
+        batches flushed: {self.flushes}
+        by kind: {self.counts}
+        """
+        print(metrics)
+
+
+# connectors and chargers built outside a SimState log to this
+DISABLED = EventLog(level=OFF)
+
+
+def read_events(path) -> list[dict]:
+    """
+    records of an event log file with numeric fields parsed
+    """
+    with open(path, newline="") as log_file:
+        events = list(csv.DictReader(log_file))
+    for event in events:
+        for field in ("time", "value", "extra"):
+            event[field] = float(event[field])
+        for field in ("bus", "charger", "connector"):
+            event[field] = int(event[field])
+    return events
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import time
+    from main import Main
+
+    log_dir = tempfile.mkdtemp()
+    print(f"{'level':>8} {'seconds':>8}")
+    for level in ("off", "warning", "info", "debug"):
+        path = os.path.join(log_dir, f"{level}.csv")
+        stdout = io.StringIO()
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(stdout):
+            main = Main("naive", 32, 64, seed=0, event_level=level, event_path=path)
+            main.run_sim(plot=False)
+        seconds = time.perf_counter() - begin
+        print(f"{level:>8} {seconds:>8.2f}  {main.sim_state.events.emitted} events, {len(stdout.getvalue())} bytes printed")
+
+    departures = [event for event in read_events(os.path.join(log_dir, "info.csv")) if event["kind"] == DEPARTURE]
+    print(f"{len(departures)} departures logged, lowest final SOC {min(event['value'] for event in departures):.1f}%")
@@ -0,0 +1,136 @@
+"""
+Array-native observation and reward kernels for BusDepotEnv.
+
+Per-bus quantities that never change during an episode (departure time,
+battery capacity, desired SOC) are gathered into arrays once per reset,
+so each step only reads the current battery capacities and does the
+rest of the work in numpy.
+"""
+
+import numpy as np
+
+
+class FleetArrays:
+    """
+    static per-bus arrays of a SimState, rebuilt whenever the
+    simulation is reset and its buses are replaced
+    """
+
+    def __init__(self, sim_state):
+        self.state = sim_state
+        self.rebuild()
+
+    def rebuild(self):
+        state = self.state
+        self.buses = state.buses
+        self.departure_seconds = np.array(
+            [(bus.departure_time - state.start_schedule).total_seconds() for bus in self.buses]
+        )
+        self.battery_capacity  = np.array([bus.battery_capacity for bus in self.buses], dtype=float)
+        self.desired_soc       = np.array([bus.desired_soc for bus in self.buses], dtype=float)
+        self.horizon_seconds   = (state.end_schedule - state.start_schedule).total_seconds()
+        self.max_grid_pull     = state.connector_arrays.site_capacity()
+        self.max_price         = max(state.price_schedule.tariff_index.rates.max(), state.price_schedule.on_peak_rate)
+
+    def sync(self):
+        """
+        rebuild the arrays if the simulation was reset since the last step
+        """
+        if self.buses is not self.state.buses:
+            self.rebuild()
+
+    def current_capacity(self) -> np.ndarray:
+        return np.fromiter((bus.get_current_capacity() for bus in self.buses), dtype=float, count=len(self.buses))
+
+    def seconds_to_departure(self) -> np.ndarray:
+        elapsed = (self.state.current_time - self.state.start_schedule).total_seconds()
+        return self.departure_seconds - elapsed
+
+
+def observation_kernel(fleet: FleetArrays) -> np.ndarray:
+    """
+    SOC, time to departure, grid pull and energy price, each scaled into
+    the [0, 1] observation space declared by BusDepotEnv
+    """
+    fleet.sync()
+    num_buses = len(fleet.buses)
+    grid_pull, energy_price = fleet.state.get_current_meterics()
+
+    observation = np.empty(num_buses * 2 + 2, dtype=np.float32)
+    observation[:num_buses] = fleet.current_capacity() / fleet.battery_capacity
+    observation[num_buses:2 * num_buses] = fleet.seconds_to_departure() / fleet.horizon_seconds
+    observation[-2] = grid_pull / fleet.max_grid_pull
+    observation[-1] = energy_price / fleet.max_price
+    return np.clip(observation, 0, 1, out=observation)
+
+
+def reward_kernel(fleet: FleetArrays) -> float:
+    """
+    vectorized form of the BusDepotEnv reward: unmet SOC, energy cost and
+    distance of the grid pull from the naive (evenly spread) pull
+    """
+    fleet.sync()
+    num_buses = len(fleet.buses)
+    current_capacity = fleet.current_capacity()
+    soc = current_capacity / fleet.battery_capacity * 100
+    unmet_soc_penalty = np.maximum(0, fleet.desired_soc - soc).sum() / num_buses
+
+    hours_to_departure = np.maximum(0, fleet.seconds_to_departure() // 3600)
+    departing = hours_to_departure != 0
+    ideal_grid_pull = np.sum(
+        (fleet.battery_capacity[departing] - current_capacity[departing]) // hours_to_departure[departing]
+    )
+
+    grid_pull, energy_price = fleet.state.get_current_meterics()
+    rate_penalty = np.abs(ideal_grid_pull - grid_pull) / num_buses
+    energy_cost = grid_pull * energy_price
+    return float(- unmet_soc_penalty - (energy_cost / 10) - rate_penalty)
+
+
+if __name__ == "__main__":
+    import time
+    from datetime import datetime, timedelta
+    from simspace import SimState
+
+    def list_observation(sim_state):
+        # list based observation BusDepotEnv used before the kernels
+        socs = [bus.current_soc() for bus in sim_state.buses]
+        departures = [int((bus.departure_time - sim_state.current_time).total_seconds() // 60) for bus in sim_state.buses]
+        grid_pull, energy_price = sim_state.get_current_meterics()
+        return np.array(socs + departures + [grid_pull, energy_price], dtype=np.float32)
+
+    def list_reward(sim_state):
+        # list based reward BusDepotEnv used before the kernels
+        unmet_soc_penalty = sum(max(0, bus.desired_soc - bus.current_soc()) for bus in sim_state.buses) / len(sim_state.buses)
+        ideal_grid_pull = 0
+        for bus in sim_state.buses:
+            time_to_departure = max(0, int((bus.departure_time - sim_state.current_time).total_seconds() // 3600))
+            if time_to_departure != 0:
+                ideal_grid_pull += (bus.battery_capacity - bus.get_current_capacity()) // time_to_departure
+        grid_pull, energy_price = sim_state.get_current_meterics()
+        return - unmet_soc_penalty - (grid_pull * energy_price / 10) - np.abs(ideal_grid_pull - grid_pull) / len(sim_state.buses)
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+    repeats = 50
+    print(f"{'buses':>6} {'list us/step':>13} {'kernel us/step':>15} {'list ns/bus':>12} {'kernel ns/bus':>14}")
+    for num_buses in (16, 128, 1024, 8192):
+        sim_state = SimState(start_time, end_time, num_chargers=num_buses // 2, num_buses=num_buses)
+        sim_state.current_time += timedelta(hours=2)
+        fleet = FleetArrays(sim_state)
+        assert np.isclose(reward_kernel(fleet), list_reward(sim_state))
+
+        begin = time.perf_counter()
+        for _ in range(repeats):
+            list_observation(sim_state)
+            list_reward(sim_state)
+        list_step = (time.perf_counter() - begin) / repeats
+
+        begin = time.perf_counter()
+        for _ in range(repeats):
+            observation_kernel(fleet)
+            reward_kernel(fleet)
+        kernel_step = (time.perf_counter() - begin) / repeats
+
+        print(f"{num_buses:>6} {list_step * 1e6:>13.0f} {kernel_step * 1e6:>15.0f} "
+              f"{list_step / num_buses * 1e9:>12.0f} {kernel_step / num_buses * 1e9:>14.0f}")
@@ -0,0 +1,283 @@
+"""
+Aggregate-then-disaggregate planning for very large depots.
+
+Buses are grouped into classes that share an availability window (the
+slots between their arrival and departure), an energy need bin and a
+connector limit. The
+aggregate problem has one variable per (class, slot) and is solved with
+an earliest-deadline-first greedy: classes that must leave first take
+the cheapest slots of their window, up to their members' connector
+limits and whatever site capacity is left. A bus's connector limit is
+the power of the connector it is expected to be plugged into (the first
+free one when it arrives, as SimState connects it), within that
+connector's share of a shared cabinet. Each class's plan is then
+split across its buses slot by slot, either in proportion to their
+remaining needs (a bus held at its connector limit passes the rest on
+to its classmates) or by earliest departure. The number of classes depends on how spread out the
+schedule is, not on the number of buses, so planning time stays nearly
+flat as the fleet grows.
+"""
+
+import heapq
+import time
+from datetime import timedelta
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from decisionMaker import DecisionMaker
+
+
+class HierarchicalDM(DecisionMaker):
+
+    def __init__(self, sim_state, slot_minutes=15, energy_bins=4, disaggregation="proportional", grid_limit=None):
+        super().__init__(sim_state)
+        if 3600 % (slot_minutes * 60) != 0:
+            raise ValueError(f"slot_minutes must divide an hour, got {slot_minutes}")
+        if disaggregation not in ("proportional", "edf"):
+            raise ValueError(f"Disaggregation rule {disaggregation} is not 'proportional' or 'edf'")
+        self.slot_seconds       = slot_minutes * 60
+        self.time_slot_duration = slot_minutes / 60   # hours
+        self.num_buses          = len(self.state.buses)
+        self.num_time_slots     = int((self.state.end_schedule - self.state.start_schedule).total_seconds()) // self.slot_seconds
+        self.energy_bins        = energy_bins
+        self.disaggregation     = disaggregation
+        # site limit (kW), by default every connector at full power within its cabinet
+        self.grid_limit         = grid_limit if grid_limit is not None else self.state.connector_arrays.site_capacity()
+        self.electricity_prices = np.asarray(self.state.price_schedule.slot_prices(self.slot_seconds))
+        self.cost               = 0.0
+
+        begin = time.perf_counter()
+        self.__get_bus_arrays()
+        self.__group_classes()
+        self.class_energy       = self.__solve_aggregate()    # (classes, slots) kWh
+        self.charge_rate        = self.__disaggregate() / self.time_slot_duration
+        self.plan_seconds       = time.perf_counter() - begin
+
+    def __get_bus_arrays(self) -> None:
+        """
+        first and last available slot and energy need (kWh) of every bus.
+        A bus is only planned in slots that start after it arrives and
+        end before it leaves.
+        """
+        start = self.state.start_schedule
+        arrival = np.array([(bus.arrival_time - start).total_seconds() for bus in self.state.buses])
+        departure = np.array([(bus.departure_time - start).total_seconds() for bus in self.state.buses])
+        self.departure_seconds = departure
+        self.first_slot = np.clip(np.ceil(arrival / self.slot_seconds), 0, self.num_time_slots).astype(int)
+        self.end_slot = np.clip(departure // self.slot_seconds, 0, self.num_time_slots).astype(int)
+        self.end_slot = np.maximum(self.end_slot, self.first_slot)
+        capacity = np.array([bus.battery_capacity for bus in self.state.buses], dtype=float)
+        soc = np.array([bus.current_soc() for bus in self.state.buses], dtype=float)
+        desired = np.array([bus.desired_soc for bus in self.state.buses], dtype=float)
+        # SOCs are percentages
+        self.energy_demands = np.maximum(0, capacity * (desired - soc) / 100)
+        # most a bus can take in one slot (kWh), none if it is not expected to find a free connector
+        self.bus_connector = self.__expected_connectors(arrival, departure)
+        power = np.append(self.state.connector_arrays.guaranteed_power(), 0.0)
+        self.max_slot_energy = power[self.bus_connector] * self.time_slot_duration
+
+    def __expected_connectors(self, arrival, departure) -> np.ndarray:
+        """
+        index of the connector every bus is plugged into when the buses
+        connect to the first free connector in arrival order, -1 for a
+        bus that finds none free
+        """
+        free = list(range(len(self.state.connector_arrays.connectors)))
+        leaving = []    # heap of (departure seconds, connector)
+        connector = np.full(self.num_buses, -1)
+        for bus in np.argsort(arrival, kind="stable"):
+            while leaving and leaving[0][0] <= arrival[bus]:
+                heapq.heappush(free, heapq.heappop(leaving)[1])
+            if free:
+                connector[bus] = heapq.heappop(free)
+                heapq.heappush(leaving, (departure[bus], connector[bus]))
+        return connector
+
+    def __group_classes(self) -> None:
+        """
+        assign every bus a class of (first slot, end slot, energy bin,
+        connector limit)
+        """
+        edges = np.linspace(self.energy_demands.min(initial=0), self.energy_demands.max(initial=0), self.energy_bins + 1)
+        energy_bin = np.clip(np.searchsorted(edges, self.energy_demands, side="right") - 1, 0, self.energy_bins - 1)
+        limits, limit_index = np.unique(self.max_slot_energy, return_inverse=True)
+        keys = ((self.first_slot * (self.num_time_slots + 1) + self.end_slot) * self.energy_bins + energy_bin) \
+            * len(limits) + limit_index
+        _, first_member, self.bus_class, self.class_size = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True)
+        self.num_classes  = len(self.class_size)
+        self.class_first  = self.first_slot[first_member]
+        self.class_end    = self.end_slot[first_member]
+        self.class_demand = np.bincount(self.bus_class, self.energy_demands, minlength=self.num_classes)
+        # only members that need energy are planned any, so only they add to the class's slot limit
+        self.class_slot_energy = np.bincount(self.bus_class, self.max_slot_energy * (self.energy_demands > 0),
+                                             minlength=self.num_classes)
+
+    def __solve_aggregate(self) -> np.ndarray:
+        """
+        earliest deadline first, each class fills the cheapest slots of
+        its window within its connector limit and the remaining site
+        capacity
+        """
+        class_energy = np.zeros((self.num_classes, self.num_time_slots))
+        site_left = np.full(self.num_time_slots, self.grid_limit * self.time_slot_duration)
+        for c in np.lexsort((self.class_first, self.class_end)):
+            window = np.arange(self.class_first[c], self.class_end[c])
+            need = self.class_demand[c]
+            # cheapest first, earlier slot on ties
+            for t in window[np.argsort(self.electricity_prices[window], kind="stable")]:
+                if need <= 0:
+                    break
+                energy = min(need, self.class_slot_energy[c], site_left[t])
+                class_energy[c, t] = energy
+                site_left[t] -= energy
+                need -= energy
+        return class_energy
+
+    def __disaggregate(self) -> np.ndarray:
+        """
+        (buses, slots) energy plan split out of the class plan, walking
+        each class's slots in time order. Every class's slot energy is
+        handed out in full: the class plan never exceeds the summed slot
+        limits of its members that need energy, and whatever their
+        remaining needs cannot take goes to members with connector room
+        to spare.
+        """
+        bus_energy = np.zeros((self.num_buses, self.num_time_slots))
+        order = np.lexsort((self.departure_seconds, self.bus_class))
+        class_starts = np.concatenate(([0], np.cumsum(self.class_size)))
+        for c in range(self.num_classes):
+            members = order[class_starts[c]:class_starts[c + 1]]
+            members = members[self.energy_demands[members] > 0]
+            limits = self.max_slot_energy[members]
+            remaining = self.energy_demands[members].copy()
+            for t in np.nonzero(self.class_energy[c])[0]:
+                energy = self.class_energy[c, t]
+                room = np.minimum(remaining, limits)
+                if self.disaggregation == "proportional":
+                    given = self.__water_fill(energy, remaining, room)
+                else:
+                    # earliest departure first
+                    before = np.cumsum(room) - room
+                    given = np.clip(energy - before, 0, room)
+                spare = limits - given
+                before = np.cumsum(spare) - spare
+                given += np.clip(energy - given.sum() - before, 0, spare)
+                bus_energy[members, t] = given
+                remaining = np.maximum(0, remaining - given)
+        class_totals = np.zeros_like(self.class_energy)
+        np.add.at(class_totals, self.bus_class, bus_energy)
+        assert np.allclose(class_totals, self.class_energy), "disaggregation lost class energy"
+        return bus_energy
+
+    @staticmethod
+    def __water_fill(energy, weights, limits) -> np.ndarray:
+        """
+        split of energy in proportion to weights, where a member held at
+        its limit passes its excess on to the others in proportion to
+        their weights. Hands out at most the summed limits.
+        """
+        split = np.zeros(len(weights))
+        open_ = weights > 0
+        if not open_.any():
+            return split
+        weights, limits = weights[open_], limits[open_]
+        # a member is at its limit once the fill level passes limit / weight
+        order = np.argsort(limits / weights)
+        weights, limits = weights[order], limits[order]
+        levels = limits / weights
+        # energy handed out at each level: members below it capped, the rest at level * weight
+        capped = np.cumsum(limits) - limits
+        free = weights[::-1].cumsum()[::-1]
+        k = np.searchsorted(capped + levels * free, energy)
+        if k == len(weights):
+            filled = limits
+        else:
+            filled = np.minimum(limits, (energy - capped[k]) / free[k] * weights)
+        unsorted = np.empty_like(filled)
+        unsorted[order] = filled
+        split[open_] = unsorted
+        return split
+
+    def update_chargers(self, timesteps) -> None:
+        """
+        update connector with the planned rate of its bus and then
+        deliver power to bus over timesteps
+        """
+        curr_power_price = self.state.price_schedule.get_current_price(self.state.current_time)
+        elapsed = (self.state.current_time - self.state.start_schedule).total_seconds()
+        rate_step = min(int(elapsed // self.slot_seconds), self.num_time_slots - 1)
+        for charger in self.state.chargers:
+            for connector in charger.connectors:
+                bus = connector.connected_to
+                if bus is None:
+                    continue
+                connector.update_charge_rate(self.charge_rate[bus.id, rate_step])
+                self.cost += curr_power_price * connector.deliver_power(timesteps)
+
+    def next_decision_time(self):
+        """
+        the plan only changes rates at the start of each time slot
+        """
+        elapsed = int((self.state.current_time - self.state.start_schedule).total_seconds())
+        return self.state.current_time + timedelta(seconds=self.slot_seconds - elapsed % self.slot_seconds)
+
+    def print_metrics(self):
+        metrics = f"""
+        number of buses: {self.num_buses}
+        number of classes: {self.num_classes}
+        number of time slots: {self.num_time_slots}
+        time slot duration (hours): {self.time_slot_duration}
+        site limit (kW): {self.grid_limit}
+        disaggregation: {self.disaggregation}
+        planning time (s): {self.plan_seconds}
+        planned energy (kWh): {self.class_energy.sum()} of {self.energy_demands.sum()} demanded
+        """
+        print(metrics)
+
+    def plot_bus_charge_rates(self):
+        for i, row in enumerate(self.charge_rate):
+            plt.plot(row, label=f"bus {i}")
+        plt.xlabel("time slot of charge session")
+        plt.ylabel("power to deliver (kW)")
+        plt.legend()
+        plt.grid(True)
+        plt.show()
+
+    def plot_total_charge_rate(self):
+        plt.plot(self.charge_rate.sum(axis=0))
+        plt.xlabel("time slot of charge session")
+        plt.ylabel("total power delivered (kW)")
+        plt.grid(True)
+        plt.show()
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    from datetime import datetime
+    from chargerTypes import PANTOGRAPH, PLUG_IN_60, mixed_depot
+    from main import Main
+    from simspace import SimState
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+    print(f"{'buses':>6} {'rule':>12} {'classes':>8} {'plan ms':>8} {'planned/demanded':>17}")
+    for num_buses in (16, 256, 1000, 5000):
+        np.random.seed(0)
+        sim_state = SimState(start_time, end_time, num_chargers=num_buses // 2, num_buses=num_buses, compact=True)
+        for rule in ("proportional", "edf"):
+            planner = HierarchicalDM(sim_state, disaggregation=rule)
+            planned = planner.charge_rate.sum() * planner.time_slot_duration / planner.energy_demands.sum()
+            print(f"{num_buses:>6} {rule:>12} {planner.num_classes:>8} {planner.plan_seconds * 1e3:>8.1f} {planned:>17.3f}")
+
+    # a mixed depot: planning at the largest connector's power would strand buses on the smaller ones
+    charger_types = mixed_depot({PLUG_IN_60: 12, PANTOGRAPH: 4})
+    for name in ("naive", "hierarchical"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            main = Main(name, len(charger_types), 16, seed=0, adaptive=True, charger_types=charger_types, event_level="off")
+            main.run_sim(plot=False)
+        summary = main.summary()
+        shortfall = np.mean([max(0.0, bus.desired_soc - soc) for bus, soc in zip(main.sim_state.buses, summary["departure_soc"])])
+        print(f"mixed depot {name:>12}: mean SOC shortfall {shortfall:.1f}, cost ${summary['cost']:.2f}")
@@ -0,0 +1,271 @@
+"""
+Incrementally maintained hourly and daily charging aggregates of a
+fleet report (Reports.csv).
+
+The report has one row per hour ("DateTime") and "<bus> - <field>"
+columns, of which "Energy charged" (kWh) and "Time charging" (hours)
+matter here; their ratio is the average kW a bus charged at within the
+hour. A ReportAggregator folds rows into running sums by hour of day and
+by date and keeps the fleet peak, and remembers the byte offset it has
+read up to, so update() only parses rows appended since the last call.
+The state saves to an .npz file, which lets a notebook pick up where the
+last session stopped instead of re-reading the whole report.
+
+simulated_hourly() reduces a finished Main run to the same hour of day
+energy profile, and validate() compares the two per bus.
+"""
+
+import csv
+import hashlib
+import os
+from datetime import datetime
+
+import numpy as np
+
+ENERGY = "Energy charged"
+TIME   = "Time charging"
+REPORT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Reports.csv")
+
+
+def _number(row, index) -> float:
+    # rows are ragged: trailing empty fields are left off
+    if index >= len(row) or row[index] == "":
+        return 0.0
+    return float(row[index])
+
+
+class ReportAggregator:
+
+    def __init__(self, path=REPORT_PATH):
+        self.path                     = path
+        self.offset:      int         = 0          # bytes consumed, always at a line boundary
+        self.header_hash: str         = ""         # guards against the report being replaced
+        self.bus_ids:     list[str]   = []
+        self.energy_columns           = []
+        self.time_columns             = []
+        self.rows:        int         = 0
+        # running sums, reset by __reset once the buses are known
+        self.hour_energy: np.ndarray  = np.zeros((24, 0))    # (hour of day, bus) kWh
+        self.hour_time:   np.ndarray  = np.zeros((24, 0))    # (hour of day, bus) hours charging
+        self.hour_rows:   np.ndarray  = np.zeros(24, dtype=int)
+        self.daily:       dict        = {}                   # date -> [kWh, hours charging] per bus
+        self.peak_kw:     float       = 0.0                  # largest fleet kWh in one hour
+        self.peak_time                = None
+        self.peak_implied_kw: float   = 0.0                  # largest sum of per bus implied kW in one hour
+
+    def __reset(self, header) -> None:
+        self.header_hash = hashlib.sha256(",".join(header).encode()).hexdigest()[:16]
+        self.bus_ids = [column.split(" - ")[0] for column in header if column.endswith(f" - {ENERGY}")]
+        self.energy_columns = [header.index(f"{bus} - {ENERGY}") for bus in self.bus_ids]
+        self.time_columns = [header.index(f"{bus} - {TIME}") if f"{bus} - {TIME}" in header else -1
+                             for bus in self.bus_ids]
+        self.rows = 0
+        self.hour_energy = np.zeros((24, len(self.bus_ids)))
+        self.hour_time = np.zeros((24, len(self.bus_ids)))
+        self.hour_rows = np.zeros(24, dtype=int)
+        self.daily = {}
+        self.peak_kw, self.peak_time, self.peak_implied_kw = 0.0, None, 0.0
+
+    def update(self, partial=False) -> int:
+        """
+        fold in the rows appended since the last call and return how many
+        there were. A last line with no newline yet is left for the next
+        call unless partial is set (a finished report with no trailing
+        newline). The report is re-read from the start if it shrank or its
+        header changed.
+        """
+        with open(self.path, "rb") as report:
+            header_line = report.readline()
+            header = next(csv.reader([header_line.decode()]))
+            if os.fstat(report.fileno()).st_size < self.offset or \
+                    hashlib.sha256(",".join(header).encode()).hexdigest()[:16] != self.header_hash:
+                self.__reset(header)
+                self.offset = len(header_line)
+            report.seek(self.offset)
+            data = report.read()
+        end = len(data) if partial else data.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        self.offset += end
+        count = 0
+        for row in csv.reader(data[:end].decode().splitlines()):
+            if row and row[0]:
+                self.__add(row)
+                count += 1
+        return count
+
+    def __add(self, row) -> None:
+        stamp = datetime.fromisoformat(row[0])
+        energy = np.array([_number(row, column) for column in self.energy_columns])
+        hours = np.array([_number(row, column) if column >= 0 else 0.0 for column in self.time_columns])
+        self.hour_energy[stamp.hour] += energy
+        self.hour_time[stamp.hour] += hours
+        self.hour_rows[stamp.hour] += 1
+        day = self.daily.setdefault(stamp.date().isoformat(), np.zeros((2, len(self.bus_ids))))
+        day[0] += energy
+        day[1] += hours
+        fleet = energy.sum()
+        if fleet > self.peak_kw:
+            self.peak_kw, self.peak_time = fleet, stamp
+        charging = hours > 0
+        self.peak_implied_kw = max(self.peak_implied_kw, float((energy[charging] / hours[charging]).sum()))
+        self.rows += 1
+
+    def hourly(self) -> dict:
+        """
+        hour of day profile: mean fleet kWh per hour, mean kWh per bus,
+        mean hours charging per bus and implied kW while charging
+        """
+        days = np.maximum(self.hour_rows, 1)
+        fleet_energy = self.hour_energy.sum(axis=1)
+        fleet_time = self.hour_time.sum(axis=1)
+        return {
+            "fleet_kwh":    fleet_energy / days,
+            "bus_kwh":      fleet_energy / days / max(1, len(self.bus_ids)),
+            "charge_hours": fleet_time / days / max(1, len(self.bus_ids)),
+            "implied_kw":   np.divide(fleet_energy, fleet_time, out=np.zeros(24), where=fleet_time > 0),
+        }
+
+    def implied_kw(self) -> np.ndarray:
+        """
+        (hour of day, bus) average kW each bus charged at while charging
+        """
+        return np.divide(self.hour_energy, self.hour_time, out=np.zeros_like(self.hour_energy), where=self.hour_time > 0)
+
+    def daily_totals(self) -> dict:
+        """
+        date -> fleet kWh and hours charging
+        """
+        return {date: (float(day[0].sum()), float(day[1].sum())) for date, day in sorted(self.daily.items())}
+
+    def save(self, path) -> None:
+        dates = sorted(self.daily)
+        np.savez(path, path=self.path, offset=self.offset, header_hash=self.header_hash, rows=self.rows,
+                 hour_energy=self.hour_energy, hour_time=self.hour_time, hour_rows=self.hour_rows,
+                 dates=np.array(dates, dtype=str), daily=np.array([self.daily[date] for date in dates]).reshape(len(dates), 2, len(self.bus_ids)),
+                 peak=np.array([self.peak_kw, self.peak_implied_kw]),
+                 peak_time="" if self.peak_time is None else self.peak_time.isoformat())
+
+    @classmethod
+    def load(cls, path, report_path=None) -> "ReportAggregator":
+        """
+        aggregates saved by save(); update() continues from the saved offset
+        """
+        with np.load(path) as saved:
+            aggregator = cls(report_path if report_path is not None else str(saved["path"]))
+            with open(aggregator.path, newline="") as report:
+                aggregator.__reset(next(csv.reader(report)))
+            if str(saved["header_hash"]) != aggregator.header_hash:
+                # another report: the next update starts over
+                aggregator.header_hash = ""
+                return aggregator
+            aggregator.offset = int(saved["offset"])
+            aggregator.rows = int(saved["rows"])
+            aggregator.hour_energy = saved["hour_energy"]
+            aggregator.hour_time = saved["hour_time"]
+            aggregator.hour_rows = saved["hour_rows"]
+            aggregator.daily = {str(date): day for date, day in zip(saved["dates"], saved["daily"])}
+            aggregator.peak_kw, aggregator.peak_implied_kw = (float(value) for value in saved["peak"])
+            peak_time = str(saved["peak_time"])
+            aggregator.peak_time = datetime.fromisoformat(peak_time) if peak_time else None
+        return aggregator
+
+    def print_metrics(self):
+        hourly = self.hourly()
+        metrics = f"""
+        rows: {self.rows} ({len(self.daily)} days, {len(self.bus_ids)} buses), {self.offset} bytes read
+        fleet energy charged (kWh): {self.hour_energy.sum():.1f}
+        fleet peak (kW over an hour): {self.peak_kw:.1f} at {self.peak_time}
+        peak of summed implied kW: {self.peak_implied_kw:.1f}
+        busiest hour of day: {int(np.argmax(hourly["fleet_kwh"]))}:00, {hourly["fleet_kwh"].max():.1f} kWh on average
+        """
+        print(metrics)
+
+
+def simulated_hourly(main) -> np.ndarray:
+    """
+    (hour of day,) mean kWh per bus a finished run drew in each clock
+    hour, holding each recorded depot draw until the next sample
+    """
+    start = main.sim_state.start_schedule
+    seconds = np.asarray(main.time_points, dtype=float)
+    draws = np.asarray(main.power_data, dtype=float)
+    ends = np.append(seconds[1:], (main.sim_state.end_schedule - start).total_seconds())
+    profile = np.zeros(24)
+    # split every held sample at the clock hours it spans
+    offset = start.hour * 3600 + start.minute * 60 + start.second
+    for begin, end, draw in zip(seconds + offset, ends + offset, draws):
+        while begin < end and draw:
+            boundary = min(end, (begin // 3600 + 1) * 3600)
+            profile[int(begin // 3600) % 24] += draw * (boundary - begin) / 3600
+            begin = boundary
+    return profile / max(1, main.num_buses)
+
+
+def validate(aggregator: ReportAggregator, main) -> dict:
+    """
+    compare the hour of day energy profile per bus of a run with the
+    report's: kWh per bus per day, the share of it in every hour and the
+    busiest hour of each
+    """
+    observed = aggregator.hourly()["bus_kwh"]
+    simulated = simulated_hourly(main)
+    observed_share = observed / observed.sum() if observed.sum() > 0 else observed
+    simulated_share = simulated / simulated.sum() if simulated.sum() > 0 else simulated
+    return {
+        "observed_bus_kwh":   float(observed.sum()),
+        "simulated_bus_kwh":  float(simulated.sum()),
+        "observed_share":     observed_share,
+        "simulated_share":    simulated_share,
+        "share_rmse":         float(np.sqrt(np.mean((observed_share - simulated_share) ** 2))),
+        "observed_peak_hour": int(np.argmax(observed)),
+        "simulated_peak_hour": int(np.argmax(simulated)),
+    }
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import shutil
+    import tempfile
+    import time
+    from main import Main
+
+    workdir = tempfile.mkdtemp()
+    live = os.path.join(workdir, "Reports.csv")
+    with open(REPORT_PATH, "rb") as report:
+        lines = report.read().splitlines(keepends=True)
+    if not lines[-1].endswith(b"\n"):
+        lines[-1] += b"\n"
+
+    # a report that grows by a day at a time
+    begin = time.perf_counter()
+    full = ReportAggregator(REPORT_PATH)
+    full.update(partial=True)
+    print(f"full parse: {full.rows} rows in {(time.perf_counter() - begin) * 1e3:.1f} ms")
+
+    with open(live, "wb") as report:
+        report.writelines(lines[:len(lines) - 24 * 7])
+    aggregator = ReportAggregator(live)
+    aggregator.update()
+    state = os.path.join(workdir, "aggregates.npz")
+    aggregator.save(state)
+    for day in range(7, 0, -1):
+        with open(live, "ab") as report:
+            report.writelines(lines[len(lines) - 24 * day:len(lines) - 24 * (day - 1)])
+        begin = time.perf_counter()
+        aggregator = ReportAggregator.load(state)
+        added = aggregator.update()
+        aggregator.save(state)
+        print(f"appended day: {added} rows folded in {(time.perf_counter() - begin) * 1e3:.1f} ms")
+    print(f"matches full parse: {np.allclose(aggregator.hour_energy, full.hour_energy) and aggregator.rows == full.rows}")
+    aggregator.print_metrics()
+    shutil.rmtree(workdir)
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main = Main("naive", 16, 32, seed=0, adaptive=True)
+        main.run_sim(plot=False)
+    report = validate(aggregator, main)
+    print(f"kWh per bus per day: observed {report['observed_bus_kwh']:.1f}, simulated {report['simulated_bus_kwh']:.1f}")
+    print(f"busiest hour: observed {report['observed_peak_hour']}:00, simulated {report['simulated_peak_hour']}:00, "
+          f"hourly share RMSE {report['share_rmse']:.3f}")
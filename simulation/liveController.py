@@ -0,0 +1,287 @@
+"""
+Real-time control mode: run a decision maker as a live depot controller.
+
+The controller keeps a SimState as a digital twin of the depot. Every
+control tick it lets the decision maker update the twin and pushes the
+resulting connector rates to the chargers over a charge-point style
+protocol (newline delimited JSON, loosely modelled on OCPP):
+
+    controller -> charger   SetChargingRate {connector, limit_kw}
+                            PlugIn / Unplug {connector, bus}
+    charger -> controller   Ack {id, status}
+                            MeterValues {connector, energy_kwh, power_kw}
+
+StandInChargerServer is a local stand-in for the charger fleet, with one
+TCP session per connector, so the controller can be exercised without
+hardware.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from datetime import timedelta
+from typing import Optional
+
+import numpy as np
+
+from connector import Connector
+
+
+class StandInChargerServer:
+    """
+    Local stand-in for a fleet of charge points. Each TCP session
+    represents one connector: it acknowledges commands after a small
+    actuation delay and reports meter values at a fixed interval.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, actuation_delay=0.002, meter_interval=0.5):
+        self.host:            str   = host
+        self.port:            int   = port
+        self.actuation_delay: float = actuation_delay   # worst case seconds to apply a command
+        self.meter_interval:  float = meter_interval    # seconds between MeterValues messages
+        self.sessions:        int   = 0
+        self.server:          Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle_session, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __handle_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.sessions += 1
+        session = {"connector": None, "power_kw": 0.0, "energy_kwh": 0.0, "plugged": False, "last": time.monotonic()}
+        meter_task = asyncio.create_task(self.__report_meter_values(session, writer))
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                await asyncio.sleep(random.uniform(0, self.actuation_delay))
+                self.__integrate(session)
+                action = message["action"]
+                session["connector"] = message["connector"]
+                if action == "SetChargingRate":
+                    session["power_kw"] = message["limit_kw"] if session["plugged"] else 0.0
+                elif action == "PlugIn":
+                    session["plugged"] = True
+                elif action == "Unplug":
+                    session["plugged"] = False
+                    session["power_kw"] = 0.0
+                writer.write((json.dumps({"action": "Ack", "id": message["id"], "status": "Accepted"}) + "\n").encode())
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            meter_task.cancel()
+            writer.close()
+            self.sessions -= 1
+
+    @staticmethod
+    def __integrate(session):
+        now = time.monotonic()
+        session["energy_kwh"] += session["power_kw"] * (now - session["last"]) / 3600
+        session["last"] = now
+
+    async def __report_meter_values(self, session, writer: asyncio.StreamWriter):
+        while True:
+            await asyncio.sleep(self.meter_interval)
+            if session["connector"] is None:
+                continue
+            self.__integrate(session)
+            meter_values = {
+                "action":     "MeterValues",
+                "connector":  session["connector"],
+                "energy_kwh": session["energy_kwh"],
+                "power_kw":   session["power_kw"],
+            }
+            writer.write((json.dumps(meter_values) + "\n").encode())
+
+
+class ConnectorSession:
+    """
+    Controller side of the session with one physical connector.
+    """
+
+    def __init__(self, connector: Connector, address: str):
+        self.connector:   Connector = connector
+        self.address:     str       = address    # "<charger id>/<connector id>"
+        self.reader:      Optional[asyncio.StreamReader] = None
+        self.writer:      Optional[asyncio.StreamWriter] = None
+        self.pending:     dict[int, asyncio.Future] = {}
+        self.sent_rate:   Optional[float] = None
+        self.plugged_bus: Optional[int]   = None
+        self.meter_kwh:   float           = 0.0
+        self.meter_kw:    float           = 0.0
+        self.listener:    Optional[asyncio.Task] = None
+
+    async def open(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.listener = asyncio.create_task(self.__listen())
+
+    async def close(self):
+        self.listener.cancel()
+        self.writer.close()
+
+    async def __listen(self):
+        while line := await self.reader.readline():
+            message = json.loads(line)
+            if message["action"] == "Ack":
+                future = self.pending.pop(message["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(message["status"])
+            elif message["action"] == "MeterValues":
+                self.meter_kwh = message["energy_kwh"]
+                self.meter_kw = message["power_kw"]
+
+    async def call(self, message_id: int, action: str, timeout: float, **payload) -> str:
+        """
+        send a command and wait for the charger to acknowledge it,
+        raising asyncio.TimeoutError after timeout seconds
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        message = {"action": action, "id": message_id, "connector": self.address, **payload}
+        self.writer.write((json.dumps(message) + "\n").encode())
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(message_id, None)
+
+
+class DepotController:
+    """
+    Drive a decision maker in real time. Each control tick advances the
+    digital twin by sim_seconds_per_tick, then sends plug-in/unplug
+    events and every connector rate that moved by more than
+    rate_deadband to the chargers concurrently.
+    Decision-to-actuation latency is measured from the end of the
+    decision step to the charger's acknowledgement.
+    """
+
+    def __init__(self, d_maker, host, port, sim_seconds_per_tick=60, tick_interval=0.1,
+                 command_timeout=0.25, max_in_flight=256, rate_deadband=0.5):
+        self.d_maker:              object  = d_maker
+        self.state                         = d_maker.state
+        self.host:                 str     = host
+        self.port:                 int     = port
+        self.sim_seconds_per_tick: int     = sim_seconds_per_tick
+        self.tick_interval:        float   = tick_interval      # wall clock seconds between ticks
+        self.command_timeout:      float   = command_timeout    # upper bound on one command round trip
+        self.rate_deadband:        float   = rate_deadband      # kW change below which a rate is not resent
+        self.in_flight:            asyncio.Semaphore = asyncio.Semaphore(max_in_flight)
+        self.message_ids                   = itertools.count()
+        self.sessions:             list[ConnectorSession] = [
+            ConnectorSession(connector, f"{charger.charger_id}/{connector.connector_id}")
+            for charger in self.state.chargers
+            for connector in charger.connectors
+        ]
+        self.latencies:            list[float] = []
+        self.timeouts:             int         = 0
+        self.overruns:             int         = 0
+
+    async def connect(self):
+        await asyncio.gather(*(session.open(self.host, self.port) for session in self.sessions))
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in self.sessions))
+
+    def __step_twin(self):
+        """
+        advance the digital twin by one control tick and apply bus
+        arrivals and departures that fell inside it
+        """
+        previous = self.state.current_time
+        self.state.current_time = previous + timedelta(seconds=self.sim_seconds_per_tick)
+        self.d_maker.update_chargers(self.sim_seconds_per_tick)
+        for bus in self.state.buses:
+            # through SimState so arrivals and rejected buses are logged
+            if previous < bus.arrival_time <= self.state.current_time:
+                self.state.connect_arrival(bus)
+            if previous < bus.departure_time <= self.state.current_time:
+                self.state.disconnect_departure(bus)
+
+    async def __actuate(self, session: ConnectorSession, decided_at: float):
+        connector = session.connector
+        bus_id = connector.connected_to.id if connector.active() else None
+        rate = connector.curr_power_delivery if connector.active() else 0.0
+        if bus_id == session.plugged_bus and session.sent_rate is not None \
+                and abs(rate - session.sent_rate) < self.rate_deadband:
+            return
+
+        async with self.in_flight:
+            try:
+                if bus_id != session.plugged_bus:
+                    action = "PlugIn" if bus_id is not None else "Unplug"
+                    await session.call(next(self.message_ids), action, self.command_timeout, bus=bus_id)
+                    session.plugged_bus = bus_id
+                await session.call(next(self.message_ids), "SetChargingRate", self.command_timeout, limit_kw=rate)
+                session.sent_rate = rate
+                self.latencies.append(time.perf_counter() - decided_at)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+
+    async def run(self, num_ticks: int):
+        for _ in range(num_ticks):
+            tick_start = time.perf_counter()
+            self.__step_twin()
+            decided_at = time.perf_counter()
+            await asyncio.gather(*(self.__actuate(session, decided_at) for session in self.sessions))
+
+            remaining = self.tick_interval - (time.perf_counter() - tick_start)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            else:
+                self.overruns += 1
+            if self.state.current_time >= self.state.end_schedule:
+                break
+
+    def latency_percentiles(self) -> dict:
+        if not self.latencies:
+            return {}
+        latencies_ms = np.array(self.latencies) * 1e3
+        return {f"p{p}": float(np.percentile(latencies_ms, p)) for p in (50, 95, 99, 100)}
+
+    def print_metrics(self):
+        metrics = f"""
+        connector sessions: {len(self.sessions)}
+        commands acknowledged: {len(self.latencies)}
+        command timeouts: {self.timeouts}
+        tick overruns: {self.overruns}
+        decision to actuation latency (ms): {self.latency_percentiles()}
+        metered energy (kWh): {sum(session.meter_kwh for session in self.sessions)}
+        """
+        print(metrics)
+
+
+async def run_live(d_maker, num_ticks, **controller_args) -> DepotController:
+    """
+    run d_maker against a local stand-in charger server for num_ticks
+    control ticks and return the controller with its metrics
+    """
+    server = StandInChargerServer()
+    await server.start()
+    controller = DepotController(d_maker, server.host, server.port, **controller_args)
+    await controller.connect()
+    try:
+        await controller.run(num_ticks)
+    finally:
+        await controller.close()
+        await server.stop()
+    return controller
+
+
+if __name__ == "__main__":
+    from datetime import datetime
+    from simspace import SimState
+    from naiveDM import NaiveDM
+
+    np.random.seed(0)
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+    sim_state = SimState(start_time, end_time, num_chargers=256, num_buses=512)
+    controller = asyncio.run(run_live(NaiveDM(sim_state), num_ticks=60, sim_seconds_per_tick=120,
+                                        tick_interval=0.25))
+    controller.print_metrics()
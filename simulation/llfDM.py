@@ -0,0 +1,325 @@
+"""
+Online least-laxity-first charging.
+
+The laxity of a connected bus is the time left before it departs minus
+the time it would need at the full power of its connector to reach its
+desired SOC. On a cabinet shared by several connectors, full power is
+the connector's share of the cabinet, which it can hold whatever the
+other connectors do. Buses
+that are not charging wait in a heap keyed by their latest start time
+(departure minus minimum charge time), which stays constant while they
+wait, so laxity never has to be recomputed for the whole fleet.
+
+While the current price is the cheapest left in the horizon, buses are
+started in least-laxity order until their summed power reaches the
+site limit. While a
+cheaper price is still ahead, only buses whose laxity has run out are
+started. Arrivals, departures, completed buses and price changes are
+events that each cost O(log n) heap operations. Chargers notify the
+decision maker of the connectors buses were plugged into or unplugged
+from, so connections are never found by scanning the depot.
+"""
+
+import heapq
+import itertools
+from bisect import bisect_right
+from datetime import timedelta
+
+import matplotlib.pyplot as plt
+
+from decisionMaker import DecisionMaker
+from reporting import padded_matrix
+
+
+class LeastLaxityDM(DecisionMaker):
+
+    def __init__(self, sim_state, site_limit=None, laxity_margin=60):
+        super().__init__(sim_state)
+        # site limit (kW), by default every connector at full power within its cabinet
+        self.site_limit    = site_limit if site_limit is not None else self.state.connector_arrays.site_capacity()
+        self.laxity_margin = laxity_margin      # start waiting buses this many seconds before their laxity runs out
+        self.cost          = 0.0
+        self.charge_rate_runs = [[] for _ in self.state.buses]   # run-length encoded [rate, timesteps] per bus
+        self.waiting       = []     # heap of (latest start seconds, seq, connector, bus)
+        self.completions   = []     # heap of (estimated done seconds, seq, connector, bus)
+        self.entry_seq     = {}     # connector -> seq of its only valid heap entry
+        self.charging      = {}     # connector -> full power (kW) it is charging at
+        self.charging_power = 0.0   # kW summed over charging
+        self.seen          = {}     # connector -> bus connected at the last update
+        # connectors whose bus changed since the last update, starting with any already connected
+        self.changed       = [connector for connector in self.state.connector_arrays.connectors
+                              if connector.connected_to is not None]
+        self.state.connection_listeners.append(self.changed.append)
+        self.counter       = itertools.count()
+        self.events        = 0
+        self.__init_price_horizon()
+
+    @property
+    def charge_rate(self) -> list[list[float]]:
+        """
+        per timestep charge rate history of every bus, expanded from the
+        run-length encoded record
+        """
+        return [[rate for rate, count in runs for _ in range(count)] for runs in self.charge_rate_runs]
+
+    def __init_price_horizon(self):
+        """
+        for every tariff interval, the start of the next interval with a
+        lower price, so "is something cheaper ahead?" is a lookup
+        """
+        index = self.state.price_schedule.tariff_index
+        self.price_boundaries = index.boundaries.tolist()
+        rates = index.rates.tolist()
+        horizon = (self.state.end_schedule - self.state.start_schedule).total_seconds()
+        self.next_cheaper = [horizon] * len(rates)
+        # walk back keeping a stack of interval starts with increasing rates
+        cheaper = []
+        for i in range(len(rates) - 1, -1, -1):
+            while cheaper and rates[cheaper[-1]] >= rates[i]:
+                cheaper.pop()
+            if cheaper:
+                self.next_cheaper[i] = self.price_boundaries[cheaper[-1]]
+            cheaper.append(i)
+        self.interval = None
+
+    def __elapsed(self) -> float:
+        return (self.state.current_time - self.state.start_schedule).total_seconds()
+
+    def __remaining_energy(self, bus) -> float:
+        return max(0.0, bus.battery_capacity * (bus.desired_soc - bus.current_soc()) / 100)
+
+    def __full_power(self, connector) -> float:
+        """
+        kW connector can hold with every connector of its cabinet charging
+        """
+        charger = connector.charger
+        if charger is None or charger.cabinet_limit is None:
+            return connector.max_power_out
+        return min(connector.max_power_out, charger.cabinet_limit / len(charger.connectors))
+
+    def __latest_start(self, connector, bus, now) -> float:
+        """
+        latest time (s since start) the bus can start at full power and
+        still reach its desired SOC before departing
+        """
+        departure = (bus.departure_time - self.state.start_schedule).total_seconds()
+        power = self.__full_power(connector)
+        if power <= 0:
+            return -float("inf")
+        return departure - self.__remaining_energy(bus) / power * 3600
+
+    def __push(self, heap, key, connector, bus) -> None:
+        seq = next(self.counter)
+        self.entry_seq[connector] = seq
+        heapq.heappush(heap, (key, seq, connector, bus))
+
+    def __pop_valid(self, heap):
+        """
+        top entry of heap that still belongs to a connected bus, dropping
+        entries invalidated by later pushes or disconnects
+        """
+        while heap:
+            key, seq, connector, bus = heap[0]
+            if self.entry_seq.get(connector) == seq and connector.connected_to is bus:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def __stop(self, connector) -> None:
+        self.charging_power -= self.charging.pop(connector, 0.0)
+        if not self.charging:
+            # drop float drift whenever nothing is charging
+            self.charging_power = 0.0
+
+    def __wait(self, connector, bus, now) -> None:
+        self.__stop(connector)
+        connector.update_charge_rate(0)
+        if self.__remaining_energy(bus) > 0:
+            self.__push(self.waiting, self.__latest_start(connector, bus, now), connector, bus)
+        else:
+            self.entry_seq.pop(connector, None)
+
+    def __start(self, connector, bus, power, now) -> None:
+        self.charging[connector] = power
+        self.charging_power += power
+        connector.update_charge_rate(power)
+        done = now + max(1.0, self.__remaining_energy(bus) / power * 3600)
+        self.__push(self.completions, done, connector, bus)
+
+    def __handle_connections(self, now) -> None:
+        """
+        pick up buses connected or disconnected since the last update
+        """
+        for connector in self.changed:
+            bus = connector.connected_to
+            if self.seen.get(connector) is bus:
+                # plugged and unplugged again, or already handled
+                continue
+            self.events += 1
+            self.__stop(connector)
+            self.entry_seq.pop(connector, None)
+            if bus is None:
+                del self.seen[connector]
+            else:
+                self.seen[connector] = bus
+                self.__wait(connector, bus, now)
+        self.changed.clear()
+
+    def __handle_completions(self, now) -> None:
+        while True:
+            entry = self.__pop_valid(self.completions)
+            if entry is None or entry[0] > now:
+                return
+            heapq.heappop(self.completions)
+            done, seq, connector, bus = entry
+            self.events += 1
+            remaining = self.__remaining_energy(bus)
+            if remaining > 0:
+                # delivery noise left a little to go
+                self.__push(self.completions, now + max(1.0, remaining / self.charging[connector] * 3600),
+                            connector, bus)
+            else:
+                self.__stop(connector)
+                self.entry_seq.pop(connector, None)
+                connector.update_charge_rate(0)
+
+    def __handle_price_change(self, now) -> None:
+        interval = bisect_right(self.price_boundaries, now) - 1
+        if interval == self.interval:
+            return
+        self.interval = interval
+        self.events += 1
+        self.cheaper_at = self.next_cheaper[interval]
+        if self.cheaper_at < (self.state.end_schedule - self.state.start_schedule).total_seconds():
+            # a cheaper price is ahead: stop everything that can wait for it
+            for connector in list(self.charging):
+                bus = connector.connected_to
+                if self.__latest_start(connector, bus, now) - self.laxity_margin > now:
+                    self.__wait(connector, bus, now)
+
+    def __admit(self, now) -> None:
+        """
+        start waiting buses in least-laxity order while the site has room:
+        all of them when no cheaper price is ahead, otherwise only those
+        out of laxity
+        """
+        cheapest_now = self.cheaper_at >= (self.state.end_schedule - self.state.start_schedule).total_seconds()
+        while True:
+            entry = self.__pop_valid(self.waiting)
+            if entry is None or (not cheapest_now and entry[0] - self.laxity_margin > now):
+                return
+            power = self.__full_power(entry[2])
+            if power <= 0:
+                # its connector has no power to give, so it cannot be started
+                heapq.heappop(self.waiting)
+                continue
+            if self.charging_power + power > self.site_limit + 1e-9:
+                return
+            heapq.heappop(self.waiting)
+            self.events += 1
+            self.__start(entry[2], entry[3], power, now)
+
+    def __decide(self, now) -> None:
+        """
+        process every event up to now; calling it again at the same
+        instant finds nothing to do
+        """
+        self.__handle_connections(now)
+        self.__handle_price_change(now)
+        self.__handle_completions(now)
+        self.__admit(now)
+
+    def update_chargers(self, timesteps) -> None:
+        self.__decide(self.__elapsed())
+
+        curr_power_price = self.state.price_schedule.get_current_price(self.state.current_time)
+        for connector, bus in self.seen.items():
+            rate = connector.curr_power_delivery
+            runs = self.charge_rate_runs[bus.id]
+            if runs and runs[-1][0] == rate:
+                runs[-1][1] += timesteps
+            else:
+                runs.append([rate, timesteps])
+            self.cost += curr_power_price * connector.deliver_power(timesteps)
+
+    def next_decision_time(self):
+        """
+        the next completion, the next waiting bus running out of laxity
+        or the next price change, whichever comes first
+        """
+        now = self.__elapsed()
+        # adaptive stepping asks before update_chargers, so decide first
+        self.__decide(now)
+        candidates = [self.state.price_schedule.next_price_change(self.state.current_time)]
+        for heap, margin in ((self.completions, 0), (self.waiting, self.laxity_margin)):
+            entry = self.__pop_valid(heap)
+            if entry is not None:
+                candidates.append(self.state.current_time + timedelta(seconds=max(1.0, entry[0] - margin - now)))
+        return min(candidates)
+
+    def print_metrics(self):
+        metrics = f"""
+        site limit (kW): {self.site_limit}
+        buses charging: {len(self.charging)} ({self.charging_power} kW)
+        buses waiting: {len(self.waiting)}
+        events handled: {self.events}
+        cost: {self.cost}
+        """
+        print(metrics)
+
+    def plot_bus_charge_rates(self):
+        for i, row in enumerate(self.charge_rate):
+            plt.plot(row, label=f"bus {i}")
+        plt.xlabel("timestep of charge session")
+        plt.ylabel("power to deliver (kW)")
+        plt.legend()
+        plt.grid(True)
+        plt.show()
+
+    def plot_total_charge_rate(self):
+        plt.plot(padded_matrix(self.charge_rate).sum(axis=0))
+        plt.xlabel("timestep of charge session")
+        plt.ylabel("total power delivered (kW)")
+        plt.grid(True)
+        plt.show()
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    import numpy as np
+    from datetime import datetime
+    from chargerTypes import DISPENSER_150, PANTOGRAPH, mixed_depot
+    from main import Main
+    from naiveDM import NaiveDM
+    from simspace import SimState
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+    num_buses = 5000
+    for name, make in (("naive", NaiveDM), ("least laxity", lambda state: LeastLaxityDM(state, site_limit=num_buses * 40))):
+        np.random.seed(0)
+        sim_state = SimState(start_time, end_time, num_chargers=num_buses // 2, num_buses=num_buses, compact=True)
+        d_maker = make(sim_state)
+        for bus in sim_state.buses:
+            for charger in sim_state.chargers:
+                if charger.connect_bus(bus, verbose=False):
+                    break
+        ticks = 600
+        begin = time.perf_counter()
+        for _ in range(ticks):
+            sim_state.current_time += timedelta(seconds=1)
+            d_maker.update_chargers(1)
+        per_tick = (time.perf_counter() - begin) / ticks
+        print(f"{name:>12}: {per_tick * 1e3:6.1f} ms per tick for {num_buses} buses, cost so far ${d_maker.cost:.2f}")
+
+    # a mixed depot: planning at the largest connector's power would strand buses on the smaller ones
+    charger_types = mixed_depot({DISPENSER_150: 4, PANTOGRAPH: 4})
+    for name in ("naive", "llf"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            main = Main(name, len(charger_types), 16, seed=0, adaptive=True, charger_types=charger_types, event_level="off")
+            main.run_sim(plot=False)
+        summary = main.summary()
+        shortfall = np.mean([max(0.0, bus.desired_soc - soc) for bus, soc in zip(main.sim_state.buses, summary["departure_soc"])])
+        print(f"mixed depot {name:>12}: mean SOC shortfall {shortfall:.1f}, cost ${summary['cost']:.2f}")
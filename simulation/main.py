@@ -1,60 +1,124 @@
 import matplotlib.pyplot as plt
 
 from simspace import SimState
+from tariff import Tariff
 from datetime import datetime, timedelta
 
 import sys
+import numpy as np
 from decisionMaker import DecisionMaker
 
 from naiveDM import NaiveDM
 from rtsoDM import rtsoDM
 from rlDM import rlDM
+from hierarchicalDM import HierarchicalDM
+from llfDM import LeastLaxityDM
+from decisionLog import DecisionLog, ReplayDM
+from reporting import write_report
+
+START_TIME = datetime.fromisoformat('2024-12-06T19:00:00')
+END_TIME = datetime.fromisoformat('2024-12-07T06:00:00')
 
 class Main:
 
-    def __init__(self, d_maker: str, num_chargers: int, num_buses: int):
-        self.sim_state: SimState      = self.__make_sim_state(num_chargers=num_chargers, num_buses=num_buses)
+    def __init__(self, d_maker: str, num_chargers: int, num_buses: int, seed=None, min_rate=0.08, max_rate=0.24,
+                 compact=False, adaptive=False, policy_path=None, tariff_path=None, slot_minutes=60,
+                 charger_types=None, telemetry=None,
+                 record_decisions=False, replay_path=None, trace_seconds=None,
+                 event_level="warning", event_path=None, scenario=None):
+        if seed is not None:
+            np.random.seed(seed)
+        self.sim_state: SimState      = self.__make_sim_state(num_chargers=num_chargers, 
+                                                              num_buses=num_buses,
+                                                              min_rate=min_rate,
+                                                              max_rate=max_rate,
+                                                              compact=compact,
+                                                              adaptive=adaptive,
+                                                              tariff_path=tariff_path,
+                                                              charger_types=charger_types,
+                                                              event_level=event_level,
+                                                              event_path=event_path,
+                                                              scenario=scenario)
+        self.policy_path = policy_path     # exported rlDM policy to deploy instead of training one
+        self.slot_minutes = slot_minutes   # planning resolution of rtsoDM and rlDM
+        self.replay_path = replay_path     # decision log the "replay" decision maker feeds back
         self.d_maker:   DecisionMaker = self.__make_decision_maker(d_maker, self.sim_state)
+        # attached after the decision maker so rlDM training is not recorded
+        self.decision_log = DecisionLog().attach(self.sim_state) if record_decisions else None
+        if trace_seconds is not None:
+            # per connector energy trace for re-costing under other tariffs
+            self.sim_state.meter.record_traces(trace_seconds)
         self.num_buses = num_buses
         self.time_points = []
         self.soc_data = [[] for _ in range(num_buses)]
         self.charge_rate_data = [[] for _ in range(num_buses)]
-
-    def __make_sim_state(self, num_chargers, num_buses) -> SimState:
-        start_time = datetime.fromisoformat('2024-12-06T19:00:00')
-        end_time = datetime.fromisoformat('2024-12-07T06:00:00')
-        return SimState(start_time, end_time, num_chargers=num_chargers, num_buses=num_buses)    
+        self.power_data = []    # total kW drawn by connected buses at each recorded timestep
+        self.peak_draw = 0.0
+        self.telemetry = telemetry  # sink with record(seconds, soc, draw) that replaces the lists above
+
+    def __make_sim_state(self, num_chargers, num_buses, min_rate, max_rate, compact, adaptive, tariff_path,
+                         charger_types, event_level, event_path, scenario) -> SimState:
+        return SimState(START_TIME, END_TIME, num_chargers=num_chargers, num_buses=num_buses,
+                        min_rate=min_rate, max_rate=max_rate, compact=compact, adaptive=adaptive,
+                        tariff=Tariff.load(tariff_path) if tariff_path is not None else None,
+                        charger_types=charger_types, event_level=event_level, event_path=event_path,
+                        scenario=scenario)
 
     def __make_decision_maker(self, d_maker: str, sim_state: SimState):
         if d_maker.lower() == "naive":
             return NaiveDM(sim_state)
         # TODO: Replace these with the actual simulation environments
         elif d_maker.lower() == "rule-based":
-            return rtsoDM(sim_state)
+            return rtsoDM(sim_state, slot_minutes=self.slot_minutes)
+        elif d_maker.lower() == "hierarchical":
+            return HierarchicalDM(sim_state, slot_minutes=self.slot_minutes)
+        elif d_maker.lower() == "llf":
+            return LeastLaxityDM(sim_state)
+        elif d_maker.lower() == "replay":
+            if self.replay_path is None:
+                raise ValueError("The replay decision maker needs a replay_path")
+            return ReplayDM(sim_state, DecisionLog.load(self.replay_path))
         elif d_maker.lower() == "rl":
-            return rlDM(sim_state)
+            return rlDM(sim_state, policy_path=self.policy_path, slot_minutes=self.slot_minutes)
+        elif d_maker.lower() == "rl-warm":
+            return rlDM(sim_state, train_timesteps=2000, warm_start=True, slot_minutes=self.slot_minutes)
         else:
             raise NotImplementedError(f"Decision maker ${d_maker} is not a valid decision maker")
             
-    def run_sim(self):
+    def run_sim(self, plot=True, on_step=None, report_dir=None):
+        try:
+            self.__run_steps(on_step)
+        finally:
+            # keep what was logged up to an error
+            self.sim_state.events.flush()
+        if report_dir is not None:
+            for path in write_report(self, report_dir):
+                print(f"wrote {path}")
+        elif plot:
+            self.plot_soc()
+
+    def __run_steps(self, on_step):
         total_timesteps = self.sim_state.price_schedule.num_timesteps
         timestep_scale = self.sim_state.price_schedule.timestep_duration
-        if type(self.d_maker) == rlDM:
-            for timestep in range(total_timesteps//3600):
-
+        if self.sim_state.adaptive and type(self.d_maker) != rlDM:
+            self.__run_adaptive(on_step)
+        elif type(self.d_maker) == rlDM:
+            slot_seconds = self.d_maker.slot_seconds
+            for timestep in range(total_timesteps * timestep_scale // slot_seconds):
+
+                if on_step is not None:
+                    on_step(self)
                 # update plot data for state of charge
-                self.time_points.append(timestep)
-                for i, bus in enumerate(self.sim_state.buses):
-                    self.soc_data[i].append(bus.current_soc())
+                self.__record(timestep * slot_seconds)
 
                 self.d_maker.update_chargers(timestep)
         else:
             for timestep in range(total_timesteps):
 
+                if on_step is not None:
+                    on_step(self)
                 # update plot data for state of charge
-                self.time_points.append(timestep)
-                for i, bus in enumerate(self.sim_state.buses):
-                    self.soc_data[i].append(bus.current_soc())
+                self.__record(timestep * timestep_scale)
 
                 # update current time in simulation
                 self.sim_state.current_time = self.sim_state.current_time + timedelta(seconds=timestep_scale)
@@ -62,18 +126,54 @@ class Main:
                 self.d_maker.update_chargers(1)
 
                 #print(f"Current time: {self.sim_state.current_time}")
-                # check for buses arriving/departing
-                for bus in self.sim_state.buses:
-                    if bus.arrival_time == self.sim_state.current_time:
-                                self.__find_open_connector(bus)
-                    if bus.departure_time == self.sim_state.current_time:
-                        for charger in self.sim_state.chargers:
-                            res = charger.disconnect_bus(bus)
-                            if res:
-                                print(f"{self.sim_state.current_time}: Bus disconnected\n{bus.print_metrics()}")
-                                break
-
-
+                self.__check_arrivals_departures()
+
+    def __run_adaptive(self, on_step):
+        """
+        advance the simulation by the largest step over which every
+        connector's power is constant instead of one timestep at a time.
+        Each step starts at the same instant a one-timestep run would make
+        its decision, so results differ only by the closed-form delivery.
+        """
+        timestep_scale = self.sim_state.price_schedule.timestep_duration
+        while self.sim_state.current_time < self.sim_state.end_schedule:
+            if on_step is not None:
+                on_step(self)
+            self.__record(int((self.sim_state.current_time - self.sim_state.start_schedule).total_seconds()))
+
+            self.sim_state.current_time = self.sim_state.current_time + timedelta(seconds=timestep_scale)
+            step_seconds = self.sim_state.next_step_seconds(self.d_maker.next_decision_time())
+            timesteps = max(1, step_seconds // timestep_scale)
+            if self.decision_log is not None:
+                self.decision_log.record_step()
+            self.d_maker.update_chargers(timesteps)
+            self.__check_arrivals_departures()
+            self.sim_state.current_time = self.sim_state.current_time + timedelta(seconds=(timesteps - 1) * timestep_scale)
+
+    def __record(self, seconds):
+        """
+        sample SOC and depot power at seconds since the start, into the
+        telemetry sink if there is one, otherwise into the plot lists
+        """
+        draw = self.__current_draw()
+        self.peak_draw = max(self.peak_draw, draw)
+        if self.telemetry is not None:
+            self.telemetry.record(seconds, [bus.current_soc() for bus in self.sim_state.buses], draw)
+            return
+        self.time_points.append(seconds)
+        for i, bus in enumerate(self.sim_state.buses):
+            self.soc_data[i].append(bus.current_soc())
+        self.power_data.append(draw)
+
+    def __check_arrivals_departures(self):
+        # check for buses arriving/departing
+        for bus in self.sim_state.buses:
+            if bus.arrival_time == self.sim_state.current_time:
+                self.sim_state.connect_arrival(bus)
+            if bus.departure_time == self.sim_state.current_time:
+                self.sim_state.disconnect_departure(bus)
+
+    def plot_soc(self):
         # Plotting
         plt.figure(figsize=(10, 6))
 
@@ -89,8 +189,32 @@ class Main:
 
         # Display the plot
         plt.show()
+
+    def summary(self) -> dict:
+        """
+        Collect the headline results of a finished run: metered cost,
+        the cost the decision maker estimated for itself, state of charge
+        of each bus when it left the depot and the peak power drawn by
+        the depot
+        """
+        metered = self.sim_state.meter.summary()
+        return {
+            "cost":            float(metered["cost"]),
+            "reported_cost":   float(self.d_maker.cost),
+            "energy_kwh":      float(metered["energy_kwh"]),
+            "departure_soc":   [float(bus.current_soc()) for bus in self.sim_state.buses],
+            "peak_kw":         float(self.peak_draw),
+            "metered_peak_kw": float(metered["peak_kw"]),
+        }
             
-        
+    def __current_draw(self) -> float:
+        draw = 0.0
+        for charger in self.sim_state.chargers:
+            for connector in charger.connectors:
+                if connector.active():
+                    draw += connector.curr_power_delivery
+        return draw
+
     def __check_bus_connected(self, bus):
         for charger in self.sim_state.chargers:
             for connector in charger.connectors:
@@ -98,24 +222,22 @@ class Main:
                     return True
         return False
 
-    def __find_open_connector(self, bus):
-        for charger in self.sim_state.chargers:
-            res = charger.connect_bus(bus)
-            if res:
-                print(f"{self.sim_state.current_time}: Bus arrived and was connected")
-                break
-
 
 if __name__ == "__main__":
-    if len(sys.argv) == 4:
+    report_dir = None
+    if len(sys.argv) in (4, 5):
 #                   decision maker  number of chargers  number of busses 
-        main = Main(sys.argv[1],    int(sys.argv[2]),   int(sys.argv[3]))
+        main = Main(sys.argv[1],    int(sys.argv[2]),   int(sys.argv[3]), event_level="info")
+        # optional directory to write fleet level figures to instead of showing per-bus plots
+        report_dir = sys.argv[4] if len(sys.argv) == 5 else None
     else:
-        main = Main("rule-based", 8, 16)
+        main = Main("rule-based", 8, 16, event_level="info")
         print("DECISON MAKER METRICS")
-    main.run_sim()
-    main.d_maker.plot_bus_charge_rates()
-    main.d_maker.plot_total_charge_rate()
+    main.run_sim(report_dir=report_dir)
+    if report_dir is None:
+        main.d_maker.plot_bus_charge_rates()
+        main.d_maker.plot_total_charge_rate()
 
     print(f"COST TO CHARGE: ${main.d_maker.cost}")
+    main.sim_state.meter.print_metrics()
 
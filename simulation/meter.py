@@ -0,0 +1,138 @@
+"""
+Single metering layer for every decision maker.
+
+Each Connector reports the energy it delivers to the DepotMeter of its
+SimState, which prices it at the simulation's current time and
+accumulates kWh and cost per connector, per charger and for the whole
+depot in O(1) per delivery. Because every decision maker delivers
+through connectors, they are all scored the same way regardless of how
+they keep their own cost estimate.
+
+Peaks are demand peaks as a utility bills them: the highest average kW
+over a fixed demand interval (15 minutes by default), aligned to the
+start of the schedule. Every delivery is spread over the intervals its
+step overlaps, so the peak does not depend on the step length and the
+per-second delivery noise averages out.
+
+With record_traces the meter also bins every delivery into a
+(connector, time bin) energy trace, which tariffAnalysis re-prices under
+other tariffs without simulating again.
+"""
+
+import numpy as np
+
+
+class DepotMeter:
+
+    def __init__(self, sim_state, demand_seconds=900):
+        self.state                = sim_state
+        self.energy_kwh:  float   = 0.0
+        self.cost:        float   = 0.0
+        self.peak_kw:     float   = 0.0     # highest depot kW averaged over a demand interval
+        self.deliveries:  int     = 0
+        self.demand_seconds       = demand_seconds
+        self.demand_energy        = None    # (connectors, demand intervals) kWh, sized on the first delivery
+        self.__price_time         = None
+        self.__price:     float   = 0.0
+        self.trace_seconds        = None    # bin width of the energy trace, None if not recorded
+        self.trace                = None    # (connectors, bins) kWh delivered in each bin
+
+    def record(self, connector, energy_kwh: float, seconds: float) -> None:
+        """
+        meter energy_kwh delivered by connector over the last seconds
+        """
+        now = self.state.current_time
+        if now != self.__price_time:
+            self.__price_time = now
+            self.__price = self.state.price_schedule.get_current_price(now)
+
+        cost = energy_kwh * self.__price
+        connector.meter_energy += energy_kwh
+        connector.meter_cost += cost
+
+        charger = connector.charger
+        if charger is not None:
+            charger.meter_count += energy_kwh
+            charger.meter_cost += cost
+
+        self.energy_kwh += energy_kwh
+        self.cost += cost
+        self.deliveries += 1
+        if self.demand_energy is None:
+            self.demand_energy = self.__bins(self.demand_seconds)
+        self.__spread(self.demand_energy, self.demand_seconds, connector.log_index, energy_kwh, seconds)
+        if self.trace is not None:
+            self.__spread(self.trace, self.trace_seconds, connector.log_index, energy_kwh, seconds)
+
+    def __bins(self, width) -> np.ndarray:
+        """
+        (connectors, bins) zeros covering the schedule in bins of width
+        seconds, plus one for deliveries metered at the very end
+        """
+        horizon = (self.state.end_schedule - self.state.start_schedule).total_seconds()
+        return np.zeros((len(self.state.connector_arrays.connectors), int(np.ceil(horizon / width)) + 1))
+
+    def record_traces(self, trace_seconds=60) -> None:
+        """
+        keep the energy every connector delivers per trace_seconds bin
+        from now on
+        """
+        self.trace_seconds = trace_seconds
+        self.trace = self.__bins(trace_seconds)
+
+    def __spread(self, bins, width, index, energy_kwh, seconds) -> None:
+        """
+        spread a delivery, priced at the current time, evenly over the
+        bins of width seconds that [current time, current time + seconds)
+        overlaps
+        """
+        begin = (self.state.current_time - self.state.start_schedule).total_seconds()
+        end = begin + seconds
+        first, last = int(begin // width), int((end - 1e-9) // width)
+        num_bins = bins.shape[1]
+        if first == last:
+            if first < num_bins:
+                bins[index, first] += energy_kwh
+            return
+        edges = np.clip(np.arange(first, last + 2) * width, begin, end)
+        overlap = np.diff(edges) / seconds
+        stop = min(last + 1, num_bins)
+        if first < stop:
+            bins[index, first:stop] += energy_kwh * overlap[:stop - first]
+
+    def power_trace(self) -> np.ndarray:
+        """
+        (connectors, bins) average kW drawn in each bin
+        """
+        return self.trace * 3600 / self.trace_seconds
+
+    def flush(self) -> None:
+        """
+        update the connector, charger and depot demand peaks from the
+        interval energy metered so far
+        """
+        if self.demand_energy is None:
+            return
+        arrays = self.state.connector_arrays
+        power = self.demand_energy * 3600 / self.demand_seconds
+        for connector, peak in zip(arrays.connectors, power.max(axis=1).tolist()):
+            connector.meter_peak = peak
+        charger_power = np.zeros((len(arrays.chargers), power.shape[1]))
+        np.add.at(charger_power, arrays.charger_index, power)
+        for charger, peak in zip(arrays.chargers, charger_power.max(axis=1).tolist()):
+            charger.meter_peak = peak
+        self.peak_kw = float(power.sum(axis=0).max())
+
+    def summary(self) -> dict:
+        self.flush()
+        return {"energy_kwh": self.energy_kwh, "cost": self.cost, "peak_kw": self.peak_kw}
+
+    def print_metrics(self):
+        self.flush()
+        metrics = f"""
+        metered energy (kWh): {self.energy_kwh}
+        metered cost: {self.cost}
+        metered peak (kW, {self.demand_seconds // 60:g} minute demand): {self.peak_kw}
+        deliveries metered: {self.deliveries}
+        """
+        print(metrics)
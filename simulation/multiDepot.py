@@ -0,0 +1,303 @@
+"""
+Several depots sharing utility feeders, simulated in parallel.
+
+Depots are sharded across worker processes, each of which steps the
+SimState and decision maker of its depots one timestep at a time. At
+every slot boundary the workers report how much power each depot could
+use over the next slot (connected buses that still need energy, at most
+their connector power) and the coordinator splits every feeder's kW
+limit between its depots by max-min fair water filling: depots below the
+water level get what they asked for, the rest get the level. Each depot
+enforces its allocation by spreading it over its chargers as cabinet
+limits, which rates are clamped and projected onto for the whole slot.
+Only a few numbers per depot cross process boundaries per slot, so the
+run takes about as long as its slowest shard.
+
+Every depot draws from its own generators: a seeded depot runs on a
+FrozenScenario of its seed, and each depot keeps its own copy of the
+global numpy state for whatever its decision maker draws, so a depot's
+results do not depend on which depots share its worker.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import time
+import traceback
+from datetime import timedelta
+
+import numpy as np
+
+from crnHarness import FrozenScenario
+from main import Main, START_TIME, END_TIME
+
+WORKER_TIMEOUT = 600    # seconds to wait for a worker's reply before giving up on it
+
+
+def water_fill(demands, limit) -> tuple[np.ndarray, float]:
+    """
+    max-min fair split of limit kW between demands, and the water level
+    (inf when every demand fits)
+    """
+    demands = np.asarray(demands, dtype=float)
+    if demands.sum() <= limit:
+        return demands.copy(), float("inf")
+    ordered = np.sort(demands)
+    # level if every depot from i on is capped at it
+    below = np.concatenate(([0.0], np.cumsum(ordered)[:-1]))
+    levels = (limit - below) / np.arange(len(ordered), 0, -1)
+    fits = levels <= ordered
+    level = float(levels[np.argmax(fits)])
+    return np.minimum(demands, level), level
+
+
+class DepotRunner:
+    """
+    one depot inside a worker: its Main (for the SimState and decision
+    maker) stepped a slot at a time under a kW allocation
+    """
+
+    def __init__(self, config: dict):
+        self.name = config.pop("name")
+        self.feeder = config.pop("feeder", "feeder")
+        if config.get("adaptive"):
+            raise ValueError(f"Depot {self.name}: multi-depot runs step one timestep at a time, adaptive=True is not supported")
+        if config.get("d_maker", "").lower() in ("rl", "rl-warm"):
+            raise ValueError(f"Depot {self.name}: rlDM plans whole slots through apply_action and cannot be stepped per timestep")
+        if config.get("seed") is not None and config.get("scenario") is None:
+            config["scenario"] = FrozenScenario(config["num_buses"], config["seed"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.main = Main(**config)
+        self.random_state = np.random.get_state()    # this depot's global numpy stream
+        self.state = self.main.sim_state
+        self.arrays = self.state.connector_arrays
+        self.base_limits = self.arrays.cabinet_limit.copy()    # cabinet limits of the charger types
+        self.busy_seconds = 0.0
+
+    def charger_demand(self, slot_seconds) -> np.ndarray:
+        """
+        kW every charger could use over the next slot: for each connected
+        bus below its desired SOC, its remaining energy spread over the
+        slot, at most the connector's max power
+        """
+        hours = slot_seconds / 3600
+        needs = np.zeros(len(self.arrays.connectors))
+        for i, connector in enumerate(self.arrays.connectors):
+            bus = connector.connected_to
+            if bus is not None:
+                remaining = bus.battery_capacity * (bus.desired_soc - bus.current_soc()) / 100
+                needs[i] = min(connector.max_power_out, max(0.0, remaining) / hours)
+        return np.bincount(self.arrays.charger_index, needs, minlength=len(self.arrays.chargers))
+
+    def allocate(self, allocation_kw, charger_demand) -> None:
+        """
+        split the depot allocation over its chargers in proportion to
+        their demand (no extra limit when it is inf) and project the
+        rates the decision maker last asked for onto it
+        """
+        total = charger_demand.sum()
+        if np.isinf(allocation_kw):
+            limits = self.base_limits
+        elif total > 0:
+            limits = np.minimum(self.base_limits, charger_demand * (allocation_kw / total))
+        else:
+            limits = np.zeros_like(charger_demand)
+        self.arrays.set_cabinet_limits(limits)
+        self.arrays.apply([connector.requested_power for connector in self.arrays.connectors])
+
+    def advance(self, timesteps) -> np.ndarray:
+        """
+        step timesteps and return the depot draw (kW) of each
+        """
+        begin = time.perf_counter()
+        np.random.set_state(self.random_state)
+        scale = self.state.price_schedule.timestep_duration
+        draws = np.zeros(timesteps)
+        for t in range(timesteps):
+            if self.state.current_time >= self.state.end_schedule:
+                break
+            self.state.current_time += timedelta(seconds=scale)
+            self.main.d_maker.update_chargers(1)
+            draws[t] = sum(connector.curr_power_delivery for connector in self.arrays.connectors
+                           if connector.connected_to is not None)
+            for bus in self.state.buses:
+                if bus.arrival_time == self.state.current_time:
+                    self.state.connect_arrival(bus)
+                if bus.departure_time == self.state.current_time:
+                    self.state.disconnect_departure(bus)
+        self.random_state = np.random.get_state()
+        self.busy_seconds += time.perf_counter() - begin
+        return draws
+
+    def summary(self) -> dict:
+        summary = self.main.summary()
+        summary.update({"name": self.name, "feeder": self.feeder, "busy_seconds": self.busy_seconds})
+        return summary
+
+
+def _worker(connection, configs, slot_seconds) -> None:
+    """
+    worker loop: report demand, wait for allocations, step a slot, repeat.
+    Replies are ("ok", payload), or ("error", traceback) once anything raises.
+    """
+    try:
+        runners = [DepotRunner(dict(config)) for config in configs]
+        timesteps = slot_seconds // runners[0].state.price_schedule.timestep_duration
+        demands = [runner.charger_demand(slot_seconds) for runner in runners]
+        connection.send(("ok", [float(demand.sum()) for demand in demands]))
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            draws = []
+            for runner, allocation, demand in zip(runners, message, demands):
+                runner.allocate(allocation, demand)
+                draws.append(runner.advance(timesteps))
+            demands = [runner.charger_demand(slot_seconds) for runner in runners]
+            connection.send(("ok", (np.array(draws), [float(demand.sum()) for demand in demands])))
+        connection.send(("ok", [runner.summary() for runner in runners]))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+class MultiDepotCoordinator:
+
+    def __init__(self, depots: list[dict], feeder_limits: dict, slot_minutes=15, processes=None):
+        self.depots        = depots              # Main keyword arguments plus "name" and "feeder"
+        self.feeder_limits = feeder_limits       # feeder -> kW limit
+        self.slot_seconds  = slot_minutes * 60
+        self.processes     = min(processes or multiprocessing.cpu_count(), len(depots))
+        self.shards        = self.__shard()
+        self.feeder_of     = [depot.get("feeder", "feeder") for depot in depots]
+        self.levels        = []                  # water level of every feeder at every slot
+        self.feeder_draw   = {}                  # feeder -> kW drawn at every timestep
+        self.summaries     = []
+        self.wall_seconds  = 0.0
+
+    def __shard(self) -> list[list[int]]:
+        """
+        longest processing time first: biggest depot to the least
+        loaded worker
+        """
+        shards = [[] for _ in range(self.processes)]
+        loads = np.zeros(self.processes)
+        for depot in sorted(range(len(self.depots)), key=lambda d: -self.depots[d]["num_buses"]):
+            worker = int(np.argmin(loads))
+            shards[worker].append(depot)
+            loads[worker] += self.depots[depot]["num_buses"]
+        return [shard for shard in shards if shard]
+
+    def __allocate(self, demands) -> np.ndarray:
+        allocations = np.zeros(len(demands))
+        levels = {}
+        for feeder, limit in self.feeder_limits.items():
+            members = [d for d, name in enumerate(self.feeder_of) if name == feeder]
+            allocations[members], levels[feeder] = water_fill(demands[members], limit)
+            if np.isinf(levels[feeder]):
+                # the feeder is not binding: leave its depots unconstrained
+                allocations[members] = np.inf
+        self.levels.append(levels)
+        return allocations
+
+    def __receive(self, connection, worker, shard):
+        """
+        the next reply of a worker; raises if it failed, died or went quiet
+        """
+        names = ", ".join(self.depots[d]["name"] for d in shard)
+        waited = 0.0
+        while not connection.poll(1.0):
+            waited += 1.0
+            if not worker.is_alive():
+                raise RuntimeError(f"Worker for depots {names} exited with code {worker.exitcode}")
+            if waited >= WORKER_TIMEOUT:
+                raise RuntimeError(f"Worker for depots {names} did not reply in {WORKER_TIMEOUT} s")
+        try:
+            status, payload = connection.recv()
+        except EOFError:
+            raise RuntimeError(f"Worker for depots {names} closed its pipe (exit code {worker.exitcode})") from None
+        if status == "error":
+            raise RuntimeError(f"Worker for depots {names} failed:\n{payload}")
+        return payload
+
+    def run(self) -> list[dict]:
+        begin = time.perf_counter()
+        horizon = int((END_TIME - START_TIME).total_seconds())
+        num_slots = -(-horizon // self.slot_seconds)
+        workers, connections = [], []
+        for shard in self.shards:
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_worker, args=(child, [self.depots[d] for d in shard], self.slot_seconds))
+            worker.start()
+            # only the worker holds the child end, so its exit closes the pipe
+            child.close()
+            workers.append(worker)
+            connections.append(parent)
+
+        try:
+            demands = np.zeros(len(self.depots))
+            for shard, connection, worker in zip(self.shards, connections, workers):
+                demands[shard] = self.__receive(connection, worker, shard)
+            draws = [[] for _ in self.depots]
+            for _ in range(num_slots):
+                allocations = self.__allocate(demands)
+                for shard, connection in zip(self.shards, connections):
+                    connection.send(allocations[shard].tolist())
+                for shard, connection, worker in zip(self.shards, connections, workers):
+                    shard_draws, shard_demands = self.__receive(connection, worker, shard)
+                    demands[shard] = shard_demands
+                    for d, draw in zip(shard, shard_draws):
+                        draws[d].append(draw)
+
+            summaries = [None] * len(self.depots)
+            for shard, connection, worker in zip(self.shards, connections, workers):
+                connection.send(None)
+                for d, summary in zip(shard, self.__receive(connection, worker, shard)):
+                    summaries[d] = summary
+        finally:
+            for connection, worker in zip(connections, workers):
+                connection.close()
+                worker.join(timeout=1)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+        for feeder in self.feeder_limits:
+            members = [d for d, name in enumerate(self.feeder_of) if name == feeder]
+            self.feeder_draw[feeder] = sum(np.concatenate(draws[d]) for d in members)
+        self.summaries = summaries
+        self.wall_seconds = time.perf_counter() - begin
+        return summaries
+
+    def print_metrics(self):
+        slowest = max(summary["busy_seconds"] for summary in self.summaries)
+        feeders = "".join(f"""
+        {feeder}: peak {self.feeder_draw[feeder].max():.1f} kW of {limit} kW limit, """
+                          f"""constrained in {sum(np.isfinite(levels[feeder]) for levels in self.levels)} of {len(self.levels)} slots"""
+                          for feeder, limit in self.feeder_limits.items())
+        metrics = f"""
+        depots: {len(self.depots)} on {len(self.shards)} workers
+        wall time (s): {self.wall_seconds:.2f}
+        slowest depot stepping time (s): {slowest:.2f}
+        total cost: {sum(summary["cost"] for summary in self.summaries):.2f}{feeders}
+        """
+        print(metrics)
+
+
+if __name__ == "__main__":
+    depots = [
+        {"name": "north", "feeder": "A", "d_maker": "naive", "num_chargers": 16, "num_buses": 32, "seed": 0},
+        {"name": "south", "feeder": "A", "d_maker": "llf",   "num_chargers": 12, "num_buses": 24, "seed": 1},
+        {"name": "east",  "feeder": "B", "d_maker": "naive", "num_chargers": 8,  "num_buses": 16, "seed": 2},
+        {"name": "west",  "feeder": "B", "d_maker": "hierarchical", "num_chargers": 8, "num_buses": 16, "seed": 3},
+    ]
+    for depot in depots:
+        depot["event_level"] = "off"
+    limits = {"A": 1500, "B": 800}
+    for processes in (1, len(depots)):
+        coordinator = MultiDepotCoordinator(depots, limits, processes=processes)
+        coordinator.run()
+        coordinator.print_metrics()
+        for summary in coordinator.summaries:
+            print(f"        {summary['name']:>6}: ${summary['cost']:.2f}, median departure SOC {np.median(summary['departure_soc']):.1f}%")
@@ -1,16 +1,31 @@
 from decisionMaker import DecisionMaker
 from simspace import SimState
-from datetime import timedelta
+from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import typing
 class NaiveDM(DecisionMaker):
-    def __init__(self, sim_state):
+    def __init__(self, sim_state, cache_decisions=True):
         super().__init__(sim_state)
-        self.charge_rate = [[] for bus in self.state.buses]
+        self.charge_rate_runs = [[] for bus in self.state.buses]   # run-length encoded [rate, timesteps] per bus
         self.cost = 0
+        self.decision_interval = 60     # longest time (s) a rate is held in adaptive stepping
+        self.cache_decisions = cache_decisions
+        self.decisions = {}             # connector -> (bus, rate, time the rate must be recomputed)
+        self.next_refresh = self.state.start_schedule
+
+    @property
+    def charge_rate(self) -> list[list[float]]:
+        """
+        per timestep charge rate history of every bus, expanded from the
+        run-length encoded record
+        """
+        return [[rate for rate, count in runs for _ in range(count)] for runs in self.charge_rate_runs]
 
     def update_chargers(self, timesteps) -> None:
-        self.__calc_charge_rates()
+        if self.cache_decisions:
+            self.__refresh_stale_rates(timesteps)
+        else:
+            self.__calc_charge_rates(timesteps)
 
         right_now = self.state.current_time
         curr_power_price = self.state.price_schedule.get_current_price(right_now)
@@ -19,27 +34,104 @@ class NaiveDM(DecisionMaker):
             for connector in charger.connectors:
                 power_delivered = connector.deliver_power(timesteps)
                 self.cost += curr_power_price * power_delivered        
-    def __calc_charge_rates(self) -> None: 
+    def __calc_charge_rates(self, timesteps) -> None: 
         right_now = self.state.current_time
         for charger in self.state.chargers:
             for connector in charger.connectors:
                 if connector.connected_to != None:
                     bus = connector.connected_to
-                    if bus.current_soc() >= bus.desired_soc:
-                        connector.update_charge_rate(0)
-                        self.charge_rate[bus.id].append(0)
-                    else:
-                        hours_remaining = (bus.departure_time - right_now).seconds // 3600
-                        soc_delta = bus.desired_soc - bus.current_soc()
-               # calculate lowest charge rate which will charge the bus by the desired end time
-                        if hours_remaining == 0 or soc_delta < 0:
-                            connector.update_charge_rate(0)
-                            self.charge_rate[bus.id].append(0)
-                        else:
-                            charge_rate = ((soc_delta * bus.battery_capacity) / (hours_remaining * 100))
-                            connector.update_charge_rate(charge_rate)
-                            self.charge_rate[bus.id].append(charge_rate)
+                    self.__record_rate(bus, self.__decide_rate(connector, bus, right_now), timesteps)
+
+    def __refresh_stale_rates(self, timesteps) -> None:
+        """
+        only recompute the rate of a connector when a bus has just been
+        plugged in, the whole hours left before its departure ticked down
+        or it reached its desired SOC; otherwise keep the cached rate
+        """
+        right_now = self.state.current_time
+        refresh_due = right_now >= self.next_refresh
+        changed = False
+        for charger in self.state.chargers:
+            for connector in charger.connectors:
+                bus = connector.connected_to
+                if bus is None:
+                    continue
+                decision = self.decisions.get(connector)
+                if decision is None or decision[0] is not bus or (refresh_due and right_now >= decision[2]):
+                    rate = self.__decide_rate(connector, bus, right_now)
+                    decision = (bus, rate, self.__refresh_time(connector, bus, right_now))
+                    self.decisions[connector] = decision
+                    changed = True
+                self.__record_rate(bus, decision[1], timesteps)
+
+        if changed or refresh_due:
+            self.next_refresh = min(
+                (refresh_at for bus, _, refresh_at in self.decisions.values()
+                 if bus.departure_time > right_now),
+                default=self.state.end_schedule
+            )
+
+    def __decide_rate(self, connector, bus, right_now) -> float:
+        """
+        set the lowest charge rate which will charge the bus by its
+        departure time and return it
+        """
+        if bus.current_soc() >= bus.desired_soc:
+            connector.update_charge_rate(0)
+            return 0
+        hours_remaining = (bus.departure_time - right_now).seconds // 3600
+        soc_delta = bus.desired_soc - bus.current_soc()
+        # calculate lowest charge rate which will charge the bus by the desired end time
+        if hours_remaining == 0 or soc_delta < 0:
+            connector.update_charge_rate(0)
+            return 0
+        charge_rate = ((soc_delta * bus.battery_capacity) / (hours_remaining * 100))
+        connector.update_charge_rate(charge_rate)
+        return charge_rate
+
+    def __refresh_time(self, connector, bus, right_now) -> datetime:
+        """
+        time at which the rate of connector next changes: when the whole
+        hours left before departure tick down, or when the bus reaches its
+        desired SOC at the current rate
+        """
+        seconds_left = (bus.departure_time - right_now).seconds
+        if seconds_left < 3600:
+            # no whole hours left, the rate stays at 0 until departure
+            refresh_at = self.state.end_schedule
+        else:
+            refresh_at = right_now + timedelta(seconds=seconds_left % 3600 + 1)
+        soc_delta = bus.desired_soc - bus.current_soc()
+        if soc_delta > 0 and connector.curr_power_delivery > 0:
+            seconds_to_desired = soc_delta * bus.battery_capacity * 36 / connector.curr_power_delivery
+            refresh_at = min(refresh_at, right_now + timedelta(seconds=max(1, int(seconds_to_desired))))
+        return refresh_at
 
+    def __record_rate(self, bus, rate, timesteps) -> None:
+        runs = self.charge_rate_runs[bus.id]
+        if runs and runs[-1][0] == rate:
+            runs[-1][1] += timesteps
+        else:
+            runs.append([rate, timesteps])
+
+    def next_decision_time(self) -> datetime:
+        """
+        the naive rate of a bus jumps when the whole hours left before its
+        departure tick down or when it reaches its desired SOC. With cached
+        decisions the rate is held until then; otherwise it drifts slowly
+        as the SOC rises, so it is refreshed every decision_interval
+        """
+        right_now = self.state.current_time
+        if self.cache_decisions:
+            return max(self.next_refresh, right_now + timedelta(seconds=self.state.price_schedule.timestep_duration))
+
+        next_time = right_now + timedelta(seconds=self.decision_interval)
+        for charger in self.state.chargers:
+            for connector in charger.connectors:
+                if connector.connected_to is None:
+                    continue
+                next_time = min(next_time, self.__refresh_time(connector, connector.connected_to, right_now))
+        return next_time
 
     def plot_bus_charge_rates(self):
         for i, row in enumerate(self.charge_rate):
@@ -62,3 +154,26 @@ class NaiveDM(DecisionMaker):
         plt.grid(True)
         plt.show()
 
+
+if __name__ == "__main__":
+    import time
+    import numpy as np
+    from datetime import datetime
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+    for cache_decisions in (False, True):
+        np.random.seed(0)
+        sim_state = SimState(start_time, end_time, num_chargers=32, num_buses=64)
+        naive = NaiveDM(sim_state, cache_decisions=cache_decisions)
+        for bus in sim_state.buses:
+            for charger in sim_state.chargers:
+                if charger.connect_bus(bus, verbose=False):
+                    break
+        begin = time.perf_counter()
+        for _ in range(3600):
+            sim_state.current_time += timedelta(seconds=1)
+            naive.update_chargers(1)
+        elapsed = time.perf_counter() - begin
+        runs = sum(len(bus_runs) for bus_runs in naive.charge_rate_runs)
+        print(f"cache decisions {cache_decisions}: {elapsed:.2f}s per simulated hour, cost ${naive.cost:.2f}, {runs} stored rate runs")
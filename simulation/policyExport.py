@@ -0,0 +1,120 @@
+"""
+Export trained rlDM policies to plain numpy arrays and run them without
+torch or stable_baselines3.
+
+export_policy writes the weights of the policy half of a PPO MlpPolicy
+(policy_net layers followed by action_net) and the action bounds to a
+compressed .npz file. NumpyPolicy loads that file and evaluates the
+deterministic action for a single observation or a batch of them, with
+the same predict interface as the stable_baselines3 model.
+"""
+
+import numpy as np
+
+
+ACTIVATIONS = {
+    "Tanh":     np.tanh,
+    "ReLU":     lambda x: np.maximum(x, 0),
+    "Identity": lambda x: x,
+}
+
+
+def export_policy(model, path) -> None:
+    """
+    serialize the deterministic actor of a trained stable_baselines3
+    PPO MlpPolicy to path
+    """
+    policy = model.policy
+    layers = [module for module in policy.mlp_extractor.policy_net if hasattr(module, "weight")]
+    activation = policy.activation_fn.__name__
+    if activation not in ACTIVATIONS:
+        raise NotImplementedError(f"Activation {activation} is not supported by NumpyPolicy")
+
+    arrays = {}
+    for i, layer in enumerate(layers + [policy.action_net]):
+        arrays[f"weight_{i}"] = layer.weight.detach().cpu().numpy().astype(np.float32)
+        arrays[f"bias_{i}"] = layer.bias.detach().cpu().numpy().astype(np.float32)
+    np.savez_compressed(
+        path,
+        num_layers=len(layers) + 1,
+        activation=activation,
+        action_low=model.action_space.low.astype(np.float32),
+        action_high=model.action_space.high.astype(np.float32),
+        **arrays,
+    )
+
+
+class NumpyPolicy:
+    """
+    deterministic MLP policy evaluated with numpy only
+    """
+
+    def __init__(self, weights, biases, activation, action_low, action_high):
+        self.weights:     list[np.ndarray] = weights
+        self.biases:      list[np.ndarray] = biases
+        self.activation                    = ACTIVATIONS[activation]
+        self.action_low:  np.ndarray       = action_low
+        self.action_high: np.ndarray       = action_high
+
+    @classmethod
+    def load(cls, path) -> "NumpyPolicy":
+        with np.load(path) as exported:
+            num_layers = int(exported["num_layers"])
+            # store transposed so a batch is a row-major matmul
+            weights = [np.ascontiguousarray(exported[f"weight_{i}"].T) for i in range(num_layers)]
+            biases = [exported[f"bias_{i}"] for i in range(num_layers)]
+            return cls(weights, biases, str(exported["activation"]),
+                       exported["action_low"], exported["action_high"])
+
+    def predict(self, observation, deterministic=True):
+        """
+        actions for one observation or a (batch, observation size) array,
+        clipped to the action space like stable_baselines3 does. Returns
+        (actions, None) to match model.predict.
+        """
+        hidden = np.asarray(observation, dtype=np.float32)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            hidden = self.activation(hidden @ weight + bias)
+        actions = hidden @ self.weights[-1] + self.biases[-1]
+        return np.clip(actions, self.action_low, self.action_high), None
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    from datetime import datetime
+
+    begin = time.perf_counter()
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.env_util import make_vec_env
+    from simspace import SimState
+    from rlDM import BusDepotEnv
+    framework_import = time.perf_counter() - begin
+
+    sim_state = SimState(datetime.fromisoformat('2024-12-06T19:00:00'),
+                         datetime.fromisoformat('2024-12-07T06:00:00'), num_chargers=8, num_buses=16)
+    model = PPO("MlpPolicy", make_vec_env(lambda: BusDepotEnv(sim_state), n_envs=1))
+    path = os.path.join(tempfile.mkdtemp(), "policy.npz")
+    export_policy(model, path)
+
+    begin = time.perf_counter()
+    numpy_policy = NumpyPolicy.load(path)
+    numpy_load = time.perf_counter() - begin
+
+    observations = np.random.rand(4096, model.observation_space.shape[0]).astype(np.float32)
+    expected = np.stack([model.predict(observation, deterministic=True)[0] for observation in observations[:256]])
+    actual, _ = numpy_policy.predict(observations[:256])
+    print(f"max action difference: {np.max(np.abs(expected - actual)):.2e}")
+
+    for name, predict in (("stable_baselines3", model.predict), ("numpy", numpy_policy.predict)):
+        begin = time.perf_counter()
+        for observation in observations[:1000]:
+            predict(observation, deterministic=True)
+        single = (time.perf_counter() - begin) / 1000
+        print(f"{name:>18}: {single * 1e6:7.1f} us per decision")
+
+    begin = time.perf_counter()
+    numpy_policy.predict(observations)
+    print(f"{'numpy batch':>18}: {(time.perf_counter() - begin) / len(observations) * 1e6:7.2f} us per observation")
+    print(f"startup: {framework_import * 1e3:.0f} ms importing torch/stable_baselines3, {numpy_load * 1e3:.1f} ms loading the numpy policy")
@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta, time
+from typing import Optional
+from tariff import Tariff, TariffIndex
 
 
 class PriceSchedule:
@@ -6,8 +8,15 @@ class PriceSchedule:
     from chatGPT:
     * Energy charges for large commercial customers are approximately 2.6 to 5.8 cents per kWh, with lower rates for off-peak usage
     * Demand charges (for peak power usage) range from $12 to $15 per kW depending on the time of year and service type
+
+    Pass a Tariff (see tariff.py) to price with arbitrary time-of-use,
+    seasonal and demand charges; otherwise the weekday two window
+    on/off peak tariff is used.
     """
-    def __init__(self, timestep_duration, off_peak_rate, on_peak_rate, start_schedule, stop_schedule):
+    def __init__(self, timestep_duration, off_peak_rate, on_peak_rate, start_schedule, stop_schedule,
+                 tariff: Optional[Tariff] = None):
+        self.tariff:            Tariff      = tariff if tariff is not None else Tariff.time_of_use(off_peak_rate, on_peak_rate)
+        self.tariff_index:      TariffIndex = self.tariff.compile(start_schedule, stop_schedule)
         self.on_peak_rate:      float       = on_peak_rate
         self.off_peak_rate:     float       = off_peak_rate
         self.start_schedule:    datetime    = start_schedule
@@ -36,36 +45,40 @@ class PriceSchedule:
         return price_schedule
 
 
+    def slot_prices(self, slot_seconds: int) -> list[float]:
+        """
+        price at the start of each slot_seconds long slot of the
+        simulation; slot_prices(3600) is the hourly price_schedule
+        """
+        num_slots = int((self.stop_schedule - self.start_schedule).total_seconds()) // slot_seconds
+        return self.tariff_index.prices(num_slots, slot_seconds).tolist()
+
+
     def get_current_price(self, curr_datetime: datetime):
         """
-        use the prices list to extract the price based on the current time
-        return the price float value. Checks if current time is within
-        peak pricing window and returns price accordingly.
+        use the compiled tariff to look up the price at the current time
+        return the price float value.
 
+        Default tariff:
         On-peak window: 6AM-9AM, 6PM-10PM M-F
         Off-peak window: all other times
         """
+        return self.tariff_index.price_at(curr_datetime)
 
-        is_weekday = curr_datetime.weekday() < 5
 
-        if not is_weekday:
-            return self.off_peak_rate
-
-        curr_timestamp = curr_datetime.time()
-        morning_peak = time(6,0), time(9,0)
-        evening_peak = time(18, 0), time(22, 0)
-
-        if morning_peak[0] <= curr_timestamp <= morning_peak[1] or\
-                evening_peak[0] <= curr_timestamp <= evening_peak[1]:
-                    return self.on_peak_rate
-        else:
-            return self.off_peak_rate
+    def next_price_change(self, curr_datetime: datetime) -> datetime:
+        """
+        return the first instant after curr_datetime at which
+        get_current_price may return a different value
+        """
+        return self.tariff_index.next_change(curr_datetime)
 
 
     def print_metrics(self):
         metrics = f"""
         schedule start: {self.start_schedule}
         schedule stop: {self.stop_schedule}
+        tariff: {self.tariff.name}
         on peak rate: {self.on_peak_rate}
         off peak rate: {self.off_peak_rate}
         timestep Duration: {self.timestep_duration}
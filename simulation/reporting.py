@@ -0,0 +1,192 @@
+"""
+Fleet size independent reports of a simulation run.
+
+Per-bus telemetry is reduced with numpy before anything is drawn: time is
+averaged into at most max_points bins, the fleet into percentile bands
+or at most max_rows heatmap rows, so each figure draws a fixed number of
+artists whether the depot has 16 buses or 10,000. Figures are built on
+matplotlib's Figure object and saved straight to image files without
+going through pyplot or an interactive backend.
+"""
+
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _bin_edges(length: int, max_bins: int) -> np.ndarray:
+    """
+    start index of every bin when splitting length samples into at most
+    max_bins contiguous bins of (nearly) equal size
+    """
+    return np.unique(np.linspace(0, length, min(length, max_bins) + 1).astype(int))[:-1]
+
+
+def decimate(values, max_points: int = 1000, axis: int = -1, reduce=np.add) -> np.ndarray:
+    """
+    mean (or, with reduce=np.maximum / np.minimum, the envelope) of
+    values over at most max_points contiguous bins along axis
+    """
+    values = np.asarray(values, dtype=float)
+    length = values.shape[axis]
+    if length == 0:
+        return values
+    edges = _bin_edges(length, max_points)
+    reduced = reduce.reduceat(values, edges, axis=axis)
+    if reduce is np.add:
+        counts = np.diff(np.append(edges, length))
+        shape = [1] * values.ndim
+        shape[axis] = len(counts)
+        reduced /= counts.reshape(shape)
+    return reduced
+
+
+def padded_matrix(rows) -> np.ndarray:
+    """
+    (rows, longest row) array of ragged per-bus series, padded with nan
+    """
+    rows = [np.asarray(row, dtype=float) for row in rows]
+    matrix = np.full((len(rows), max((len(row) for row in rows), default=0)), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+
+def plot_percentile_bands(ax, x, matrix, percentiles=PERCENTILES, max_points=1000, color="tab:blue"):
+    """
+    shade the spread of matrix (buses, time) between symmetric
+    percentiles and draw the median, after decimating time
+    """
+    x = decimate(x, max_points)
+    with np.errstate(invalid="ignore"):
+        bands = np.nanpercentile(decimate(matrix, max_points), percentiles, axis=0)
+    middle = len(percentiles) // 2
+    for i in range(middle):
+        alpha = 0.15 + 0.2 * i / max(1, middle - 1)
+        ax.fill_between(x, bands[i], bands[-i - 1], color=color, alpha=alpha, linewidth=0,
+                        label=f"p{percentiles[i]}-p{percentiles[-i - 1]}")
+    ax.plot(x, bands[middle], color=color, linewidth=1.5, label=f"p{percentiles[middle]}")
+    ax.legend(loc="best")
+    ax.grid(True)
+
+
+def plot_heatmap(fig, ax, x, matrix, label, max_points=1000, max_rows=256, cmap="viridis"):
+    """
+    bus x time heatmap of matrix with buses averaged into at most
+    max_rows rows and time into at most max_points columns
+    """
+    num_buses = matrix.shape[0]
+    with np.errstate(invalid="ignore"):
+        # nan (not yet recorded) samples are excluded from the row means
+        filled = decimate(np.nan_to_num(matrix), max_points)
+        counts = decimate(~np.isnan(matrix), max_points)
+        cells = decimate(filled, max_rows, axis=0) / decimate(counts, max_rows, axis=0)
+    x = np.asarray(x, dtype=float)
+    extent = (x[0], x[-1], num_buses, 0) if len(x) else None
+    image = ax.imshow(cells, aspect="auto", interpolation="nearest", cmap=cmap, extent=extent)
+    fig.colorbar(image, ax=ax, label=label)
+    ax.set_ylabel("bus")
+
+
+def plot_depot_total(ax, x, power_kw, max_points=1000):
+    """
+    depot power with the per-bin minimum and maximum so decimation
+    never hides a peak
+    """
+    x = decimate(x, max_points)
+    ax.fill_between(x, decimate(power_kw, max_points, reduce=np.minimum),
+                    decimate(power_kw, max_points, reduce=np.maximum),
+                    color="tab:orange", alpha=0.3, linewidth=0, label="min-max")
+    ax.plot(x, decimate(power_kw, max_points), color="tab:orange", label="mean")
+    ax.set_ylabel("depot power (kW)")
+    ax.legend(loc="best")
+    ax.grid(True)
+
+
+def _save(fig, report_dir, name) -> str:
+    path = os.path.join(report_dir, name)
+    fig.savefig(path, dpi=120, bbox_inches="tight")
+    return path
+
+
+def write_report(main, report_dir, max_points=1000, max_rows=256) -> list[str]:
+    """
+    render the SOC, charge rate and depot power figures of a finished
+    Main run into report_dir and return the paths written
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    hours = np.asarray(main.time_points, dtype=float) / 3600
+    soc = np.asarray(main.soc_data, dtype=float)
+    charge_rate = padded_matrix(main.d_maker.charge_rate)
+    decision_steps = np.arange(charge_rate.shape[1])
+    paths = []
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    plot_percentile_bands(ax, hours, soc, max_points=max_points)
+    ax.set_xlabel("hours since start")
+    ax.set_ylabel("state of charge (%)")
+    ax.set_title(f"SOC across {len(soc)} buses")
+    paths.append(_save(fig, report_dir, "soc_bands.png"))
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    plot_heatmap(fig, ax, hours, soc, "state of charge (%)", max_points, max_rows)
+    ax.set_xlabel("hours since start")
+    ax.set_title("SOC by bus")
+    paths.append(_save(fig, report_dir, "soc_heatmap.png"))
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    plot_percentile_bands(ax, decision_steps, charge_rate, max_points=max_points, color="tab:green")
+    ax.set_xlabel("timestep of charge session")
+    ax.set_ylabel("power to deliver (kW)")
+    ax.set_title(f"charge rates across {len(charge_rate)} buses")
+    paths.append(_save(fig, report_dir, "charge_rate_bands.png"))
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    plot_heatmap(fig, ax, decision_steps, charge_rate, "power to deliver (kW)", max_points, max_rows, cmap="magma")
+    ax.set_xlabel("timestep of charge session")
+    ax.set_title("charge rate by bus")
+    paths.append(_save(fig, report_dir, "charge_rate_heatmap.png"))
+
+    fig = Figure(figsize=(10, 4))
+    ax = fig.add_subplot()
+    plot_depot_total(ax, hours, main.power_data, max_points)
+    ax.set_xlabel("hours since start")
+    ax.set_title("depot total")
+    paths.append(_save(fig, report_dir, "depot_power.png"))
+    return paths
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+    from types import SimpleNamespace
+
+    # synthetic telemetry shaped like a Main run: SOC ramps with noise
+    num_points = 4000
+    report_dir = tempfile.mkdtemp()
+    print(f"{'buses':>6} {'reduce s':>9} {'render s':>9}")
+    for num_buses in (16, 256, 4096):
+        ramp = np.linspace(0, 1, num_points)
+        soc = np.clip(np.random.uniform(10, 50, (num_buses, 1)) + 80 * ramp * np.random.uniform(0.5, 1.2, (num_buses, 1)), 0, 100)
+        rates = np.random.uniform(0, 150, (num_buses, num_points // 10))
+        main = SimpleNamespace(time_points=np.arange(num_points) * 10, soc_data=soc,
+                               power_data=rates.sum(axis=0).repeat(10),
+                               d_maker=SimpleNamespace(charge_rate=rates))
+
+        begin = time.perf_counter()
+        decimate(soc)
+        np.nanpercentile(decimate(soc), PERCENTILES, axis=0)
+        reduce_seconds = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        write_report(main, report_dir)
+        print(f"{num_buses:>6} {reduce_seconds:>9.3f} {time.perf_counter() - begin:>9.2f}")
+    print(f"figures written to {report_dir}")
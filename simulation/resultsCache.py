@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from main import Main
+
+
+SOURCE_DIR = Path(__file__).resolve().parent
+# decision makers that train a PPO policy; torch makes them irreproducible even with a numpy seed
+TRAINING_D_MAKERS = ("rl", "rl-warm")
+
+
+def code_version() -> str:
+    """
+    hash every simulator source file so cached results are invalidated
+    as soon as any part of the simulation changes
+    """
+    digest = hashlib.sha256()
+    for source in sorted(SOURCE_DIR.glob("*.py")):
+        digest.update(source.name.encode())
+        digest.update(source.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def cacheable(config: dict) -> bool:
+    """
+    whether config always reproduces the same run: it is seeded and its
+    decision maker does not train a policy (an exported one is fine)
+    """
+    if config.get("seed") is None:
+        return False
+    d_maker = config.get("d_maker", "").lower()
+    return d_maker not in TRAINING_D_MAKERS or (d_maker == "rl" and config.get("policy_path") is not None)
+
+
+class ResultsCache:
+    """
+    Content addressed on-disk store of finished simulation runs.
+
+    Each entry is keyed by the full scenario configuration
+    (decision maker, chargers, buses, seed, tariff) plus the code
+    version, and holds the run summary alongside compressed telemetry.
+    Once the cache grows past max_bytes the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, cache_dir=".sim_cache", max_bytes=512 * 1024 * 1024):
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_bytes: int  = max_bytes
+        self.version:   str  = code_version()
+        self.hits:      int  = 0
+        self.misses:    int  = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, config: dict) -> str:
+        content = {"config": config, "code_version": self.version}
+        if config.get("tariff_path") is not None:
+            # key on what the tariff says, not where it lives
+            content["tariff"] = hashlib.sha256(Path(config["tariff_path"]).read_bytes()).hexdigest()
+        if config.get("policy_path") is not None:
+            content["policy"] = hashlib.sha256(Path(config["policy_path"]).read_bytes()).hexdigest()
+        payload = json.dumps(content, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __path(self, config: dict) -> Path:
+        return self.cache_dir / f"{self.key(config)}.npz"
+
+    def get(self, config: dict) -> Optional[dict]:
+        """
+        return the stored result for config, or None if it has not
+        been computed with the current code version
+        """
+        self.__check(config)
+        path = self.__path(config)
+        if not path.exists():
+            self.misses += 1
+            return None
+
+        with np.load(path) as entry:
+            # the same shape run_sweep returns on a miss
+            result = {
+                "config": json.loads(str(entry["config"])),
+                **json.loads(str(entry["summary"])),
+                "soc":    entry["soc"],
+                "power":  entry["power"],
+            }
+        # mark as recently used for eviction
+        os.utime(path)
+        self.hits += 1
+        return result
+
+    def put(self, config: dict, summary: dict, soc_data, power_data) -> None:
+        """
+        store the summary and telemetry of a finished run
+        """
+        self.__check(config)
+        path = self.__path(config)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as tmp_file:
+            np.savez_compressed(
+                tmp_file,
+                config=json.dumps(config, sort_keys=True),
+                summary=json.dumps(summary),    # every field of Main.summary()
+                soc=np.asarray(soc_data, dtype=np.float32),
+                power=np.asarray(power_data, dtype=np.float32),
+            )
+        # atomic so an interrupted sweep never leaves a half written entry
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def __check(self, config: dict) -> None:
+        if not cacheable(config):
+            raise ValueError(f"Configuration {config} is unseeded or trains a policy, so its runs are not reproducible")
+
+    def evict(self, keep=None) -> None:
+        """
+        remove least recently used entries until the cache fits in
+        max_bytes, never the entry at keep (the one just written)
+        """
+        entries = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.cache_dir.glob("*.npz")]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == keep:
+                continue
+            path.unlink()
+            total -= size
+
+    def print_metrics(self):
+        metrics = f"""
+        cache directory: {self.cache_dir}
+        code version: {self.version}
+        entries: {len(list(self.cache_dir.glob("*.npz")))}
+        hits: {self.hits}
+        misses: {self.misses}
+        """
+        print(metrics)
+
+
+def run_sweep(configs: list[dict], cache: ResultsCache) -> list[dict]:
+    """
+    run every configuration in configs, skipping the ones already in the
+    cache. Each config holds the keyword arguments of Main (d_maker,
+    num_chargers, num_buses, seed, min_rate, max_rate, tariff_path).
+    Configurations that are not cacheable always run and are not stored.
+    """
+    results = []
+    for config in configs:
+        stored = cacheable(config)
+        result = cache.get(config) if stored else None
+        if result is None:
+            main = Main(**config)
+            main.run_sim(plot=False)
+            summary = main.summary()
+            if stored:
+                cache.put(config, summary, main.soc_data, main.power_data)
+            result = {
+                "config": config,
+                **summary,
+                "soc":    np.asarray(main.soc_data, dtype=np.float32),
+                "power":  np.asarray(main.power_data, dtype=np.float32),
+            }
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    cache = ResultsCache()
+    sweep = [
+        {"d_maker": "naive", "num_chargers": 2, "num_buses": 4, "seed": seed, "min_rate": 0.08, "max_rate": 0.24}
+        for seed in range(3)
+    ]
+    for result in run_sweep(sweep, cache):
+        print(f"seed {result['config']['seed']}: cost ${result['cost']:.2f}, peak {result['peak_kw']:.1f} kW")
+    cache.print_metrics()
@@ -2,41 +2,58 @@ from decisionMaker import DecisionMaker
 from datetime import timedelta
 import gym
 from gym import spaces
-from stable_baselines3 import PPO
-from stable_baselines3.common.env_util import make_vec_env
+from fleetKernels import FleetArrays, observation_kernel, reward_kernel
+from policyExport import NumpyPolicy, export_policy
 import numpy as np
 import matplotlib.pyplot as plt
 
 class rlDM(DecisionMaker):
 
-    def __init__(self, sim_state):
+    def __init__(self, sim_state, train_timesteps=10000, warm_start=False, demo_seeds=range(16), policy_path=None,
+                 slot_minutes=60):
         super().__init__(sim_state)
+        if 3600 % (slot_minutes * 60) != 0:
+            raise ValueError(f"slot_minutes must divide an hour, got {slot_minutes}")
+        self.slot_seconds       = slot_minutes * 60   # one decision per slot
         self.num_buses          = len(self.state.buses)
         self.num_time_slots     = self.__get_num_time_slots()
         self.energy_demands     = self.__get_energy_demands()
         self.grid_limit         = 300 # TODO: arbitrary value, test best input
-        self.time_slot_duration = 1   # TODO: another arbitrary value, currently assumes time slots are hours
-        self.electricity_prices = self.state.price_schedule.price_schedule
+        self.time_slot_duration = slot_minutes / 60   # hours
+        self.electricity_prices = self.state.price_schedule.slot_prices(self.slot_seconds)
         self.arrival_times, self.departure_times    = self.__get_bus_times()
         self.charge_rate        = self.__get_charge_rates()
         self.cost               = 0.0
 
+        if policy_path is not None:
+            # deploy an exported policy: numpy only, no training
+            self.depot_env = BusDepotEnv(self.state, self.slot_seconds)
+            self.model = NumpyPolicy.load(policy_path)
+            return
+
+        # stable_baselines3 pulls in torch, so only import it when training
+        from stable_baselines3 import PPO
+        from stable_baselines3.common.env_util import make_vec_env
+
         # train the model upon initialization of the DM
         # Create environment
-        self.env = make_vec_env(lambda: BusDepotEnv(self.state), n_envs=1)
+        self.env = make_vec_env(lambda: BusDepotEnv(self.state, self.slot_seconds), n_envs=1)
+        self.depot_env = self.env.envs[0].unwrapped
 
         # Initialize and train PPO
         self.model = PPO("MlpPolicy", self.env, verbose=1)
+        if warm_start:
+            self.__warm_start(demo_seeds)
         print("training RL model...")
         self.state.print_metrics()
-        self.model.learn(total_timesteps=10000)
+        self.model.learn(total_timesteps=train_timesteps)
         print("model is ready for prediction")
         self.state.reset_simulation()
 
     def plot_bus_charge_rates(self):
         for i, row in enumerate(self.charge_rate):
             plt.plot(row, label=f"bus {i}")
-        plt.xlabel("hour of charge session")
+        plt.xlabel("time slot of charge session")
         plt.ylabel("power to deliver (kW)")
         plt.legend()
         plt.grid(True)
@@ -48,7 +65,7 @@ class rlDM(DecisionMaker):
             for i, element in enumerate(charge_rate):
                 totals[i] += element
         plt.plot(totals)
-        plt.xlabel("hour of charge session")
+        plt.xlabel("time slot of charge session")
         plt.ylabel("total power delivered (kWh)")
         plt.grid(True)
         plt.show()
@@ -59,14 +76,20 @@ class rlDM(DecisionMaker):
         deliver power to bus over timesteps
         """
         # Get the current observation
-        observation = self.env.envs[0].unwrapped.get_observation()  # Assuming single env
+        observation = self.depot_env.get_observation()
         action, _ = self.model.predict(observation, deterministic=True)
         
-        self.state.apply_action(action, verbose=True)
+        self.state.apply_action(action, seconds=self.slot_seconds)
         for i, act in enumerate(action):
             charge_rate = act * self.state.max_power
             self.charge_rate[i][timestep] = charge_rate
-            self.cost += charge_rate * self.electricity_prices[timestep]
+            self.cost += charge_rate * self.time_slot_duration * self.electricity_prices[timestep]
+
+    def export_policy(self, path) -> None:
+        """
+        save the trained policy for torch-free deployment with policy_path
+        """
+        export_policy(self.model, path)
 
     def print_metrics(self):
         metrics = f"""
@@ -96,9 +119,9 @@ class rlDM(DecisionMaker):
     def __get_num_time_slots(self):
         """
         From the simstate stand and end schedule times, get the 
-        number of hours in the simstate
+        number of time slots in the simstate
         """
-        return (self.state.end_schedule - self.state.start_schedule).seconds // 3600
+        return int((self.state.end_schedule - self.state.start_schedule).total_seconds()) // self.slot_seconds
 
 
     def __get_energy_demands(self):
@@ -115,6 +138,19 @@ class rlDM(DecisionMaker):
 
     
 
+    def __warm_start(self, demo_seeds):
+        """
+        pretrain the policy by behavior cloning NaiveDM and rtsoDM
+        demonstrations recorded on depots of the same size
+        """
+        from demonstrations import generate_dataset, behavior_clone
+
+        print("recording demonstrations...")
+        observations, actions = generate_dataset(self.state.num_chargers, self.num_buses, demo_seeds)
+        print(f"behavior cloning on {len(observations)} demonstrated hours...")
+        losses = behavior_clone(self.model, observations, actions)
+        print(f"behavior cloning loss: {losses[0]:.4f} -> {losses[-1]:.4f}")
+
     def __get_charge_rates(self):
         # Dummy rates before training
         return np.zeros((self.num_buses, self.num_time_slots))
@@ -122,10 +158,12 @@ class rlDM(DecisionMaker):
 
 # custom gym env for training RL model (Chat GPT helped on this one)
 class BusDepotEnv(gym.Env):
-    def __init__(self, sim_state):
+    def __init__(self, sim_state, slot_seconds=3600):
         super().__init__()
         self.sim_state = sim_state
+        self.slot_seconds = slot_seconds   # simulated seconds per step
         self.num_buses = len(sim_state.buses)
+        self.fleet = FleetArrays(sim_state)
         
         # Define action and observation spaces
         self.action_space = spaces.Box(
@@ -142,7 +180,7 @@ class BusDepotEnv(gym.Env):
 
     def step(self, action):
         # Apply the action to the simulation
-        self.sim_state.apply_action(action) 
+        self.sim_state.apply_action(action, seconds=self.slot_seconds)
         
         # Get the next state, reward, and done flag
         observation = self.get_observation()
@@ -156,28 +194,11 @@ class BusDepotEnv(gym.Env):
         pass
 
     def get_observation(self):
-        # Example: Combine SOC and grid consumption as the observation
-        socs = [bus.current_soc() for bus in self.sim_state.buses]
-        departures = [int((bus.departure_time - self.sim_state.current_time).total_seconds() // 60) for bus in self.sim_state.buses]
-        grid_pull, energy_price = self.sim_state.get_current_meterics()
-        return np.array(socs + departures + [grid_pull, energy_price], dtype=np.float32)
+        # SOC, time to departure, grid consumption and price, normalized to [0, 1]
+        return observation_kernel(self.fleet)
 
     def calculate_reward(self):
-        unmet_soc_penalty = sum(
-            max(0, bus.desired_soc - bus.current_soc()) for bus in self.sim_state.buses
-        ) / len(self.sim_state.buses)
-        ideal_grid_pull = 0
-        for bus in self.sim_state.buses:
-            time_to_departure = max(0, int((bus.departure_time - self.sim_state.current_time).total_seconds() // 3600)) 
-            capacity = bus.battery_capacity
-            current_charge = bus.get_current_capacity()
-            if time_to_departure != 0:
-                ideal_grid_pull += (capacity - current_charge) // time_to_departure
-
-        grid_pull, energy_price = self.sim_state.get_current_meterics()
-        rate_penalty = np.abs(ideal_grid_pull - grid_pull) / len(self.sim_state.buses)
-        energy_cost = grid_pull * energy_price
-        return - unmet_soc_penalty - (energy_cost / 10) - rate_penalty # reward for being close to the naive approach
+        return reward_kernel(self.fleet) # reward for being close to the naive approach
     
     def seed(self, seed=None):
         self.np_random, seed = gym.utils.seeding.np_random(seed)
@@ -1,21 +1,79 @@
 from decisionMaker import DecisionMaker
 from datetime import timedelta
+import time
 import pygad
 import numpy as np
 import matplotlib.pyplot as plt
+from scenarioSampler import sample_scenarios
 
 class rtsoDM(DecisionMaker):
+    """
+    Plans hourly charge rates with a genetic algorithm.
 
-    def __init__(self, sim_state):
+    With sparse=True (the default) a chromosome only holds the (bus, slot)
+    pairs where the bus is at the depot, and every offspring is repaired
+    so each bus's planned energy meets its demand where the slot bounds
+    allow it. sparse=False keeps the original dense (bus x slot) encoding.
+
+    Planning is anytime: it stops after max_generations, once deadline
+    seconds of wall-clock time have passed, or after stall_generations
+    generations without improvement, whichever comes first, and keeps the
+    best plan seen. self.convergence records every generation.
+
+    slot_minutes sets the planning resolution (60, 15, 5, ... any divisor
+    of an hour). Genes are the energy (kWh) delivered in a slot and
+    charge_rate holds the matching power (kW) per bus and slot.
+
+    With scenarios=K the sparse planner does not trust the buses' drawn
+    arrival, departure and capacity. It samples K scenarios of the noise
+    model and scores each candidate against all of them at once:
+    expected cost and unmet demand plus risk_weight times the mean unmet
+    demand of the worst (1 - risk_alpha) share of scenarios.
+    """
+
+    def __init__(self, sim_state, sparse=True, max_generations=50, deadline=None, stall_generations=None,
+                 slot_minutes=60, scenarios=0, risk_weight=1.0, risk_alpha=0.9, scenario_seed=None):
         super().__init__(sim_state)
+        if scenarios and not sparse:
+            raise ValueError("Scenario planning needs the sparse encoding")
+        if 3600 % (slot_minutes * 60) != 0:
+            raise ValueError(f"slot_minutes must divide an hour, got {slot_minutes}")
+        self.slot_seconds       = slot_minutes * 60
         self.num_buses          = len(self.state.buses)
         self.num_time_slots     = self.__get_num_time_slots()
         self.energy_demands     = self.__get_energy_demands()
         self.grid_limit         = 500 # TODO: arbitrary value, test best input
-        self.time_slot_duration = 1   # TODO: another arbitrary value, currently assumes time slots are hours
-        self.electricity_prices = self.state.price_schedule.price_schedule
+        self.time_slot_duration = slot_minutes / 60   # hours
+        self.slot_grid_limit    = self.grid_limit * self.time_slot_duration   # kWh the depot may draw per slot
+        self.max_slot_energy    = self.slot_grid_limit / self.num_buses
+        self.electricity_prices = self.state.price_schedule.slot_prices(self.slot_seconds)
         self.arrival_times, self.departure_times    = self.__get_bus_times()
-        self.charge_rate        = self.__get_charge_rates(self.__create_gene_space())
+        self.sparse             = sparse
+        self.max_generations    = max_generations
+        self.deadline           = deadline             # wall-clock planning budget (s)
+        self.stall_generations  = stall_generations    # stop after this many generations without improvement
+        self.convergence        = []                   # per generation best/mean fitness, evaluations and time
+        self.stop_reason        = None
+        self.scenarios          = scenarios
+        self.risk_weight        = risk_weight
+        self.risk_alpha         = risk_alpha
+        if scenarios:
+            self.scenario_batch = sample_scenarios(self.state, scenarios, scenario_seed)
+            self.scenario_first, self.scenario_end = self.scenario_batch.slot_windows(self.slot_seconds, self.num_time_slots)
+            availability = self.scenario_batch.availability(self.slot_seconds, self.num_time_slots)
+            # (slots, buses, scenarios) presence for the grid check
+            self.scenario_present = availability.transpose(2, 1, 0).astype(float)
+            self.scenario_demands = self.scenario_batch.energy_demands()
+            self.slot_prices = np.asarray(self.electricity_prices)
+            # a gene for every slot a bus may be at the depot in
+            self.gene_bus, self.gene_slot = np.nonzero(availability.any(axis=0))
+            self.charge_rate    = self.scatter(self.__get_sparse_charge_rates()) / self.time_slot_duration
+        elif sparse:
+            # (bus, slot) of every gene, ordered by bus
+            self.gene_bus, self.gene_slot = np.nonzero(self.__get_availability())
+            self.charge_rate    = self.scatter(self.__get_sparse_charge_rates()) / self.time_slot_duration
+        else:
+            self.charge_rate    = self.__get_charge_rates(self.__create_gene_space()) / self.time_slot_duration
         self.cost = 0.0
 
 
@@ -28,16 +86,23 @@ class rtsoDM(DecisionMaker):
         curr_power_price = self.state.price_schedule.get_current_price(right_now)
 
 
-        for _ in range(timesteps):
-            rate_step = (self.state.current_time - self.state.start_schedule).seconds // 3600
-            for i, bus in enumerate(self.state.buses):
-                # find connector with bus
-                for charger in self.state.chargers:
-                    for connector in charger.connectors:
-                        if connector.connected_to == bus:
-                            connector.update_charge_rate(self.charge_rate[i, rate_step])
-                            power_delivered = connector.deliver_power(timesteps)
-                            self.cost += curr_power_price * power_delivered
+        elapsed = (self.state.current_time - self.state.start_schedule).total_seconds()
+        rate_step = min(int(elapsed // self.slot_seconds), self.num_time_slots - 1)
+        for i, bus in enumerate(self.state.buses):
+            # find connector with bus
+            for charger in self.state.chargers:
+                for connector in charger.connectors:
+                    if connector.connected_to == bus:
+                        connector.update_charge_rate(self.charge_rate[i, rate_step])
+                        power_delivered = connector.deliver_power(timesteps)
+                        self.cost += curr_power_price * power_delivered
+
+    def next_decision_time(self):
+        """
+        the plan only changes rates at the start of each time slot
+        """
+        elapsed = int((self.state.current_time - self.state.start_schedule).total_seconds())
+        return self.state.current_time + timedelta(seconds=self.slot_seconds - elapsed % self.slot_seconds)
 
 
     def print_metrics(self):
@@ -51,6 +116,8 @@ class rtsoDM(DecisionMaker):
         bus arrival times: {self.arrival_times}
         bus departure times: {self.departure_times}
         charge rates for each bus:\n{self.charge_rate}
+        generations run: {len(self.convergence)} (stopped by {self.stop_reason})
+        best fitness: {self.convergence[-1]["best_fitness"] if self.convergence else None}
         """
         print(metrics)
 
@@ -68,9 +135,9 @@ class rtsoDM(DecisionMaker):
     def __get_num_time_slots(self):
         """
         From the simstate stand and end schedule times, get the 
-        number of hours in the simstate
+        number of time slots in the simstate
         """
-        return (self.state.end_schedule - self.state.start_schedule).seconds // 3600
+        return int((self.state.end_schedule - self.state.start_schedule).total_seconds()) // self.slot_seconds
 
 
     def __get_energy_demands(self):
@@ -81,7 +148,8 @@ class rtsoDM(DecisionMaker):
         energy_demands = []
 
         for bus in self.state.buses:
-            energy_demands.append(bus.battery_capacity * (bus.desired_soc - bus.current_soc()))
+            # SOCs are percentages
+            energy_demands.append(bus.battery_capacity * (bus.desired_soc - bus.current_soc()) / 100)
 
         return energy_demands
 
@@ -98,7 +166,8 @@ class rtsoDM(DecisionMaker):
             energy_demands, 
             electricity_prices, 
             grid_limit,
-            start_schedule
+            start_schedule,
+            slot_duration=timedelta(hours=1)
             ):
         """
         Fitness function for GA
@@ -114,7 +183,7 @@ class rtsoDM(DecisionMaker):
                 if charging_schedule[bus, t] < 0:  # Penalize negative charge rates
                     penalty += 1000 * abs(charging_schedule[bus, t])
 
-                right_now = start_schedule + timedelta(hours=t)
+                right_now = start_schedule + t * slot_duration
                 if arrival_times[bus] <= right_now < departure_times[bus]:  # Check if the bus is available
                     energy_delivered += charging_schedule[bus, t]
                 elif charging_schedule[bus, t] > 0:  # Penalize charging outside availability
@@ -143,37 +212,198 @@ class rtsoDM(DecisionMaker):
         for bus in range(self.num_buses):
             bus_gene_space = []
             for t in range(self.num_time_slots):
-                right_now = self.state.start_schedule + timedelta(hours=t)
+                right_now = self.state.start_schedule + timedelta(seconds=t * self.slot_seconds)
                 if self.arrival_times[bus] <= right_now < self.departure_times[bus]:
-                    bus_gene_space.append({'low': 0, 'high': self.grid_limit / self.num_buses})  # Allow charging
+                    bus_gene_space.append({'low': 0, 'high': self.max_slot_energy})  # Allow charging
                 else:
                     bus_gene_space.append(0)  # Force zero when unavailable
             gene_space.extend(bus_gene_space)
         return gene_space
 
 
-    def __get_charge_rates(self, gene_space):
-        num_genes = self.num_buses * self.num_time_slots
+    def __get_availability(self) -> np.ndarray:
+        """
+        (buses, slots) mask of the slots each bus is at the depot for
+        """
+        slot_starts = [self.state.start_schedule + timedelta(seconds=t * self.slot_seconds) for t in range(self.num_time_slots)]
+        return np.array([
+            [arrival <= right_now < departure for right_now in slot_starts]
+            for arrival, departure in zip(self.arrival_times, self.departure_times)
+        ], dtype=bool).reshape(self.num_buses, self.num_time_slots)
+
+    def scatter(self, solution) -> np.ndarray:
+        """
+        dense (buses, slots) charge rate matrix of a sparse solution
+        """
+        charging_schedule = np.zeros((self.num_buses, self.num_time_slots))
+        charging_schedule[self.gene_bus, self.gene_slot] = solution
+        return charging_schedule
+
+    def __sparse_fitness(self, ga_instance, solution, solution_idx) -> float:
+        """
+        the dense fitness on available genes only: energy cost plus
+        penalties for unmet demand and for exceeding the grid limit
+        """
+        total_cost = solution @ self.gene_prices
+        energy_delivered = np.bincount(self.gene_bus, solution, minlength=self.num_buses)
+        penalty = 3000 * np.sum(np.maximum(0, self.demands - energy_delivered))
+        total_energy_per_slot = np.bincount(self.gene_slot, solution, minlength=self.num_time_slots)
+        penalty += 1000 * np.sum(np.maximum(0, total_energy_per_slot - self.slot_grid_limit))
+        return -1 * (total_cost + penalty)
+
+    def __scenario_fitness(self, ga_instance, solutions, solution_idx):
+        return self.scenario_fitness(solutions)
+
+    def scenario_fitness(self, solutions) -> np.ndarray:
+        """
+        fitness of a batch of sparse solutions against every scenario.
+        A bus is available over one contiguous run of slots per scenario,
+        so its delivered energy and cost are differences of prefix sums
+        over its planned row; only the grid check needs a (batched) matmul.
+        """
+        solutions = np.atleast_2d(solutions)
+        plans = np.zeros((len(solutions), self.num_buses, self.num_time_slots))
+        plans[:, self.gene_bus, self.gene_slot] = solutions
+        energy = np.zeros((len(solutions), self.num_buses, self.num_time_slots + 1))
+        np.cumsum(plans, axis=2, out=energy[..., 1:])
+        spend = np.zeros_like(energy)
+        np.cumsum(plans * self.slot_prices, axis=2, out=spend[..., 1:])
+
+        buses = np.arange(self.num_buses)
+        first, end = self.scenario_first, self.scenario_end                              # (scenarios, buses)
+        per_bus = energy[:, buses, end] - energy[:, buses, first]                       # (solutions, scenarios, buses)
+        total_cost = (spend[:, buses, end] - spend[:, buses, first]).sum(axis=2)
+        unmet = np.maximum(0, self.scenario_demands - per_bus).sum(axis=2)
+        # (slots, solutions, scenarios) energy drawn by the buses present
+        per_slot = np.matmul(plans.transpose(2, 0, 1), self.scenario_present)
+        grid_penalty = 1000 * np.maximum(0, per_slot - self.slot_grid_limit).sum(axis=0)
+
+        expected = np.mean(total_cost + 3000 * unmet + grid_penalty, axis=1)
+        tail = max(1, int(np.ceil((1 - self.risk_alpha) * self.scenarios)))
+        tail_unmet = -np.partition(-unmet, tail - 1, axis=1)[:, :tail].mean(axis=1)
+        return -1 * (expected + self.risk_weight * 3000 * tail_unmet)
+
+    def repair(self, population: np.ndarray) -> np.ndarray:
+        """
+        move every bus's planned energy in each solution of population
+        (solutions, genes) onto its demand: short buses are topped up in
+        proportion to each slot's headroom, over-served buses scaled down
+        """
+        population = np.clip(population, 0, self.max_slot_energy)
+        # per (solution, bus with genes) sums, genes of a bus are contiguous
+        delivered = np.add.reduceat(population, self.bus_starts, axis=1)
+        headroom = self.max_slot_energy - population
+        bus_headroom = np.add.reduceat(headroom, self.bus_starts, axis=1)
+        demand = self.gene_demands
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fill = np.where(delivered < demand, np.clip((demand - delivered) / bus_headroom, 0, 1), 0)
+            scale = np.where(delivered > demand, np.maximum(demand, 0) / delivered, 1)
+        population += headroom * np.nan_to_num(fill)[:, self.gene_group]
+        population *= scale[:, self.gene_group]
+        return population
+
+    def __mutate(self, offspring, ga_instance) -> np.ndarray:
+        """
+        random mutation within the slot bounds followed by repair
+        """
+        mutate = np.random.random(offspring.shape) < self.mutation_probability
+        offspring[mutate] = np.random.uniform(0, self.max_slot_energy, np.count_nonzero(mutate))
+        return self.repair(offspring)
+
+    def __get_sparse_charge_rates(self, sol_per_pop=20, num_generations=50) -> np.ndarray:
+        num_genes = len(self.gene_bus)
+        if num_genes == 0:
+            return np.zeros(0)
+        self.gene_prices = np.asarray(self.electricity_prices)[self.gene_slot]
+        self.demands = np.asarray(self.energy_demands)
+        # the buses that own genes, where each starts and which one owns each gene
+        bus_ids, self.bus_starts, self.gene_group = np.unique(self.gene_bus, return_index=True, return_inverse=True)
+        self.gene_demands = self.demands[bus_ids]
+        self.mutation_probability = 0.08
+        fitness_args = {}
+        if self.scenarios:
+            # repair toward the demand the risk level asks to cover
+            self.gene_demands = np.quantile(self.scenario_demands[:, bus_ids], self.risk_alpha, axis=0)
+            fitness_args = {"fitness_batch_size": sol_per_pop}
+
+        initial_population = self.repair(np.random.uniform(0, self.max_slot_energy, (sol_per_pop, num_genes)))
+        return self.__run_ga(
+            self.__scenario_fitness if self.scenarios else self.__sparse_fitness,
+            initial_population=initial_population,
+            gene_space={'low': 0, 'high': self.max_slot_energy},
+            mutation_type=self.__mutate,
+            **fitness_args
+        )
+
+    def __run_ga(self, fitness_func, **ga_args) -> np.ndarray:
+        """
+        run pygad until a stopping rule fires, recording the convergence
+        curve, and return the best solution seen
+        """
+        self.convergence = []
+        self.stop_reason = "generations"
+        evaluations = 0
+        best = {"fitness": -np.inf, "solution": None, "generation": 0}
+        begin = time.perf_counter()
+
+        def counted_fitness(ga, solution, solution_idx):
+            nonlocal evaluations
+            # one solution, or a batch of them with fitness_batch_size
+            evaluations += len(np.atleast_2d(solution))
+            return fitness_func(ga, solution, solution_idx)
+
+        def on_generation(ga):
+            fitness = ga.last_generation_fitness
+            generation = ga.generations_completed
+            fittest = int(np.argmax(fitness))
+            if fitness[fittest] > best["fitness"]:
+                best.update(fitness=float(fitness[fittest]), solution=ga.population[fittest].copy(), generation=generation)
+            elapsed = time.perf_counter() - begin
+            self.convergence.append({
+                "generation":   generation,
+                "seconds":      elapsed,
+                "evaluations":  evaluations,
+                "best_fitness": best["fitness"],
+                "mean_fitness": float(np.mean(fitness)),
+            })
+            if self.deadline is not None and elapsed >= self.deadline:
+                self.stop_reason = "deadline"
+                return "stop"
+            if self.stall_generations is not None and generation - best["generation"] >= self.stall_generations:
+                self.stop_reason = "stalled"
+                return "stop"
 
         ga_instance = pygad.GA(
-            num_generations=50,
+            num_generations=self.max_generations,
             num_parents_mating=5,
-            fitness_func=lambda ga, sol, idx: self.__fitness_function(
+            fitness_func=counted_fitness,
+            on_generation=on_generation,
+            parent_selection_type="rank",
+            crossover_type="single_point",
+            **ga_args
+        )
+
+        ga_instance.run()
+        solution, solution_fitness, solution_idx = ga_instance.best_solution(ga_instance.last_generation_fitness)
+        if best["solution"] is None or solution_fitness > best["fitness"]:
+            return solution
+        return best["solution"]
+
+    def __get_charge_rates(self, gene_space):
+        num_genes = self.num_buses * self.num_time_slots
+
+        solution = self.__run_ga(
+            lambda ga, sol, idx: self.__fitness_function(
                 ga, sol, idx, self.num_buses, self.num_time_slots, self.arrival_times,
-                self.departure_times, self.energy_demands, self.electricity_prices, self.grid_limit,
-                self.state.start_schedule
+                self.departure_times, self.energy_demands, self.electricity_prices, self.slot_grid_limit,
+                self.state.start_schedule, timedelta(seconds=self.slot_seconds)
             ),
             sol_per_pop=20,
             num_genes=num_genes,
             gene_space=gene_space,
-            parent_selection_type="rank",
-            crossover_type="single_point",
             mutation_type="random",
             mutation_percent_genes=8
         )
-
-        ga_instance.run()
-        solution, solution_fitness, solution_idx = ga_instance.best_solution()
         charging_schedule = solution.reshape(self.num_buses, self.num_time_slots)
 
         return charging_schedule
@@ -182,7 +412,7 @@ class rtsoDM(DecisionMaker):
     def plot_bus_charge_rates(self):
         for i, row in enumerate(self.charge_rate):
             plt.plot(row, label=f"bus {i}")
-        plt.xlabel("hour of charge session")
+        plt.xlabel("time slot of charge session")
         plt.ylabel("power to deliver (kWh)")
         plt.legend()
         plt.grid(True)
@@ -194,8 +424,46 @@ class rtsoDM(DecisionMaker):
             for i, element in enumerate(charge_rate):
                 totals[i] += element
         plt.plot(totals)
-        plt.xlabel("hour of charge session")
+        plt.xlabel("time slot of charge session")
         plt.ylabel("total power delivered (kW)")
         plt.grid(True)
         plt.show()
 
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    from datetime import datetime
+    from simspace import SimState
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+
+    def plan(num_buses, **kwargs):
+        np.random.seed(0)
+        sim_state = SimState(start_time, end_time, num_chargers=num_buses // 2, num_buses=num_buses)
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            planner = rtsoDM(sim_state, **kwargs)
+        return planner, time.perf_counter() - begin
+
+    print(f"{'buses':>6} {'slot min':>8} {'encoding':>8} {'genes':>6} {'plan s':>7} {'cost':>9} {'unmet kWh':>10}")
+    for num_buses in (16, 64, 256):
+        for slot_minutes, sparse in ((60, False), (60, True), (15, True), (5, True)):
+            planner, seconds = plan(num_buses, sparse=sparse, slot_minutes=slot_minutes)
+            energy = planner.charge_rate * planner.time_slot_duration
+            cost = float(np.sum(energy @ np.asarray(planner.electricity_prices)))
+            unmet = float(np.sum(np.maximum(0, np.asarray(planner.energy_demands) - energy.sum(axis=1))))
+            genes = len(planner.gene_bus) if sparse else energy.size
+            print(f"{num_buses:>6} {slot_minutes:>8} {'sparse' if sparse else 'dense':>8} {genes:>6} "
+                  f"{seconds:>7.2f} {cost:>9.1f} {unmet:>10.1f}")
+
+    # anytime planning: quality vs time under a deadline and stall rule
+    planner, seconds = plan(64, sparse=False, max_generations=10000, deadline=5.0, stall_generations=100)
+    print(f"\nanytime dense plan for 64 buses stopped by {planner.stop_reason} after "
+          f"{len(planner.convergence)} generations in {seconds:.2f}s")
+    print(f"{'generation':>10} {'seconds':>8} {'evaluations':>12} {'best':>12} {'mean':>12}")
+    for record in planner.convergence[::max(1, len(planner.convergence) // 10)] + planner.convergence[-1:]:
+        print(f"{record['generation']:>10} {record['seconds']:>8.2f} {record['evaluations']:>12} "
+              f"{record['best_fitness']:>12.1f} {record['mean_fitness']:>12.1f}")
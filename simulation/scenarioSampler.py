@@ -0,0 +1,131 @@
+"""
+Scenario sampling of the bus noise model for stochastic planning.
+
+A ScenarioBatch holds K independent draws of every bus's true arrival,
+true departure and initial capacity, made with the same distributions
+Bus uses (arrival and departure late by |int(N(0, 10))| minutes, initial
+capacity N(150, 10) kWh) from a private generator, so sampling never
+disturbs the simulation's global random state. Everything is stored as
+(scenarios, buses) arrays so planners can score a schedule against all
+scenarios in one vectorized pass.
+"""
+
+import numpy as np
+
+
+class ScenarioBatch:
+
+    def __init__(self, arrival_seconds, departure_seconds, initial_capacity, battery_capacity, desired_soc):
+        self.arrival_seconds:   np.ndarray = arrival_seconds     # (scenarios, buses) seconds after start
+        self.departure_seconds: np.ndarray = departure_seconds   # (scenarios, buses) seconds after start
+        self.initial_capacity:  np.ndarray = initial_capacity    # (scenarios, buses) kWh
+        self.battery_capacity:  np.ndarray = battery_capacity    # (buses,) kWh
+        self.desired_soc:       np.ndarray = desired_soc         # (buses,) percent
+
+    @property
+    def num_scenarios(self) -> int:
+        return self.arrival_seconds.shape[0]
+
+    def slot_windows(self, slot_seconds: int, num_slots: int):
+        """
+        (scenarios, buses) first and one-past-last slot that start while
+        the bus is at the depot, the rule rtsoDM plans with
+        """
+        first = np.clip(np.ceil(self.arrival_seconds / slot_seconds), 0, num_slots).astype(int)
+        end = np.clip(np.ceil(self.departure_seconds / slot_seconds), 0, num_slots).astype(int)
+        return first, np.maximum(first, end)
+
+    def availability(self, slot_seconds: int, num_slots: int) -> np.ndarray:
+        """
+        (scenarios, buses, slots) mask of the slot windows
+        """
+        first, end = self.slot_windows(slot_seconds, num_slots)
+        slots = np.arange(num_slots)
+        return (first[..., None] <= slots) & (slots < end[..., None])
+
+    def energy_demands(self) -> np.ndarray:
+        """
+        (scenarios, buses) kWh needed to reach the desired SOC
+        """
+        return np.maximum(0, self.battery_capacity * self.desired_soc / 100 - self.initial_capacity)
+
+
+def sample_scenarios(sim_state, num_scenarios: int, seed=None) -> ScenarioBatch:
+    """
+    draw num_scenarios realizations of the noise model for every bus of
+    sim_state
+    """
+    rng = np.random.default_rng(seed)
+    shape = (num_scenarios, len(sim_state.buses))
+    start = sim_state.start_schedule
+    arrival = (sim_state.scheduled_arrival - start).total_seconds()
+    departure = (sim_state.scheduled_departure - start).total_seconds()
+    late_minutes = lambda: np.abs(np.trunc(rng.normal(0, 10, shape)))
+    return ScenarioBatch(
+        arrival + late_minutes() * 60,
+        departure + late_minutes() * 60,
+        rng.normal(150, 10, shape),
+        np.array([bus.battery_capacity for bus in sim_state.buses], dtype=float),
+        np.array([bus.desired_soc for bus in sim_state.buses], dtype=float),
+    )
+
+
+def evaluate_plan(energy_plan, batch: ScenarioBatch, slot_prices, slot_seconds: int, risk_alpha=0.9) -> dict:
+    """
+    expected cost, mean unmet energy and the mean of the worst
+    (1 - risk_alpha) share of unmet energy of a (buses, slots) kWh plan
+    when the buses behave as in each scenario of batch
+    """
+    energy_plan = np.asarray(energy_plan, dtype=float)
+    delivered = energy_plan * batch.availability(slot_seconds, energy_plan.shape[1])
+    cost = delivered.sum(axis=1) @ np.asarray(slot_prices)
+    unmet = np.maximum(0, batch.energy_demands() - delivered.sum(axis=2)).sum(axis=1)
+    tail = max(1, int(np.ceil((1 - risk_alpha) * len(unmet))))
+    return {
+        "expected_cost":  float(cost.mean()),
+        "expected_unmet": float(unmet.mean()),
+        "tail_unmet":     float(np.sort(unmet)[-tail:].mean()),
+    }
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    from datetime import datetime
+    from simspace import SimState
+    from rtsoDM import rtsoDM
+
+    start_time = datetime.fromisoformat('2024-12-06T19:00:00')
+    end_time = datetime.fromisoformat('2024-12-07T06:00:00')
+
+    # batched evaluation: one (solutions, scenarios, genes) pass per population
+    np.random.seed(0)
+    sim_state = SimState(start_time, end_time, num_chargers=32, num_buses=64)
+    print(f"{'scenarios':>9} {'ms/population':>14} {'us/solution/scenario':>21}")
+    for num_scenarios in (1, 8, 32, 128, 512):
+        with contextlib.redirect_stdout(io.StringIO()):
+            planner = rtsoDM(sim_state, slot_minutes=15, scenarios=num_scenarios, max_generations=1)
+        population = np.random.uniform(0, planner.max_slot_energy, (20, len(planner.gene_bus)))
+        repeats = 5
+        begin = time.perf_counter()
+        for _ in range(repeats):
+            planner.scenario_fitness(population)
+        seconds = (time.perf_counter() - begin) / repeats
+        print(f"{num_scenarios:>9} {seconds * 1e3:>14.1f} {seconds / (20 * num_scenarios) * 1e6:>21.2f}")
+
+    # plan quality on held out scenarios of a depot the grid limit can serve
+    np.random.seed(0)
+    sim_state = SimState(start_time, end_time, num_chargers=4, num_buses=8)
+    held_out = sample_scenarios(sim_state, 2000, seed=12345)
+    print(f"\n{'scenarios':>9} {'plan s':>7} {'cost':>8} {'unmet kWh':>10} {'tail unmet':>11}")
+    for num_scenarios in (0, 16, 64):
+        np.random.seed(1)
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            planner = rtsoDM(sim_state, slot_minutes=15, scenarios=num_scenarios, scenario_seed=7, max_generations=200)
+        seconds = time.perf_counter() - begin
+        result = evaluate_plan(planner.charge_rate * planner.time_slot_duration, held_out,
+                               planner.electricity_prices, planner.slot_seconds)
+        print(f"{num_scenarios:>9} {seconds:>7.2f} {result['expected_cost']:>8.1f} "
+              f"{result['expected_unmet']:>10.1f} {result['tail_unmet']:>11.1f}")
@@ -0,0 +1,305 @@
+"""
+Zero-copy results transport for parallel simulation replicates.
+
+The parent preallocates one array per result field, laid out by
+(replicate, bus, time sample), in multiprocessing.shared_memory blocks or
+in .npy files opened as memory maps. Worker processes attach to the same
+blocks by name and Main writes its telemetry straight into its replicate's
+rows through a ReplicateWriter, so nothing but the replicate index goes
+back through pickle. The parent aggregates over the replicate axis on
+views of the shared buffers.
+
+Telemetry is sampled onto a fixed grid of sample_seconds, holding each
+sample until the next one, so fixed-step, adaptive and slotted runs all
+fill the same columns.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from main import Main, START_TIME, END_TIME
+
+
+METRICS = ("cost", "reported_cost", "energy_kwh", "peak_kw", "metered_peak_kw")
+
+
+class SharedResults:
+
+    def __init__(self, num_replicates, num_buses, num_samples, sample_seconds=60, backend="shm", path=None, spec=None):
+        if backend not in ("shm", "memmap"):
+            raise ValueError(f"Backend {backend} is not 'shm' or 'memmap'")
+        if backend == "memmap" and path is None:
+            raise ValueError("The memmap backend needs a directory path")
+        self.num_replicates: int = num_replicates
+        self.num_buses:      int = num_buses
+        self.num_samples:    int = num_samples
+        self.sample_seconds: int = sample_seconds
+        self.backend:        str = backend
+        self.path                = path
+        self.owner:          bool = spec is None    # the creating process unlinks the blocks
+        self.blocks              = {}
+        self.fields              = {}
+        names = spec["names"] if spec is not None else {}
+        for field, (shape, dtype) in self.layout().items():
+            self.fields[field] = self.__open(field, shape, dtype, names.get(field))
+        if self.owner:
+            for field in ("soc", "power", "departure_soc", "metrics"):
+                self.fields[field].fill(np.nan)
+
+    @classmethod
+    def for_main(cls, num_replicates, num_buses, sample_seconds=60, backend="shm", path=None):
+        """
+        results sized for num_replicates runs of Main's schedule
+        """
+        num_samples = int((END_TIME - START_TIME).total_seconds()) // sample_seconds
+        return cls(num_replicates, num_buses, num_samples, sample_seconds, backend, path)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        open the results described by spec (from spec()) in a worker
+        """
+        return cls(spec["num_replicates"], spec["num_buses"], spec["num_samples"], spec["sample_seconds"],
+                   spec["backend"], spec["path"], spec=spec)
+
+    def layout(self) -> dict:
+        replicates, buses, samples = self.num_replicates, self.num_buses, self.num_samples
+        return {
+            "soc":           ((replicates, buses, samples), np.float32),
+            "power":         ((replicates, samples), np.float32),
+            "departure_soc": ((replicates, buses), np.float32),
+            "metrics":       ((replicates, len(METRICS)), np.float64),
+            "done":          ((replicates,), np.uint8),
+        }
+
+    def spec(self) -> dict:
+        """
+        small picklable description workers attach with
+        """
+        names = {field: block.name for field, block in self.blocks.items()}
+        return {"num_replicates": self.num_replicates, "num_buses": self.num_buses, "num_samples": self.num_samples,
+                "sample_seconds": self.sample_seconds, "backend": self.backend, "path": self.path, "names": names}
+
+    def __open(self, field, shape, dtype, name):
+        if self.backend == "memmap":
+            file = os.path.join(self.path, f"{field}.npy")
+            if self.owner:
+                os.makedirs(self.path, exist_ok=True)
+                return np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+            return np.load(file, mmap_mode="r+")
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        if self.owner:
+            block = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            # pool workers share the owner's resource tracker, so attaching
+            # does not hand them the unlink
+            block = shared_memory.SharedMemory(name=name)
+        self.blocks[field] = block
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    @property
+    def soc(self) -> np.ndarray:
+        return self.fields["soc"]
+
+    @property
+    def power(self) -> np.ndarray:
+        return self.fields["power"]
+
+    @property
+    def departure_soc(self) -> np.ndarray:
+        return self.fields["departure_soc"]
+
+    @property
+    def done(self) -> np.ndarray:
+        return self.fields["done"]
+
+    def metric(self, name) -> np.ndarray:
+        """
+        view of one summary metric across replicates
+        """
+        return self.fields["metrics"][:, METRICS.index(name)]
+
+    def writer(self, replicate):
+        return ReplicateWriter(self, replicate)
+
+    def time_points(self) -> np.ndarray:
+        return np.arange(self.num_samples) * self.sample_seconds
+
+    # aggregation over the replicate axis, computed on the shared buffers
+
+    def __finished(self, array) -> np.ndarray:
+        """
+        array itself once every replicate is done, else its finished rows
+        """
+        done = self.done == 1
+        return array if done.all() else array[done]
+
+    def mean_soc(self) -> np.ndarray:
+        """
+        (buses, samples) SOC averaged over finished replicates
+        """
+        return np.nanmean(self.__finished(self.soc), axis=0)
+
+    def power_percentiles(self, percentiles=(5, 50, 95)) -> np.ndarray:
+        return np.nanpercentile(self.__finished(self.power), percentiles, axis=0)
+
+    def summary(self) -> dict:
+        """
+        mean and standard deviation of every metric over finished replicates
+        """
+        result = {"replicates": int((self.done == 1).sum())}
+        for name in METRICS:
+            values = self.__finished(self.metric(name))
+            result[name] = float(values.mean()) if len(values) else float("nan")
+            result[f"{name}_std"] = float(values.std()) if len(values) else float("nan")
+        return result
+
+    def close(self) -> None:
+        """
+        release this process's mapping, and the blocks themselves if it
+        created them
+        """
+        self.fields = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def print_metrics(self):
+        metrics = f"""
+        backend: {self.backend}
+        replicates: {self.num_replicates} ({int((self.done == 1).sum())} finished)
+        buses: {self.num_buses}
+        samples: {self.num_samples} every {self.sample_seconds} s
+        shared bytes: {sum(array.nbytes for array in self.fields.values())}
+        """
+        print(metrics)
+
+
+class ReplicateWriter:
+    """
+    Main telemetry sink that holds each sample on the shared grid until
+    the next one
+    """
+
+    def __init__(self, results: SharedResults, replicate: int):
+        self.results                = results
+        self.replicate:  int        = replicate
+        self.soc:        np.ndarray = results.soc[replicate]
+        self.power:      np.ndarray = results.power[replicate]
+        self.column:     int        = -1        # last grid column written
+        self.last_soc               = None
+        self.last_draw:  float      = 0.0
+
+    def record(self, seconds, soc, draw) -> None:
+        column = min(int(seconds // self.results.sample_seconds), self.results.num_samples - 1)
+        if column <= self.column:
+            return
+        self.__hold(column)
+        self.soc[:len(soc), column] = soc
+        self.power[column] = draw
+        self.column = column
+        self.last_soc = soc
+        self.last_draw = draw
+
+    def __hold(self, column) -> None:
+        """
+        repeat the last sample up to (not including) column
+        """
+        if self.last_soc is not None and column > self.column + 1:
+            self.soc[:len(self.last_soc), self.column + 1:column] = np.asarray(self.last_soc, dtype=np.float32)[:, None]
+            self.power[self.column + 1:column] = self.last_draw
+
+    def finish(self, summary: dict) -> None:
+        """
+        hold the last sample to the end of the grid, write the summary
+        metrics and mark the replicate done
+        """
+        self.__hold(self.results.num_samples)
+        if self.last_soc is not None and self.column < self.results.num_samples - 1:
+            self.soc[:len(self.last_soc), -1] = self.last_soc
+            self.power[-1] = self.last_draw
+        departure_soc = summary["departure_soc"]
+        self.results.departure_soc[self.replicate, :len(departure_soc)] = departure_soc
+        self.results.fields["metrics"][self.replicate] = [summary[name] for name in METRICS]
+        self.results.done[self.replicate] = 1
+
+
+def _run_replicate(task) -> int:
+    """
+    worker: run one Main configuration into its replicate's shared rows
+    """
+    spec, replicate, config = task
+    results = SharedResults.attach(spec)
+    writer = results.writer(replicate)
+    try:
+        # Main reports every arrival and departure; keep workers quiet
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            main = Main(**config, telemetry=writer)
+            main.run_sim(plot=False)
+        writer.finish(main.summary())
+    finally:
+        # drop every view of the shared buffers before unmapping them
+        main = writer = None
+        results.close()
+    return replicate
+
+
+def run_replicates(configs: list[dict], results: SharedResults, processes=None) -> SharedResults:
+    """
+    run every configuration (keyword arguments of Main) as one replicate,
+    in parallel when processes is not 1, writing into results
+    """
+    if len(configs) > results.num_replicates:
+        raise ValueError(f"{len(configs)} configurations do not fit in {results.num_replicates} replicates")
+    spec = results.spec()
+    tasks = [(spec, replicate, config) for replicate, config in enumerate(configs)]
+    if processes == 1:
+        for task in tasks:
+            _run_replicate(task)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for _ in pool.imap_unordered(_run_replicate, tasks):
+                pass
+    return results
+
+
+if __name__ == "__main__":
+    import pickle
+    import time
+
+    num_buses = 16
+    configs = [{"d_maker": "naive", "num_chargers": 8, "num_buses": num_buses, "seed": seed, "adaptive": True}
+               for seed in range(int(sys.argv[1]) if len(sys.argv) > 1 else 8)]
+    for backend in ("shm", "memmap"):
+        path = os.path.join(".sim_cache", "shared_results") if backend == "memmap" else None
+        with SharedResults.for_main(len(configs), num_buses, backend=backend, path=path) as results:
+            begin = time.perf_counter()
+            run_replicates(configs, results)
+            seconds = time.perf_counter() - begin
+            summary = results.summary()
+            print(f"{backend}: {summary['replicates']} replicates in {seconds:.2f} s, "
+                  f"cost ${summary['cost']:.2f} +/- {summary['cost_std']:.2f}, "
+                  f"peak {summary['peak_kw']:.1f} kW, "
+                  f"final mean SOC {np.nanmean(results.mean_soc()[:, -1]):.1f}%")
+            results.print_metrics()
+
+    # what the same telemetry would cost to send back through pickle at full resolution
+    main = Main(**configs[0])
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main.run_sim(plot=False)
+    payload = pickle.dumps((main.soc_data, main.power_data, main.time_points))
+    print(f"pickled telemetry of one replicate: {len(payload)} bytes; shared transport sends {len(pickle.dumps(0))}")
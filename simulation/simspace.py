@@ -1,7 +1,12 @@
 from bus import Bus
 from charger import Charger
 from priceSchedule import PriceSchedule
+from compactFleet import CompactBus, CompactCharger
+from meter import DepotMeter
+from chargerTypes import ConnectorArrays
+from eventLog import EventLog, INFO, WARNING, ARRIVAL, REJECTED
 import numpy as np
+from bisect import bisect_left
 from datetime import datetime, timedelta
 from typing import List
 
@@ -20,60 +25,137 @@ class SimState():
                  max_rate=0.24,
                  min_rate=0.08,
                  battery_capacity=588,
-                 desired_soc=90
+                 desired_soc=90,
+                 compact=False,
+                 adaptive=False,
+                 tariff=None,
+                 charger_types=None,
+                 event_level="warning",
+                 event_path=None,
+                 scenario=None
                  ) -> None:
+        if charger_types is not None:
+            # a mixed depot: one ChargerType per charger sets its connectors and limits
+            num_chargers = len(charger_types)
+            num_connectors = max(charger_type.num_connectors for charger_type in charger_types)
+            min_power = min(charger_type.min_power for charger_type in charger_types)
+            max_power = max(charger_type.max_power for charger_type in charger_types)
         self.min_power = min_power
         self.max_power = max_power
         self.num_chargers = num_chargers
         self.num_connectors = num_connectors
         self.num_buses = num_buses
+        self.charger_types = charger_types
+        self.decision_log = None    # DecisionLog recording rate changes, see decisionLog.py
+        self.scenario = scenario    # FrozenScenario fixing bus noise and delivery noise, see crnHarness.py
+        self.connection_listeners = []  # called with every connector a bus is plugged into or unplugged from
         self.battery_capacity = battery_capacity
         self.desired_soc = desired_soc
+        self.compact = compact      # use the slotted classes from compactFleet for large fleets
+        self.adaptive = adaptive    # connectors integrate multi-timestep deliveries in closed form
         self.is_done = False
         self.start_schedule: datetime       = start_schedule
         self.end_schedule:   datetime       = end_schedule
         self.current_time:   datetime       = self.start_schedule
-        self.price_schedule: PriceSchedule  = self.__initialize_price_schedule(timestep_duration, max_rate, min_rate)
+        # every bus is scheduled to arrive at the start and leave an hour before the end
+        self.scheduled_arrival:   datetime  = self.start_schedule
+        self.scheduled_departure: datetime  = self.end_schedule - timedelta(hours=1)
+        self.price_schedule: PriceSchedule  = self.__initialize_price_schedule(timestep_duration, max_rate, min_rate, tariff)
+        self.meter:          DepotMeter     = DepotMeter(self)
+        self.events:         EventLog       = EventLog(self, event_level, event_path)
         self.chargers:       List[Charger]  = self.__initialize_chargers(num_chargers, 
                                                                          min_power, 
                                                                          max_power,
                                                                          num_connectors)
+        self.connector_arrays: ConnectorArrays = ConnectorArrays(self.chargers)
         self.buses:          List[Bus]      = self.__initialize_buses(num_buses, battery_capacity, desired_soc)
+        self.event_times:    List[datetime] = self.__get_event_times()
 
 
     def __initialize_chargers(self, num_chargers: int, min_power: float, max_power: float, num_connectors: int)\
             -> List[Charger]:
         """
-        Initialize a set of chargers which make up a bus deport
+        Initialize a set of chargers which make up a bus deport, identical
+        unless charger types were given
         """
+        charger_class = CompactCharger if self.compact else Charger
         charger_list = []
         for charger in range(0, num_chargers):
-            charger_list.append( Charger(charger, min_power, max_power, num_connectors, self.price_schedule.timestep_duration))
+            if self.charger_types is not None:
+                charger_type = self.charger_types[charger]
+                charger_list.append( charger_class(charger, charger_type.min_power, charger_type.max_power,
+                                                   charger_type.num_connectors, self.price_schedule.timestep_duration,
+                                                   charger_type.cabinet_limit))
+            else:
+                charger_list.append( charger_class(charger, min_power, max_power, num_connectors, self.price_schedule.timestep_duration))
+            charger_list[-1].events = self.events
+            charger_list[-1].listeners = self.connection_listeners
+            for connector in charger_list[-1].connectors:
+                connector.analytic = self.adaptive
+                connector.meter = self.meter
+                connector.events = self.events
+        if self.scenario is not None:
+            position = 0
+            for charger in charger_list:
+                for connector in charger.connectors:
+                    connector.rng = self.scenario.connector_rng(position)
+                    position += 1
 
         # return a list of chargers with the passed in specifications
         return charger_list
 
 
     def __initialize_buses(self, num_buses, battery_capacity, desired_soc) -> list[Bus]:
+        bus_class = CompactBus if self.compact else Bus
         bus_list = []
         for i in range(0, num_buses):
-            bus_list.append(Bus(
+            frozen = self.scenario.bus_kwargs(i, self.scheduled_arrival, self.scheduled_departure) \
+                if self.scenario is not None else {}
+            bus_list.append(bus_class(
                 i,
-                self.start_schedule, 
-                self.end_schedule - timedelta(hours=1), 
+                self.scheduled_arrival,
+                self.scheduled_departure,
                 battery_capacity, 
-                desired_soc
+                desired_soc,
+                **frozen
                 )
             )
         return bus_list
 
-    def __initialize_price_schedule(self, timestep_duration, max_rate, min_rate) -> PriceSchedule:
+    def __get_event_times(self) -> List[datetime]:
+        """
+        sorted arrival and departure times of every bus
+        """
+        return sorted({bus.arrival_time for bus in self.buses} | {bus.departure_time for bus in self.buses})
+
+    def next_step_seconds(self, decision_time: datetime) -> int:
+        """
+        largest number of seconds the simulation can advance from the
+        current time while every connector's power stays constant: up to
+        the next arrival, departure, price change, battery-full crossing,
+        decision point or the end of the schedule, whichever comes first
+        """
+        right_now = self.current_time
+        limits = [decision_time, self.end_schedule, self.price_schedule.next_price_change(right_now)]
+
+        next_event = bisect_left(self.event_times, right_now)
+        if next_event < len(self.event_times):
+            limits.append(self.event_times[next_event])
+
+        step_seconds = (min(limits) - right_now).total_seconds()
+        for charger in self.chargers:
+            for connector in charger.connectors:
+                step_seconds = min(step_seconds, connector.seconds_until_full())
+        return max(1, int(step_seconds))
+
+    def __initialize_price_schedule(self, timestep_duration, max_rate, min_rate, tariff) -> PriceSchedule:
         return PriceSchedule(
                 timestep_duration,  
                 min_rate, 
                 max_rate,
                 self.start_schedule, 
-                self.end_schedule
+                self.end_schedule,
+                tariff
                 )
     
     def print_metrics(self):
@@ -101,39 +183,64 @@ class SimState():
         """
         self.current_time = self.start_schedule
         self.is_done = False
+        self.meter:          DepotMeter     = DepotMeter(self)
         self.chargers:       List[Charger]  = self.__initialize_chargers(self.num_chargers, 
                                                                          self.min_power, 
                                                                          self.max_power,
                                                                          self.num_connectors)
+        self.connector_arrays: ConnectorArrays = ConnectorArrays(self.chargers)
         self.buses:          List[Bus]      = self.__initialize_buses(self.num_buses, self.battery_capacity, self.desired_soc)
-       
+        self.event_times:    List[datetime] = self.__get_event_times()
+        if self.decision_log is not None:
+            self.decision_log.attach(self)
 
 
-    def apply_action(self, action, verbose=False):
+
+    def connect_arrival(self, bus) -> bool:
+        """
+        log the arrival of bus and plug it into the first free connector
+        """
+        if self.events.info:
+            self.events.emit(INFO, ARRIVAL, bus.id, value=bus.current_soc())
+        for charger in self.chargers:
+            if charger.connect_bus(bus, verbose=False):
+                return True
+        if self.events.warn:
+            self.events.emit(WARNING, REJECTED, bus.id)
+        return False
+
+    def disconnect_departure(self, bus) -> bool:
+        """
+        unplug bus from whichever connector it is on
+        """
+        for charger in self.chargers:
+            if charger.disconnect_bus(bus, verbose=False):
+                return True
+        return False
+
+    def apply_action(self, action, seconds=3600):
         """
         Apply the action to the simulation state by updating charger outputs
-        and advancing the simulation by one timestep.
+        and advancing the simulation by one decision slot.
 
         Args:
-            action (list or np.array): Charging rates for each bus as a fraction of max charger power.
+            action (list or np.array): Charging rates for each bus as a fraction of the max power of its connector.
+            seconds (int): Length of the slot the action holds for.
         """
         if len(action) != len(self.buses):
             raise ValueError("Action length must match the number of buses.")
         
-        # Step 1: Apply the charging action
-        for i, bus in enumerate(self.buses):
-            # Find the charger and connector associated with the bus
-            for charger in self.chargers:
-                for connector in charger.connectors:
-                    if connector.connected_to == bus:
-                        # Calculate the charging power based on action
-                        charge_rate = action[i] * self.max_power
-                        charge_rate = max(0, min(charge_rate, self.max_power))  # Clamp to valid range
-                        charger.update_charge_rate(connector.connector_id, charge_rate)
+        # Step 1: Apply the charging action to every connector at once,
+        # projected onto the connector bounds and cabinet limits
+        arrays = self.connector_arrays
+        bus_ids = arrays.bus_ids()
+        active = bus_ids >= 0
+        fraction = np.clip(np.asarray(action, dtype=float)[np.where(active, bus_ids, 0)], 0, 1)
+        arrays.apply(fraction * arrays.max_power, active)
 
-        for i in range(3600):
+        timestep_duration = self.price_schedule.timestep_duration
+        for i in range(seconds // timestep_duration):
             # Step 2: Advance the simulation state
-            timestep_duration = self.price_schedule.timestep_duration
             for charger in self.chargers:
                 for connector in charger.connectors:
                     connector.deliver_power(timestep_duration)  # Update bus SOCs based on charging rates
@@ -146,24 +253,14 @@ class SimState():
             # check for buses arriving/departing
             for bus in self.buses:
                 if bus.arrival_time == self.current_time:
-                    for charger in self.chargers:
-                        res = charger.connect_bus(bus, verbose=False)
-                        if res:
-                            if verbose:
-                                print(f"{self.current_time}: Bus arrived and was connected")
-                                bus.print_metrics()
-                            break
+                    self.connect_arrival(bus)
                 if bus.departure_time == self.current_time:
-                    for charger in self.chargers:
-                        res = charger.disconnect_bus(bus, verbose=False)
-                        if res:
-                            if verbose:
-                                print(f"{self.current_time}: Bus disconnected")
-                                bus.print_metrics()
-                            break
+                    self.disconnect_departure(bus)
 
     def get_current_meterics(self):
-       grid_pull = np.sum([charger.current_draw for charger in self.chargers])
+       # from the connectors: decision makers that set rates one connector
+       # at a time leave charger.current_draw untouched
+       grid_pull = self.connector_arrays.draw()
        price = self.price_schedule.get_current_price(self.current_time)
        return grid_pull, price
 
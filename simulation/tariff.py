@@ -0,0 +1,259 @@
+"""
+File based tariffs with time-of-use, seasonal and demand charges.
+
+A tariff file is JSON of the form
+
+    {
+      "name": "weekday TOU",
+      "default_rate": 0.08,
+      "energy": [
+        {"name": "evening peak", "rate": 0.24, "months": [1, 2, 12],
+         "days": [0, 1, 2, 3, 4], "start": "18:00", "end": "22:00"}
+      ],
+      "demand": [
+        {"name": "on-peak demand", "rate": 13.5, "days": [0, 1, 2, 3, 4],
+         "start": "06:00", "end": "22:00"}
+      ]
+    }
+
+Energy rates are $/kWh, demand rates $/kW of the highest power drawn in
+the window over a billing month. Periods are half open [start, end)
+clock times ("HH:MM" or "HH:MM:SS"); a period whose end is before its
+start runs past midnight and belongs to the day it starts on. "months"
+(1-12) and "days" (0 = Monday) default to all, and the first matching
+energy period wins. Tariff.compile turns a tariff
+into a TariffIndex over a simulation horizon: sorted interval boundaries
+with a rate per interval, so price lookup is a binary search and whole
+power traces are priced with numpy.
+"""
+
+import json
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+
+
+def _seconds(clock: str) -> int:
+    """
+    seconds after midnight of an "HH:MM" or "HH:MM:SS" clock time
+    """
+    fields = [int(field) for field in clock.split(":")] + [0]
+    return fields[0] * 3600 + fields[1] * 60 + fields[2]
+
+
+class TariffPeriod:
+
+    def __init__(self, name, rate, start="00:00", end="24:00", months=None, days=None):
+        self.name:   str      = name
+        self.rate:   float    = rate
+        self.start:  int      = _seconds(start)    # seconds after midnight
+        self.end:    int      = _seconds(end)      # before start: the period wraps past midnight
+        self.months: set[int] = set(months) if months is not None else set(range(1, 13))
+        self.days:   set[int] = set(days) if days is not None else set(range(7))
+        if self.start == self.end:
+            raise ValueError(f"Tariff period {name} starts and ends at {start}")
+
+    @property
+    def wraps(self) -> bool:
+        return self.end < self.start
+
+    def __on(self, day: date) -> bool:
+        return day.month in self.months and day.weekday() in self.days
+
+    def applies(self, curr_datetime: datetime) -> bool:
+        seconds = curr_datetime.hour * 3600 + curr_datetime.minute * 60 + curr_datetime.second
+        if not self.wraps:
+            return self.__on(curr_datetime) and self.start <= seconds < self.end
+        if seconds >= self.start:
+            return self.__on(curr_datetime)
+        # the part after midnight belongs to the day before
+        return seconds < self.end and self.__on(curr_datetime - timedelta(days=1))
+
+    def boundaries(self, day: date) -> list[datetime]:
+        """
+        start and end of the period that starts on day, if any
+        """
+        if not self.__on(day):
+            return []
+        midnight = datetime.combine(day, time(0, 0))
+        end = self.end + (86400 if self.wraps else 0)
+        return [midnight + timedelta(seconds=self.start), midnight + timedelta(seconds=end)]
+
+
+class Tariff:
+
+    def __init__(self, name, default_rate, energy_periods, demand_periods):
+        self.name:           str                = name
+        self.default_rate:   float              = default_rate
+        self.energy_periods: list[TariffPeriod] = energy_periods
+        self.demand_periods: list[TariffPeriod] = demand_periods
+
+    @classmethod
+    def load(cls, path) -> "Tariff":
+        with open(path) as tariff_file:
+            spec = json.load(tariff_file)
+        return cls.from_dict(spec)
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "Tariff":
+        return cls(
+            spec.get("name", "tariff"),
+            spec["default_rate"],
+            [TariffPeriod(**period) for period in spec.get("energy", [])],
+            [TariffPeriod(**period) for period in spec.get("demand", [])],
+        )
+
+    @classmethod
+    def time_of_use(cls, off_peak_rate, on_peak_rate) -> "Tariff":
+        """
+        the two window weekday tariff PriceSchedule has always modeled.
+        PriceSchedule's windows include their end time, hence the extra second.
+        """
+        weekdays = [0, 1, 2, 3, 4]
+        return cls("weekday time of use", off_peak_rate, [
+            TariffPeriod("morning peak", on_peak_rate, "06:00", "09:00:01", days=weekdays),
+            TariffPeriod("evening peak", on_peak_rate, "18:00", "22:00:01", days=weekdays),
+        ], [])
+
+    def rate_at(self, curr_datetime: datetime) -> float:
+        """
+        energy rate at curr_datetime by scanning the periods
+        """
+        for period in self.energy_periods:
+            if period.applies(curr_datetime):
+                return period.rate
+        return self.default_rate
+
+    def compile(self, start: datetime, stop: datetime) -> "TariffIndex":
+        """
+        build the interval index of this tariff over [start, stop)
+        """
+        points = {start, stop}
+        # from the day before, for periods running past midnight into the horizon
+        day = start.date() - timedelta(days=1)
+        while day <= stop.date():
+            points.add(datetime.combine(day, time(0, 0)))
+            for period in self.energy_periods + self.demand_periods:
+                points.update(period.boundaries(day))
+            day += timedelta(days=1)
+        points = sorted(point for point in points if start <= point <= stop)
+
+        boundaries, rates, windows, months = [], [], [], []
+        for segment_start in points[:-1]:
+            rate = self.rate_at(segment_start)
+            window = tuple(period.applies(segment_start) for period in self.demand_periods)
+            month = segment_start.year * 12 + segment_start.month
+            if rates and rates[-1] == rate and windows[-1] == window and months[-1] == month:
+                continue
+            boundaries.append((segment_start - start).total_seconds())
+            rates.append(rate)
+            windows.append(window)
+            months.append(month)
+
+        return TariffIndex(
+            self, start, stop,
+            np.array(boundaries),
+            np.array(rates),
+            np.array(windows, dtype=bool).reshape(len(boundaries), len(self.demand_periods)),
+            np.array(months),
+        )
+
+
+class TariffIndex:
+    """
+    a tariff compiled over a fixed horizon. Interval i covers
+    [boundaries[i], boundaries[i + 1]) seconds after start.
+    """
+
+    def __init__(self, tariff, start, stop, boundaries, rates, demand_windows, billing_months):
+        self.tariff:         Tariff     = tariff
+        self.start:          datetime   = start
+        self.stop:           datetime   = stop
+        self.boundaries:     np.ndarray = boundaries        # interval start, seconds after start
+        self.rates:          np.ndarray = rates             # $/kWh per interval
+        self.demand_windows: np.ndarray = demand_windows    # (intervals, demand periods) membership
+        self.billing_months: np.ndarray = billing_months    # billing month key per interval
+        self.demand_rates:   np.ndarray = np.array([period.rate for period in tariff.demand_periods])
+        self.__boundary_list             = boundaries.tolist()
+        self.__rate_list                 = rates.tolist()
+
+    def price_at(self, curr_datetime: datetime) -> float:
+        """
+        energy rate at curr_datetime in O(log n)
+        """
+        if not self.start <= curr_datetime < self.stop:
+            return self.tariff.rate_at(curr_datetime)
+        seconds = (curr_datetime - self.start).total_seconds()
+        return self.__rate_list[bisect_right(self.__boundary_list, seconds) - 1]
+
+    def next_change(self, curr_datetime: datetime) -> datetime:
+        """
+        start of the interval after the one containing curr_datetime
+        """
+        seconds = (curr_datetime - self.start).total_seconds()
+        interval = bisect_right(self.__boundary_list, seconds)
+        if interval >= len(self.__boundary_list):
+            return max(self.stop, curr_datetime + timedelta(seconds=1))
+        return self.start + timedelta(seconds=self.__boundary_list[interval])
+
+    def intervals(self, num_steps: int, step_seconds: float, offset_seconds: float = 0) -> np.ndarray:
+        """
+        interval index of every step of a trace sampled every step_seconds
+        """
+        times = offset_seconds + np.arange(num_steps) * step_seconds
+        return np.searchsorted(self.boundaries, times, side="right") - 1
+
+    def prices(self, num_steps: int, step_seconds: float, offset_seconds: float = 0) -> np.ndarray:
+        return self.rates[self.intervals(num_steps, step_seconds, offset_seconds)]
+
+    def energy_cost(self, power_kw, step_seconds: float, offset_seconds: float = 0) -> float:
+        """
+        cost of drawing power_kw[i] kW over each step of a trace
+        """
+        power_kw = np.asarray(power_kw, dtype=float)
+        prices = self.prices(len(power_kw), step_seconds, offset_seconds)
+        return float(power_kw @ prices * step_seconds / 3600)
+
+    def demand_cost(self, power_kw, step_seconds: float, offset_seconds: float = 0) -> float:
+        """
+        demand charges of a trace: for every demand period and billing
+        month, the rate times the peak power drawn inside the window
+        """
+        power_kw = np.asarray(power_kw, dtype=float)
+        intervals = self.intervals(len(power_kw), step_seconds, offset_seconds)
+        windows = self.demand_windows[intervals]
+        months = self.billing_months[intervals]
+        total = 0.0
+        for month in np.unique(months):
+            in_month = months == month
+            # (demand periods,) peak of the masked trace
+            peaks = np.max(np.where(windows[in_month], power_kw[in_month, None], 0), axis=0, initial=0)
+            total += float(peaks @ self.demand_rates)
+        return total
+
+    def cost(self, power_kw, step_seconds: float, offset_seconds: float = 0) -> dict:
+        energy = self.energy_cost(power_kw, step_seconds, offset_seconds)
+        demand = self.demand_cost(power_kw, step_seconds, offset_seconds)
+        return {"energy": energy, "demand": demand, "total": energy + demand}
+
+
+if __name__ == "__main__":
+    import os
+    import timeit
+
+    path = os.path.join(os.path.dirname(__file__), "tariffs", "seasonal_tou.json")
+    start = datetime.fromisoformat('2024-10-01T00:00:00')
+    index = Tariff.load(path).compile(start, start + timedelta(days=31))
+    print(f"{index.tariff.name}: {len(index.boundaries)} intervals over October")
+
+    probe = start + timedelta(days=3, hours=19, minutes=30)
+    lookups = 100000
+    indexed = timeit.timeit(lambda: index.price_at(probe), number=lookups) / lookups
+    scanned = timeit.timeit(lambda: index.tariff.rate_at(probe), number=lookups) / lookups
+    print(f"price lookup: {indexed * 1e6:.2f} us indexed, {scanned * 1e6:.2f} us scanning periods")
+
+    # a month of depot load at one second resolution
+    trace = np.random.uniform(0, 500, 31 * 24 * 3600)
+    seconds = timeit.timeit(lambda: index.cost(trace, 1), number=1)
+    print(f"{index.cost(trace, 1)} for {len(trace)} samples in {seconds:.2f}s")
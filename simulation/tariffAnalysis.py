@@ -0,0 +1,175 @@
+"""
+Re-costing recorded power traces under many tariffs at once.
+
+Every compiled tariff is piecewise constant, so a trace only has to be
+reduced once onto the union of all tariffs' interval boundaries: the
+energy and the peak power of every trace in every segment. Energy
+charges of all (trace, tariff) pairs are then one matrix product of
+segment energy with segment rates. Demand charges take the peak of the
+segment peaks inside each demand window and billing month; variants
+that only change rates share windows, so each distinct window is
+reduced once however many tariffs use it.
+
+Traces are (traces, steps) kW arrays on a fixed step, such as the
+per-connector trace of DepotMeter.record_traces or a depot total.
+"""
+
+import copy
+import itertools
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from tariff import Tariff, TariffIndex, TariffPeriod
+
+
+class TariffMatrix:
+
+    def __init__(self, indices: list[TariffIndex], num_steps: int, step_seconds: float, offset_seconds: float = 0):
+        self.indices:      list[TariffIndex] = indices
+        self.num_steps:    int               = num_steps
+        self.step_seconds: float             = step_seconds
+        times = offset_seconds + np.arange(num_steps) * step_seconds
+        # first step of every segment of the union of all interval boundaries
+        boundaries = np.unique(np.concatenate([index.boundaries for index in indices]))
+        starts = np.searchsorted(times, boundaries, side="left")
+        self.segment_starts: np.ndarray = np.unique(np.concatenate(([0], starts[starts < num_steps])))
+        segment_times = times[self.segment_starts]
+
+        rates, masks, mask_rows = [], [], {}
+        charge_tariff, charge_mask, charge_rate = [], [], []
+        for v, index in enumerate(indices):
+            intervals = np.searchsorted(index.boundaries, segment_times, side="right") - 1
+            rates.append(index.rates[intervals])
+            windows = index.demand_windows[intervals]
+            months = index.billing_months[intervals]
+            for month in np.unique(months):
+                for d, demand_rate in enumerate(index.demand_rates):
+                    mask = windows[:, d] & (months == month)
+                    if not mask.any():
+                        continue
+                    key = mask.tobytes()
+                    if key not in mask_rows:
+                        mask_rows[key] = len(masks)
+                        masks.append(mask)
+                    charge_tariff.append(v)
+                    charge_mask.append(mask_rows[key])
+                    charge_rate.append(demand_rate)
+        num_segments = len(self.segment_starts)
+        self.segment_rates: np.ndarray = np.array(rates).reshape(len(indices), num_segments)  # (tariffs, segments) $/kWh
+        self.demand_masks:  np.ndarray = np.array(masks, dtype=bool).reshape(len(masks), num_segments)  # distinct windows
+        self.charge_tariff: np.ndarray = np.array(charge_tariff, dtype=int)    # tariff of every demand charge
+        self.charge_mask:   np.ndarray = np.array(charge_mask, dtype=int)      # window of every demand charge
+        self.charge_rate:   np.ndarray = np.array(charge_rate, dtype=float)    # $/kW
+
+    @classmethod
+    def from_tariffs(cls, tariffs: list[Tariff], start: datetime, num_steps: int, step_seconds: float) -> "TariffMatrix":
+        """
+        compile every tariff over a trace of num_steps steps from start
+        """
+        stop = start + timedelta(seconds=num_steps * step_seconds)
+        return cls([tariff.compile(start, stop) for tariff in tariffs], num_steps, step_seconds)
+
+    @property
+    def num_tariffs(self) -> int:
+        return len(self.indices)
+
+    def reduce(self, traces):
+        """
+        (traces, segments) kWh and peak kW of every trace in every segment
+        """
+        traces = np.atleast_2d(np.asarray(traces, dtype=float))
+        if traces.shape[1] != self.num_steps:
+            raise ValueError(f"Traces have {traces.shape[1]} steps, the tariffs were compiled for {self.num_steps}")
+        energy = np.add.reduceat(traces, self.segment_starts, axis=1) * self.step_seconds / 3600
+        peaks = np.maximum.reduceat(traces, self.segment_starts, axis=1)
+        return energy, peaks
+
+    def cost(self, traces) -> dict:
+        """
+        (traces, tariffs) energy, demand and total cost of every trace
+        under every tariff
+        """
+        energy, peaks = self.reduce(traces)
+        energy_cost = energy @ self.segment_rates.T
+        # (traces, distinct windows) peak inside each window
+        window_peaks = np.stack([np.max(peaks[:, mask], axis=1, initial=0) for mask in self.demand_masks], axis=1) \
+            if len(self.demand_masks) else np.zeros((len(peaks), 0))
+        demand_cost = np.zeros_like(energy_cost)
+        np.add.at(demand_cost.T, self.charge_tariff, (window_peaks[:, self.charge_mask] * self.charge_rate).T)
+        return {"energy": energy_cost, "demand": demand_cost, "total": energy_cost + demand_cost}
+
+    def print_metrics(self):
+        metrics = f"""
+        tariffs: {self.num_tariffs}
+        steps: {self.num_steps} of {self.step_seconds} s
+        segments: {len(self.segment_starts)}
+        distinct demand windows: {len(self.demand_masks)}
+        demand charges: {len(self.charge_rate)}
+        """
+        print(metrics)
+
+
+def scaled_variants(tariff: Tariff, energy_scales, demand_scales) -> list[Tariff]:
+    """
+    one copy of tariff for every pair of energy and demand rate scales
+    """
+    def scale(periods, factor) -> list[TariffPeriod]:
+        scaled = [copy.copy(period) for period in periods]
+        for period in scaled:
+            period.rate *= factor
+        return scaled
+
+    variants = []
+    for energy_scale, demand_scale in itertools.product(energy_scales, demand_scales):
+        energy = scale(tariff.energy_periods, energy_scale)
+        demand = scale(tariff.demand_periods, demand_scale)
+        variants.append(Tariff(f"{tariff.name} x{energy_scale:g} energy x{demand_scale:g} demand",
+                               tariff.default_rate * energy_scale, energy, demand))
+    return variants
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import time
+    from main import Main, START_TIME
+
+    tariff_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariffs")
+    base = Tariff.load(os.path.join(tariff_dir, "weekday_tou.json"))
+
+    # one simulated night, re-priced under the tariff it was metered with
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main = Main("naive", 8, 16, seed=0, adaptive=True, trace_seconds=1,
+                    tariff_path=os.path.join(tariff_dir, "weekday_tou.json"))
+        main.run_sim(plot=False)
+    night = main.sim_state.meter.power_trace()
+    matrix = TariffMatrix([main.sim_state.price_schedule.tariff_index], night.shape[1], 1)
+    recost = matrix.cost(night)["energy"].sum()
+    print(f"night re-costed ${recost:.2f}, metered ${main.sim_state.meter.cost:.2f}")
+
+    # a month of depot load: the night's total at one minute steps, repeated every day
+    minute_night = night.sum(axis=0)[:-1].reshape(-1, 60).mean(axis=1)
+    day = np.zeros(24 * 60)
+    first_minute = START_TIME.hour * 60
+    day[first_minute:] = minute_night[:len(day) - first_minute]
+    day[:len(minute_night) - (len(day) - first_minute)] = minute_night[len(day) - first_minute:]
+    rng = np.random.default_rng(0)
+    month_start = datetime.fromisoformat("2024-12-01T00:00:00")
+    month = np.tile(day, 31) * rng.uniform(0.8, 1.2, 31 * 24 * 60)
+
+    variants = scaled_variants(base, np.linspace(0.5, 1.5, 40), np.linspace(0, 2, 25))
+    begin = time.perf_counter()
+    matrix = TariffMatrix.from_tariffs(variants, month_start, len(month), 60)
+    compiled = time.perf_counter() - begin
+    begin = time.perf_counter()
+    totals = matrix.cost(month)["total"][0]
+    priced = time.perf_counter() - begin
+    print(f"{len(variants)} tariff variants: compiled in {compiled:.2f} s, priced a month in {priced * 1e3:.1f} ms")
+    matrix.print_metrics()
+
+    # spot check against pricing each tariff on its own
+    for v in (0, len(variants) // 2, len(variants) - 1):
+        single = matrix.indices[v].cost(month, 60)["total"]
+        print(f"{variants[v].name}: ${totals[v]:.2f} (single tariff ${single:.2f})")